@@ -0,0 +1,63 @@
+"""
+Vectorized versions of the `imagehash` algorithms which scale the image down to a small grayscale
+array, calculating the hashes of a batch of images in one pass over the stacked arrays
+"""
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from typing import Callable, Dict, List, Tuple
+
+import imagehash
+import numpy
+import scipy.fftpack
+from PIL import Image
+from imagehash import ImageHash
+
+from duplicate_images.function_types import HashFunction
+
+
+def phash(pixels: numpy.ndarray, hash_size: int) -> numpy.ndarray:
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=1), axis=2)
+    low_frequencies = dct[:, :hash_size, :hash_size]
+    medians = numpy.median(low_frequencies.reshape(len(pixels), -1), axis=1)
+    return low_frequencies > medians[:, None, None]
+
+
+# (width, height) `imagehash` resizes the image to for a hash size
+BATCH_INPUT_SIZE: Dict[Callable, Callable[[int], Tuple[int, int]]] = {
+    imagehash.average_hash: lambda hash_size: (hash_size, hash_size),
+    imagehash.phash: lambda hash_size: (4 * hash_size, 4 * hash_size),
+    imagehash.dhash: lambda hash_size: (hash_size + 1, hash_size),
+    imagehash.dhash_vertical: lambda hash_size: (hash_size, hash_size + 1),
+}
+
+# the hash bits of a stack of resized images, as a boolean array of shape (images, rows, columns)
+BATCH_HASH_FUNCTION: Dict[Callable, Callable[[numpy.ndarray, int], numpy.ndarray]] = {
+    # the sum of integer pixel values is exact, so the mean is the same as for single images
+    imagehash.average_hash: lambda pixels, _: pixels > pixels.mean(axis=(1, 2), keepdims=True),
+    imagehash.phash: phash,
+    imagehash.dhash: lambda pixels, _: pixels[:, :, 1:] > pixels[:, :, :-1],
+    imagehash.dhash_vertical: lambda pixels, _: pixels[:, 1:, :] > pixels[:, :-1, :],
+}
+
+
+def resized_pixels(
+        image: Image.Image, algorithm: HashFunction, hash_size_kwargs: Dict
+) -> numpy.ndarray:
+    """The pixels of image scaled down the same way `imagehash` does for algorithm"""
+    hash_size = hash_size_kwargs.get('hash_size', 8)
+    if hash_size < 2:
+        raise ValueError('Hash size must be greater than or equal to 2')
+    return numpy.asarray(
+        image.convert('L').resize(BATCH_INPUT_SIZE[algorithm](hash_size), Image.Resampling.LANCZOS)
+    )
+
+
+def hash_pixels(
+        pixels: List[numpy.ndarray], algorithm: HashFunction, hash_size_kwargs: Dict
+) -> List[ImageHash]:
+    """
+    The hashes of the images scaled down by `resized_pixels()`, identical to the ones `imagehash`
+    calculates for each image
+    """
+    bits = BATCH_HASH_FUNCTION[algorithm](numpy.stack(pixels), hash_size_kwargs.get('hash_size', 8))
+    return [ImageHash(image_bits) for image_bits in bits]
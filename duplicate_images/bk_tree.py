@@ -0,0 +1,68 @@
+"""
+Metric tree for finding image hashes within a given Hamming distance of each other
+"""
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from typing import Dict, List, Optional
+
+
+def hamming_distance(value: int, other: int) -> int:
+    return (value ^ other).bit_count()
+
+
+class BKTreeNode:  # pylint: disable=too-few-public-methods
+    """
+    Node of a `BKTree`, holding all items sharing the same hash value and the
+    subtrees at each distance from that value
+    """
+    __slots__ = ('value', 'items', 'children')
+
+    def __init__(self, value: int, item: int) -> None:
+        self.value = value
+        self.items: List[int] = [item]
+        self.children: Dict[int, 'BKTreeNode'] = {}
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over the Hamming distance between integer-encoded
+    image hashes. Finding all hashes within distance `d` of a given hash only
+    visits the subtrees whose distance to a node is within `d` of the distance
+    between node and the hash searched for, instead of all stored hashes.
+    """
+
+    def __init__(self) -> None:
+        self.root: Optional[BKTreeNode] = None
+
+    def add(self, value: int, item: int) -> None:
+        if self.root is None:
+            self.root = BKTreeNode(value, item)
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node.value)
+            if distance == 0:
+                node.items.append(item)
+                return
+            child = node.children.get(distance)
+            if child is None:
+                node.children[distance] = BKTreeNode(value, item)
+                return
+            node = child
+
+    def find(self, value: int, max_distance: int) -> List[int]:
+        """Returns all items whose value is at most max_distance away from value"""
+        if self.root is None:
+            return []
+        found: List[int] = []
+        candidates = [self.root]
+        while candidates:
+            node = candidates.pop()
+            distance = hamming_distance(value, node.value)
+            if distance <= max_distance:
+                found.extend(node.items)
+            candidates.extend(
+                child for child_distance, child in node.children.items()
+                if abs(child_distance - distance) <= max_distance
+            )
+        return found
@@ -3,16 +3,128 @@ Functions used in multiple places
 """
 __author__ = 'Lene Preuss <lene.preuss@gmail.com>'
 
+import json
 import logging
-from functools import wraps
+import mmap
+from functools import lru_cache, wraps
 from pathlib import Path
+from queue import Empty, Full, Queue
+from threading import Event, Thread
 from time import time
+from typing import IO, Dict, Generator, Iterable, List, Tuple, TypeVar
+
+from imagehash import ImageHash
+from numpy import packbits
 
 
 def path_with_parent(path: Path) -> str:
     return '/'.join(str(path).rstrip('/').split('/')[-2:])
 
 
+@lru_cache(maxsize=65536)
+def resolved_directory(directory: Path) -> Path:
+    return directory.resolve()
+
+
+def resolved_file(file: Path) -> Path:
+    """
+    Absolute path of file with all symlinks in its directory resolved. Only the
+    directory is resolved, once per directory, so that files in the same
+    directory do not each need a filesystem lookup for every path component.
+    """
+    return resolved_directory(file.parent.absolute()) / file.name
+
+
+def encode_path(path: Path) -> bytes:
+    return str(path).encode('utf-8', 'surrogateescape')
+
+
+def decode_path(path: bytes) -> Path:
+    return Path(path.decode('utf-8', 'surrogateescape'))
+
+
+def aligned(size: int, alignment: int = 8) -> int:
+    return size + -size % alignment
+
+
+# size of the header length field following the magic bytes of the binary file formats
+HEADER_SIZE = 8
+
+
+def write_header(file: IO, magic: bytes, header: Dict) -> None:
+    """Writes magic, the size of the JSON encoded header and the header, padded to 8 bytes"""
+    encoded = json.dumps(header).encode()
+    encoded += b' ' * (aligned(len(encoded)) - len(encoded))
+    file.write(magic)
+    file.write(len(encoded).to_bytes(HEADER_SIZE, 'little'))
+    file.write(encoded)
+
+
+def read_header(data: mmap.mmap, magic: bytes) -> Tuple[Dict, int]:
+    """The header written by `write_header()` and the offset of the data following it"""
+    start = len(magic) + HEADER_SIZE
+    size = int.from_bytes(data[len(magic):start], 'little')
+    return json.loads(data[start:start + size]), start + size
+
+
+def hash_as_int(image_hash: ImageHash) -> int:
+    """Encodes the bits of an image hash as an integer, for fast Hamming distance calculation"""
+    return int.from_bytes(bytes(packbits(image_hash.hash.flatten())), 'big')
+
+
+T = TypeVar('T')
+
+# seconds to wait for the queue in `prefetched()` before checking whether to stop
+PREFETCH_POLL_INTERVAL = 0.1
+
+
+def prefetched(items: Iterable[T], size: int) -> Generator[T, None, None]:
+    """
+    Yields items, which are produced in a background thread while the consumer
+    processes them, up to size items ahead of the consumer. Exceptions raised
+    by the producer are raised in the consumer.
+    """
+    queue: Queue = Queue(maxsize=size)
+    stopped = Event()
+    errors: List[BaseException] = []
+
+    def put(item: T) -> bool:
+        while not stopped.is_set():
+            try:
+                queue.put((item,), timeout=PREFETCH_POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as error:  # pylint: disable=broad-exception-caught
+            errors.append(error)
+        finally:
+            stopped.set()
+
+    producer = Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            try:
+                (item,) = queue.get(timeout=PREFETCH_POLL_INTERVAL)
+            except Empty:
+                if stopped.is_set() and queue.empty():
+                    break
+                continue
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+    if errors:
+        raise errors[0]
+
+
 def log_execution_time():
     def actual_decorator(method):
         @wraps(method)
@@ -0,0 +1,126 @@
+"""
+Finding byte-identical copies of image files, so that the image hash is only calculated once for
+all copies
+"""
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+import hashlib
+from concurrent.futures import Future
+from os import SEEK_END
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from duplicate_images.function_types import Hash
+
+# bytes read from the start and from the end of a file for the partial digest
+PARTIAL_DIGEST_SIZE = 64 * 1024
+
+
+def partial_digest(file: Path) -> bytes:
+    """BLAKE2b digest of the first and last `PARTIAL_DIGEST_SIZE` bytes of file"""
+    digest = hashlib.blake2b()
+    with file.open('rb') as opened:
+        digest.update(opened.read(PARTIAL_DIGEST_SIZE))
+        if opened.seek(0, SEEK_END) > 2 * PARTIAL_DIGEST_SIZE:
+            opened.seek(-PARTIAL_DIGEST_SIZE, SEEK_END)
+        else:
+            opened.seek(PARTIAL_DIGEST_SIZE)
+        digest.update(opened.read(PARTIAL_DIGEST_SIZE))
+    return digest.digest()
+
+
+def full_digest(file: Path) -> bytes:
+    with file.open('rb') as opened:
+        return hashlib.file_digest(opened, 'blake2b').digest()
+
+
+class NullCopyDetector:
+    """Copy detector that considers all files different"""
+
+    def original_of(self, _: Path) -> Optional[Path]:
+        return None
+
+    def set_hashes(self, _: Path, __: List[Optional[Hash]]) -> None:
+        pass
+
+    def is_resolved(self, _: Path) -> bool:
+        return True
+
+    def hashes_of(self, _: Path) -> List[Optional[Hash]]:
+        return []
+
+
+class CopyDetector(NullCopyDetector):
+    """
+    Finds byte-identical copies among the files passed to `original_of()`. Files are compared by
+    size first, then by a digest of their first and last 64 KiB, and only then by a digest of their
+    complete content, so files with a unique size are not read at all and files with a unique
+    partial digest only partially. The hashes calculated for the first file with a given content
+    are used for all its copies.
+    The first file found for a size, a size and partial digest, or a size and both digests is
+    looked up by these keys. It is only digested further once another file with the same key is
+    found, and the files are read without holding the lock.
+    """
+
+    def __init__(self) -> None:
+        self.firsts: Dict[Tuple[Union[int, bytes], ...], Path] = {}
+        self.partial_digests: Dict[Path, bytes] = {}
+        self.full_digests: Dict[Path, bytes] = {}
+        self.hashes: Dict[Path, Future] = {}
+        self.num_copies = 0
+        self.lock = Lock()
+
+    def original_of(self, file: Path) -> Optional[Path]:
+        """
+        An earlier file with the same content as file, whose hashes are used for file, or None if
+        file is the first with its content and its hashes must be passed to `set_hashes()`
+        """
+        try:
+            key: Tuple[Union[int, bytes], ...] = (file.stat().st_size,)
+            for function, digests in (
+                    (partial_digest, self.partial_digests), (full_digest, self.full_digests)
+            ):
+                first = self.first_with_key(key, file)
+                if first == file:
+                    return None
+                # the first file moves on to the next key before file, so it stays the original
+                try:
+                    self.first_with_key(key + (self.digest(first, function, digests),), first)
+                except OSError:
+                    pass
+                key += (self.digest(file, function, digests),)
+        except OSError:
+            with self.lock:
+                self.hashes.setdefault(file, Future())
+            return None
+        original = self.first_with_key(key, file)
+        if original == file:
+            return None
+        with self.lock:
+            self.num_copies += 1
+        return original
+
+    def first_with_key(self, key: Tuple[Union[int, bytes], ...], file: Path) -> Path:
+        """The first file found with key, which is file if there was none yet"""
+        with self.lock:
+            first = self.firsts.setdefault(key, file)
+            if first == file:
+                self.hashes.setdefault(file, Future())
+        return first
+
+    @staticmethod
+    def digest(file: Path, function: Callable[[Path], bytes], digests: Dict[Path, bytes]) -> bytes:
+        if file not in digests:
+            digests[file] = function(file)
+        return digests[file]
+
+    def set_hashes(self, file: Path, hashes: List[Optional[Hash]]) -> None:
+        self.hashes[file].set_result(hashes)
+
+    def is_resolved(self, original: Path) -> bool:
+        return self.hashes[original].done()
+
+    def hashes_of(self, original: Path) -> List[Optional[Hash]]:
+        """The hashes of original, waiting for them if they are still being calculated"""
+        return self.hashes[original].result()
@@ -5,23 +5,27 @@ The main script for the `find-dups` command line tool.
 
 import logging
 import re
+import sys
 from argparse import Namespace
+from contextlib import contextmanager
 from multiprocessing.pool import ThreadPool
-from os import walk, access, R_OK
+from os import O_WRONLY, R_OK, access, devnull, dup2, open as open_file, scandir
 from pathlib import Path
-from typing import Callable, List, Optional
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 
 import PIL.Image
 from filetype import guess
 from pillow_heif import is_supported, register_heif_opener
 
-from duplicate_images.common import path_with_parent, log_execution_time
+from duplicate_images.common import path_with_parent, log_execution_time, prefetched
 from duplicate_images.function_types import Results, ImageGroup, ActionFunction
 from duplicate_images.hash_store import FileHashStore
 from duplicate_images.image_pair_finder import ImagePairFinder, PairFinderOptions
 from duplicate_images.log import setup_logging
 from duplicate_images.methods import ACTIONS_ON_EQUALITY, IMAGE_HASH_ALGORITHM, get_hash_size_kwargs
+from duplicate_images.pair_finder_options import reduced_resolution_metadata
 from duplicate_images.parse_commandline import parse_command_line
+from duplicate_images.thumbnail_cache import ThumbnailCache
 
 try:
     register_heif_opener()
@@ -30,22 +34,100 @@ except ImportError as error:
     logging.warning('See https://github.com/lene/DuplicateImages/issues/11 for details')
 
 
+# number of bytes at the start of a file needed to recognize all file types known to `filetype`
+FILE_HEADER_SIZE = 8192
+IMAGE_EXTENSIONS = frozenset({
+    '.avif', '.bmp', '.gif', '.heic', '.heif', '.hif', '.jfif', '.jpe', '.jpeg', '.jpg', '.png',
+    '.tif', '.tiff', '.webp'
+})
+
+
 def is_image_file(filename: Path) -> bool:
     """Returns True if filename is a readable image file"""
     try:
         if access(filename, R_OK) and not filename.is_symlink():
-            # Check for HEIF support first, as filetype.guess() doesn't recognize HEIF
-            if is_supported(filename):
-                return True
-            kind = guess(filename)
-            return kind is not None and kind.mime.startswith('image/')
+            with open(filename, 'rb') as file:
+                return is_image_header(file.read(FILE_HEADER_SIZE))
     except OSError as err:
         logging.warning('Skipping %s: %s', path_with_parent(filename), err)
     return False
 
 
-def folder_matches(filename: Path, regex: re.Pattern) -> bool:
-    return bool(re.search(regex, str(filename.parent)))
+def is_image_header(header: bytes) -> bool:
+    # Check for HEIF support first, as filetype.guess() doesn't recognize HEIF
+    if is_supported(header):
+        return True
+    kind = guess(header)
+    return kind is not None and kind.mime.startswith('image/')
+
+
+def has_image_extension(filename: Path) -> bool:
+    """
+    Returns True if filename has a known image file extension and is not a symlink, without
+    reading it - whether it is an image is only found out when decoding it. Files with other
+    extensions are checked with `is_image_file()`.
+    """
+    if filename.suffix.lower() in IMAGE_EXTENSIONS:
+        return not filename.is_symlink()
+    return is_image_file(filename)
+
+
+# number of threads listing directories and checking files, which is mostly waiting for I/O
+WALK_THREADS = 16
+# maximum number of image files found but not yet hashed
+PREFETCH_FILES = 10000
+
+
+def folder_matches(folder: Path, regexes: List[re.Pattern]) -> bool:
+    folder_name = str(folder)
+    return any(regex.search(folder_name) for regex in regexes)
+
+
+def scan_folder(
+        folder: Path, is_relevant: Callable[[Path], bool], exclude_regexes: List[re.Pattern]
+) -> Tuple[List[Path], List[Path]]:
+    """
+    Returns the files in folder which satisfy the condition is_relevant, unless folder matches any
+    of exclude_regexes, and the subfolders of folder. Like `os.walk()`, does not descend into
+    symlinks to folders and ignores folders which cannot be read.
+    """
+    files: List[Path] = []
+    subfolders: List[Path] = []
+    try:
+        with scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subfolders.append(Path(entry.path))
+                else:
+                    files.append(Path(entry.path))
+    except OSError:
+        return [], []
+    if folder_matches(folder, exclude_regexes):
+        return [], subfolders
+    return [file for file in files if is_relevant(file)], subfolders
+
+
+def walk_files(
+        dir_names: List[Path], is_relevant: Callable[[Path], bool] = lambda f: f.is_file(),
+        exclude_regexes: Optional[List[str]] = None, threads: int = WALK_THREADS
+) -> Iterator[Path]:
+    """
+    Yields all files in the directories dir_names and their subdirectories which satisfy the
+    condition is_relevant, in no particular order. The directories on each level of the tree are
+    listed and their files checked in parallel threads.
+    """
+    exclude_compiled = [re.compile(regex) for regex in exclude_regexes or []]
+    folders = [Path(dir_name) for dir_name in dir_names]
+    with ThreadPool(threads) as pool:
+        while folders:
+            subfolders: List[Path] = []
+            for files, folder_subfolders in pool.imap_unordered(
+                    lambda folder: scan_folder(folder, is_relevant, exclude_compiled), folders
+            ):
+                subfolders.extend(folder_subfolders)
+                yield from files
+            folders = subfolders
 
 
 @log_execution_time()
@@ -58,44 +140,89 @@ def files_in_dirs(
     satisfy the condition is_file. If exclude_regexes is given, files in directories matching any
     of the regular expressions are excluded.
     """
-    exclude_compiled = [re.compile(regex) for regex in exclude_regexes or []]
-    unfiltered = (
-        Path(root) / filename
-        for dir_name in dir_names
-        for root, _, filenames in walk(dir_name)
-        for filename in filenames
-        if not any(folder_matches(Path(root) / filename, regex) for regex in exclude_compiled)
-    )
-    # astonishingly, filtering in a separate step is faster than in the generator expression
-    return [file for file in unfiltered if is_relevant(file)]
+    return list(walk_files(dir_names, is_relevant, exclude_regexes))
 
 
-def get_matches(
+def get_matches(  # pylint: disable = too-many-arguments,too-many-positional-arguments
         root_directories: List[Path], algorithm: str,
         options: PairFinderOptions = PairFinderOptions(),
         hash_store_path: Optional[Path] = None,
-        exclude_regexes: Optional[List[str]] = None
+        exclude_regexes: Optional[List[str]] = None,
+        thumbnail_cache_path: Optional[Path] = None
 ) -> Results:
+    with create_pair_finder(
+            root_directories, algorithm, options, hash_store_path, exclude_regexes,
+            thumbnail_cache_path
+    ) as finder:
+        return finder.get_equal_groups()
+
+
+def stream_matches(  # pylint: disable = too-many-arguments,too-many-positional-arguments
+        root_directories: List[Path], algorithm: str,
+        options: PairFinderOptions = PairFinderOptions(),
+        hash_store_path: Optional[Path] = None,
+        exclude_regexes: Optional[List[str]] = None,
+        thumbnail_cache_path: Optional[Path] = None
+) -> Iterator[ImageGroup]:
+    """
+    Yields the matches, with `options.stream` while the images are still being scanned, otherwise
+    after all of them have been scanned
+    """
+    with create_pair_finder(
+            root_directories, algorithm, options, hash_store_path, exclude_regexes,
+            thumbnail_cache_path
+    ) as finder:
+        yield from finder.matches()
+
+
+@contextmanager
+def create_pair_finder(  # pylint: disable = too-many-arguments,too-many-positional-arguments
+        root_directories: List[Path], algorithm: str, options: PairFinderOptions,
+        hash_store_path: Optional[Path], exclude_regexes: Optional[List[str]],
+        thumbnail_cache_path: Optional[Path] = None
+) -> Iterator[ImagePairFinder]:
+    """
+    Creates the `ImagePairFinder` for the image files, with the hash store and thumbnail cache open
+    """
     hash_algorithm = IMAGE_HASH_ALGORITHM[algorithm]
     hash_size_kwargs = get_hash_size_kwargs(hash_algorithm, options.hash_size)
-    image_files = files_in_dirs(root_directories, is_image_file, exclude_regexes)
-    logging.info('%d total files', len(image_files))
-    image_files.sort()
+    # hash the image files while still looking for more of them, the results are sorted later
+    image_files = prefetched(
+        walk_files(
+            root_directories, has_image_extension if options.trust_extensions else is_image_file,
+            exclude_regexes
+        ),
+        PREFETCH_FILES
+    )
     logging.info('Computing image hashes')
 
-    with FileHashStore.create(hash_store_path, algorithm, hash_size_kwargs) as hash_store:
-        return ImagePairFinder.create(
+    with FileHashStore.create(
+            hash_store_path, algorithm, {**hash_size_kwargs, **reduced_resolution_metadata(options)}
+    ) as hash_store, ThumbnailCache.create(
+        thumbnail_cache_path, options.thumbnail_size
+    ) as thumbnails:
+        if options.search_index and options.new_only:
+            hash_store.open_search_index(options.max_distance)
+        yield ImagePairFinder.create(
             image_files, hash_algorithm, options=options, hash_store=hash_store,
-        ).get_equal_groups()
+            thumbnails=thumbnails
+        )
 
 
-def execute_actions(matches: Results, args: Namespace) -> None:
+def execute_actions(matches: Iterable[ImageGroup], args: Namespace) -> None:
+    """
+    Executes the action on all matches in the order given, which is sorted for `Results` and the
+    order they are found in with `--stream`. The matches are only iterated over once, so they are
+    never all held in memory if they are generated lazily.
+    """
     action_equal = ACTIONS_ON_EQUALITY[args.on_equal]
     if args.parallel_actions:
         with ThreadPool(args.parallel_actions) as pool:
-            pool.map(lambda group: execute_action(action_equal, group, args), matches)
+            # imap() instead of map(), which would make a list of all matches before starting
+            for _ in pool.imap(lambda group: execute_action(action_equal, group, args), matches):
+                pass
     else:
-        for group in sorted(matches):
+        for group in matches:
             execute_action(action_equal, group, args)
 
 
@@ -104,6 +231,9 @@ def execute_action(action: ActionFunction, group: ImageGroup, args: Namespace) -
         action(args, group)
     except FileNotFoundError:
         pass
+    if args.stream:
+        # make the output available to a pipe while the scan is still running
+        sys.stdout.flush()
 
 
 def set_max_image_pixels(args: Namespace) -> None:
@@ -121,16 +251,30 @@ def main() -> None:
             'Scanning %s %s', path_with_parent(folder),
             f'(excluding {', '.join(args.exclude_dir)})' if args.exclude_dir else ''
         )
+    root_directories = [Path(folder) for folder in args.root_directory]
+    hash_store_path = Path(args.hash_db) if args.hash_db else None
+    exclude_regexes = list(args.exclude_dir) if args.exclude_dir else None
+    thumbnail_cache_path = Path(args.thumbnail_cache) if args.thumbnail_cache else None
     try:
-        matches = get_matches(
-            [Path(folder) for folder in args.root_directory], args.algorithm,
-            options=options, hash_store_path=Path(args.hash_db) if args.hash_db else None,
-            exclude_regexes=list(args.exclude_dir) if args.exclude_dir else None
-        )
-        logging.info('%d matches', len(matches))
-        execute_actions(matches, args)
+        if args.stream:
+            execute_actions(
+                stream_matches(
+                    root_directories, args.algorithm, options, hash_store_path, exclude_regexes,
+                    thumbnail_cache_path
+                ), args
+            )
+        else:
+            matches = get_matches(
+                root_directories, args.algorithm, options, hash_store_path, exclude_regexes,
+                thumbnail_cache_path
+            )
+            logging.info('%d matches', len(matches))
+            execute_actions(matches, args)
     except KeyboardInterrupt:
         pass
+    except BrokenPipeError:
+        # the program reading the output, e.g. `head`, has exited - discard the remaining output
+        dup2(open_file(devnull, O_WRONLY), sys.stdout.fileno())
 
 
 if __name__ == '__main__':
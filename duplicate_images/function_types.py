@@ -5,6 +5,7 @@ Shorter and more descriptive type aliases used in static type checking for the
 __author__ = 'Lene Preuss <lene.preuss@gmail.com>'
 
 from argparse import Namespace
+from collections.abc import Collection
 from pathlib import Path
 from typing import Any, Callable, Dict, List, Optional, Tuple, Generator, Union
 
@@ -15,7 +16,8 @@ Hash = Union[ImageHash, ImageMultiHash]
 HashFunction = Callable[[Image.Image], Hash]
 ImageGroup = Tuple[Path, ...]
 ActionFunction = Callable[[Namespace, ImageGroup], Any]
-Results = List[ImageGroup]
+# results are sorted, and are iterated lazily if there can be many more of them than images
+Results = Collection[ImageGroup]
 ResultsGenerator = Generator[List[Path], None, None]
 ResultsGrouper = Callable[[ResultsGenerator], Results]
 CacheEntry = Tuple[Path, Optional[Hash]]
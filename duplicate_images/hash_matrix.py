@@ -0,0 +1,144 @@
+"""
+Vectorized Hamming distance calculation on image hashes packed into a matrix
+"""
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+import logging
+from contextlib import contextmanager
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy
+from imagehash import ImageHash
+
+# upper bound for the number of 64 bit words XORed in one step, keeps memory use around 64 MB
+BLOCK_WORDS = 8 * 1024 * 1024
+# below this number of hashes, starting worker processes takes longer than comparing the hashes
+PARALLEL_MIN_HASHES = 20000
+# more shards than processes, so that processes finishing early can take over remaining shards
+SHARDS_PER_PROCESS = 4
+
+# the hash matrix in worker processes, attached to the shared memory by `attach_matrix()`
+worker_memory: Optional[SharedMemory] = None  # pylint: disable=invalid-name
+worker_matrix = numpy.zeros((0, 1), dtype=numpy.uint64)
+
+
+def pack_hashes(hashes: Sequence[ImageHash]) -> numpy.ndarray:
+    """
+    Packs the bits of each hash into a row of 64 bit words, giving a contiguous
+    matrix of shape (len(hashes), ceil(hash bits / 64))
+    """
+    if not hashes:
+        return numpy.zeros((0, 1), dtype=numpy.uint64)
+    bits = numpy.stack([image_hash.hash.flatten() for image_hash in hashes])
+    packed = numpy.packbits(bits, axis=1)
+    padding = -packed.shape[1] % 8
+    if padding:
+        packed = numpy.pad(packed, ((0, 0), (0, padding)))
+    return numpy.ascontiguousarray(packed).view(numpy.uint64)
+
+
+def distances(rows: numpy.ndarray, matrix: numpy.ndarray) -> numpy.ndarray:
+    """Hamming distances between each of rows and each row of matrix"""
+    return numpy.bitwise_count(rows[:, None, :] ^ matrix[None, :, :]).sum(axis=2, dtype=numpy.int32)
+
+
+def block_size(num_rows: int, num_words: int) -> int:
+    return max(1, BLOCK_WORDS // max(1, num_rows * num_words))
+
+
+def matching_pairs(
+        matrix: numpy.ndarray, max_distance: int, start: int = 0, end: int = -1
+) -> Iterator[Tuple[int, int]]:
+    """
+    Yields all index pairs (i, j), i < j, of rows in matrix at most max_distance
+    apart, ordered by i, then j. Only rows i in the range [start, end) are
+    compared to the rows following them.
+    """
+    end = len(matrix) if end < 0 else end
+    step = block_size(len(matrix) - start, matrix.shape[1])
+    for block_start in range(start, end, step):
+        block_end = min(block_start + step, end)
+        block_distances = distances(matrix[block_start:block_end], matrix[block_start:])
+        rows, columns = numpy.nonzero(block_distances <= max_distance)
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            if column > row:
+                yield block_start + row, block_start + column
+
+
+def shards(num_rows: int, num_shards: int, end: int = -1) -> List[Tuple[int, int]]:
+    """
+    Splits the rows [0, end) of a matrix of num_rows rows into num_shards ranges [start, end), or
+    fewer if there are not enough rows, in which about the same number of pairs (i, j), i < j, are
+    compared by `matching_pairs()`
+    """
+    end = num_rows if end < 0 else end
+    if not end:
+        return []
+    cumulative_pairs = numpy.cumsum(numpy.arange(num_rows - 1, num_rows - 1 - end, -1))
+    total = int(cumulative_pairs[-1])
+    targets = [total * shard / num_shards for shard in range(1, num_shards)]
+    bounds = [0, *(numpy.searchsorted(cumulative_pairs, targets) + 1).tolist(), end]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+@contextmanager
+def shared_copy(matrix: numpy.ndarray) -> Iterator[SharedMemory]:
+    """A copy of matrix in shared memory, which is released afterwards"""
+    memory = SharedMemory(create=True, size=max(1, matrix.nbytes))
+    try:
+        numpy.ndarray(matrix.shape, dtype=matrix.dtype, buffer=memory.buf)[:] = matrix
+        yield memory
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def attach_matrix(name: str, shape: Tuple[int, int]) -> None:
+    global worker_memory, worker_matrix  # pylint: disable=global-statement
+    worker_memory = SharedMemory(name=name)
+    worker_matrix = numpy.ndarray(shape, dtype=numpy.uint64, buffer=worker_memory.buf)
+
+
+def shard_matching_pairs(shard: Tuple[int, int, int]) -> List[Tuple[int, int]]:
+    start, end, max_distance = shard
+    return list(matching_pairs(worker_matrix, max_distance, start, end))
+
+
+def parallel_matching_pairs(
+        matrix: numpy.ndarray, max_distance: int, processes: int, end: int = -1
+) -> List[Tuple[int, int]]:
+    """
+    The same pairs as `matching_pairs()`, in the same order, calculated in processes sharing the
+    matrix in shared memory, each comparing the rows in shards of about the same number of pairs
+    """
+    matrix_shards = shards(len(matrix), SHARDS_PER_PROCESS * processes, end)
+    logging.info(
+        'Comparing %d hashes in %d shards with %d processes',
+        len(matrix), len(matrix_shards), processes
+    )
+    with shared_copy(matrix) as memory, get_context('spawn').Pool(
+            processes, initializer=attach_matrix, initargs=(memory.name, matrix.shape)
+    ) as pool:
+        # imap() returns the shards in order, so the pairs are ordered as in matching_pairs()
+        return [
+            pair
+            for pairs in pool.imap(
+                shard_matching_pairs, [(start, end, max_distance) for start, end in matrix_shards]
+            )
+            for pair in pairs
+        ]
+
+
+def matching_indices(
+        hashes: List[ImageHash], max_distance: int, processes: int = 1, end: int = -1
+) -> List[Tuple[int, int]]:
+    """
+    Index pairs (i, j), i < j, of the hashes at most max_distance apart, for the hashes i in the
+    range [0, end)
+    """
+    matrix = pack_hashes(hashes)
+    if processes > 1 and len(matrix) >= PARALLEL_MIN_HASHES:
+        return parallel_matching_pairs(matrix, max_distance, processes, end)
+    return list(matching_pairs(matrix, max_distance, 0, end))
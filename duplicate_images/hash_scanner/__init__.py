@@ -4,5 +4,6 @@ Functionality to compute and store the image hashes of a set of images
 __author__ = 'Lene Preuss <lene.preuss@gmail.com>'
 
 from duplicate_images.hash_scanner.image_hash_scanner import (
-    ImageHashScanner, ParallelImageHashScanner
+    PARALLEL_SCANNERS, ImageHashScanner, ParallelImageHashScanner, ProcessImageHashScanner
 )
+from duplicate_images.hash_scanner.image_hasher import ImageHasher
@@ -5,103 +5,311 @@ __author__ = 'Lene Preuss <lene.preuss@gmail.com>'
 
 import logging
 import os
-
+from collections import deque
+from collections.abc import Sized
+from itertools import batched, chain
+from multiprocessing import get_context
 from multiprocessing.pool import ThreadPool
 from pathlib import Path
-from typing import List, Optional, Dict
+from typing import Deque, Iterable, Iterator, List, Optional, Dict, Tuple, Type
 
 from PIL import Image
-from PIL.Image import DecompressionBombError
 
-from duplicate_images.common import path_with_parent
-from duplicate_images.function_types import CacheEntry, HashFunction
+from duplicate_images.copy_detector import CopyDetector, NullCopyDetector
+from duplicate_images.function_types import CacheEntry, Hash, HashFunction
+from duplicate_images.hash_scanner.image_hasher import (
+    ImageHasher, PackedResult, initialize_worker, unpack_hash
+)
 from duplicate_images.hash_store import HashStore, NullHashStore
-from duplicate_images.methods import get_hash_size_kwargs
-from duplicate_images.pair_finder_options import PairFinderOptions
+from duplicate_images.memory_budget import MemoryBudget, NullMemoryBudget
+from duplicate_images.methods import IMAGE_HASH_ALGORITHM, get_draft_size, get_hash_size_kwargs
+from duplicate_images.pair_finder_options import PairFinderOptions, reduced_resolution_metadata
 from duplicate_images.progress_bar_manager import ProgressBarManager, NullProgressBarManager
+from duplicate_images.thumbnail_cache import NullThumbnailCache
 
 
-class ImageHashScanner:
+class ImageHashScanner:  # pylint: disable = too-many-instance-attributes
     """
-    Reads images from the given list of files and calculates their image hashes,
-    using a single thread only
+    Reads images from the given files and calculates their image hashes,
+    using a single thread only. The files may be any iterable, so that hashes
+    can be calculated while the files are still being found.
     """
 
     @staticmethod
-    def create(
-            files: List[Path], hash_algorithm: HashFunction,
+    def create(  # pylint: disable = too-many-arguments,too-many-positional-arguments
+            files: Iterable[Path], hash_algorithm: HashFunction,
             options: PairFinderOptions,
             hash_store: HashStore = NullHashStore(),
-            progress_bars: ProgressBarManager = NullProgressBarManager()
+            progress_bars: ProgressBarManager = NullProgressBarManager(),
+            thumbnails: NullThumbnailCache = NullThumbnailCache()
     ) -> 'ImageHashScanner':
         hash_size_kwargs = get_hash_size_kwargs(hash_algorithm, options.hash_size)
         if not options.parallel:
             return ImageHashScanner(
-                files, hash_algorithm, hash_size_kwargs, hash_store, progress_bars
+                files, hash_algorithm, hash_size_kwargs, hash_store, progress_bars, options,
+                thumbnails=thumbnails
             )
-        return ParallelImageHashScanner(
+        scanner_class = PARALLEL_SCANNERS[options.parallel_mode]
+        return scanner_class(
             files, hash_algorithm, hash_size_kwargs, hash_store, progress_bars,
-            options.parallel
+            options.parallel, options, thumbnails=thumbnails
         )
 
     def __init__(  # pylint: disable = too-many-arguments,too-many-positional-arguments
-            self, files: List[Path], hash_algorithm: HashFunction,
+            self, files: Iterable[Path], hash_algorithm: HashFunction,
             hash_size_kwargs: Optional[Dict] = None,
             hash_store: HashStore = NullHashStore(),
-            progress_bars: ProgressBarManager = NullProgressBarManager()
+            progress_bars: ProgressBarManager = NullProgressBarManager(),
+            options: PairFinderOptions = PairFinderOptions(),
+            *, thumbnails: NullThumbnailCache = NullThumbnailCache()
     ) -> None:
         self.files = files
         self.algorithm = hash_algorithm
         self.hash_size_kwargs = hash_size_kwargs if hash_size_kwargs is not None else {}
         self.hash_store = hash_store
         self.progress_bars = progress_bars
+        self.thumbnails = thumbnails
+        self.copies = CopyDetector() if options.detect_copies else NullCopyDetector()
+        self.batch_hashing = options.batch_hashing
+        self.memory_budget = MemoryBudget(options.memory_budget * 2 ** 20) \
+            if options.memory_budget else NullMemoryBudget()
+        additional_algorithms = [
+            (name, IMAGE_HASH_ALGORITHM[name],
+             get_hash_size_kwargs(IMAGE_HASH_ALGORITHM[name], options.hash_size))
+            for name in options.additional_algorithms
+            if IMAGE_HASH_ALGORITHM[name] is not hash_algorithm
+        ]
+        # the hashes of the additional algorithms are only stored, not compared
+        self.additional_stores = [
+            hash_store.for_algorithm(
+                name, {**hash_size_kwargs, **reduced_resolution_metadata(options)}
+            )
+            for name, _, hash_size_kwargs in additional_algorithms
+        ]
+        draft_size = self.draft_size([
+            (hash_algorithm, self.hash_size_kwargs),
+            *((algorithm, kwargs) for _, algorithm, kwargs in additional_algorithms)
+        ]) if options.fast_decode else None
+        self.hasher = ImageHasher(
+            hash_algorithm, self.hash_size_kwargs,
+            # the thumbnail is all that is needed from the image
+            draft_size=options.thumbnail_size or draft_size,
+            exif_thumbnails=options.exif_thumbnails,
+            additional_algorithms=tuple(
+                (algorithm, kwargs) for _, algorithm, kwargs in additional_algorithms
+            ),
+            thumbnail_size=options.thumbnail_size
+        )
         logging.info('Using %s', self.class_string())
 
+    @staticmethod
+    def draft_size(algorithms: List[Tuple[HashFunction, Dict]]) -> Optional[int]:
+        """The size to decode images at which is big enough for all algorithms"""
+        sizes = [get_draft_size(algorithm, kwargs) for algorithm, kwargs in algorithms]
+        return None if None in sizes else max(size for size in sizes if size is not None)
+
     def class_string(self) -> str:
         return self.__class__.__name__
 
     def precalculate_hashes(self) -> List[CacheEntry]:
         return [self.get_hash(file) for file in self.files]
 
+    def hashes(self) -> Iterator[CacheEntry]:
+        """Yields the image hash of each file as soon as it is calculated, in no particular order"""
+        return (self.get_hash(file) for file in self.files)
+
     def get_hash(self, file: Path) -> CacheEntry:
         self.progress_bars.update_reader()
+        cached = self.get_cached(file)
+        if cached is not None:
+            return file, cached
+
+        original = self.copies.original_of(file)
+        if original is not None:
+            image_hash, *additional_hashes = self.copies.hashes_of(original)
+        else:
+            image_hash, *additional_hashes = self.calculate_original_hashes(file)
+        self.store(file, image_hash, additional_hashes)
+        return file, image_hash
+
+    def calculate_original_hashes(self, file: Path) -> List[Optional[Hash]]:
+        """The hashes of file, which are passed on to its copies waiting for them"""
+        hashes: List[Optional[Hash]] = [None] * (1 + len(self.additional_stores))
         try:
-            cached = self.hash_store.get(file)
-            if cached is not None:
-                return file, cached
-
-            image_hash = self.algorithm(Image.open(file), **self.hash_size_kwargs)
-            self.hash_store.add(file, image_hash)
-            return file, image_hash
-        except (OSError, ValueError) as err:
-            logging.warning('%s: %s', path_with_parent(file), err)
-            return file, None
-        except DecompressionBombError as err:
-            logging.warning('%s: %s', path_with_parent(file), err)
-            logging.warning('To process this file, use the --max-image-pixels option')
-            return file, None
+            hashes = self.calculate_hashes(file)
+        finally:
+            self.copies.set_hashes(file, hashes)
+        return hashes
+
+    def calculate_hashes(self, file: Path) -> List[Optional[Hash]]:
+        """The hashes of file, from its cached thumbnail if there is one"""
+        cached_hashes = self.hashes_from_thumbnail(file)
+        if cached_hashes is not None:
+            return cached_hashes
+        thumbnail, hashes = self.hasher.thumbnail_and_hashes(file, self.memory_budget)
+        if thumbnail is not None:
+            self.thumbnails.add(file, thumbnail)
+        return hashes
+
+    def hashes_from_thumbnail(self, file: Path) -> Optional[List[Optional[Hash]]]:
+        thumbnail = self.thumbnails.get(file)
+        if thumbnail is None:
+            return None
+        return self.hasher.hashes_of_image(Image.fromarray(thumbnail))
+
+    def get_cached(self, file: Path) -> Optional[Hash]:
+        """The stored hash of file, if the hashes of all additional algorithms are stored too"""
+        cached = self.hash_store.get(file)
+        if cached is None or any(store.get(file) is None for store in self.additional_stores):
+            return None
+        return cached
+
+    def store(
+            self, file: Path, image_hash: Optional[Hash], additional_hashes: List[Optional[Hash]]
+    ) -> None:
+        for hash_store, calculated in zip(
+                [self.hash_store, *self.additional_stores], [image_hash, *additional_hashes]
+        ):
+            if calculated is not None:
+                hash_store.add(file, calculated)
 
 
 class ParallelImageHashScanner(ImageHashScanner):
     """
-    Reads images from the given list of files and calculates their image hashes,
+    Reads images from the given files and calculates their image hashes,
     using a specified number of threads in parallel
     """
 
     def __init__(  # pylint: disable = too-many-arguments,too-many-positional-arguments
             self,
-            files: List[Path], hash_algorithm: HashFunction,
+            files: Iterable[Path], hash_algorithm: HashFunction,
             hash_size_kwargs: Optional[Dict] = None,
             hash_store: HashStore = NullHashStore(),
             progress_bars: ProgressBarManager = NullProgressBarManager(),
-            parallel: int = os.cpu_count() or 1
+            parallel: int = os.cpu_count() or 1,
+            options: PairFinderOptions = PairFinderOptions(),
+            *, thumbnails: NullThumbnailCache = NullThumbnailCache()
     ) -> None:
         self.num_threads = parallel
-        super().__init__(files, hash_algorithm, hash_size_kwargs, hash_store, progress_bars)
+        super().__init__(
+            files, hash_algorithm, hash_size_kwargs, hash_store, progress_bars, options,
+            thumbnails=thumbnails
+        )
 
     def class_string(self) -> str:
         return f'{self.__class__.__name__} with {self.num_threads} threads'
 
     def precalculate_hashes(self) -> List[CacheEntry]:
         with ThreadPool(self.num_threads) as pool:
-            return pool.map(self.get_hash, self.files)
+            # imap() instead of map(), which would wait for all files before starting
+            return list(pool.imap(self.get_hash, self.files))
+
+    def hashes(self) -> Iterator[CacheEntry]:
+        with ThreadPool(self.num_threads) as pool:
+            yield from pool.imap_unordered(self.get_hash, self.files)
+
+
+class ProcessImageHashScanner(ParallelImageHashScanner):
+    """
+    Reads images from the given files and calculates their image hashes,
+    using a specified number of processes in parallel to avoid the hash
+    calculations being serialized by the GIL. Only the paths of images not
+    already in the hash store or the thumbnail cache, and not copies of other
+    images, are sent to the worker processes, which send back the packed bits
+    of the calculated hashes. With `batch_hashing`, each worker calculates the
+    hashes of a batch of images in one vectorized pass.
+    """
+
+    STREAMING_CHUNK_SIZE = 8
+
+    def class_string(self) -> str:
+        return f'{self.__class__.__name__} with {self.num_threads} processes'
+
+    def precalculate_hashes(self) -> List[CacheEntry]:
+        files: List[Path] = []
+        hashes = dict(self.unordered_hashes(files))
+        return [(file, hashes[file]) for file in files]
+
+    def hashes(self) -> Iterator[CacheEntry]:
+        return self.unordered_hashes([])
+
+    def unordered_hashes(self, files: List[Path]) -> Iterator[CacheEntry]:
+        """
+        Yields the image hashes of all files, those from the hash store as soon as the next
+        calculated one arrives, and appends the files to files in the order they are read
+        """
+        cached: Deque[CacheEntry] = deque()
+        # copies of other files and the files they are copies of
+        copies: Deque[Tuple[Path, Path]] = deque()
+
+        def uncached_files() -> Iterator[Path]:
+            for file in self.files:
+                files.append(file)
+                cached_hash = self.get_cached(file)
+                if cached_hash is None:
+                    original = self.copies.original_of(file)
+                    if original is not None:
+                        copies.append((file, original))
+                        continue
+                    cached_hashes = self.hashes_from_thumbnail(file)
+                    if cached_hashes is None:
+                        yield file
+                        continue
+                    self.copies.set_hashes(file, cached_hashes)
+                    cached_hash, *additional_hashes = cached_hashes
+                    self.store(file, cached_hash, additional_hashes)
+                cached.append((file, cached_hash))
+                self.progress_bars.update_reader()
+
+        # spawn instead of fork, because forking a process running threads may deadlock
+        with get_context('spawn').Pool(
+                self.num_threads, initializer=initialize_worker,
+                initargs=(Image.MAX_IMAGE_PIXELS, self.memory_budget)
+        ) as pool:
+            results: Iterator[PackedResult]
+            if self.batch_hashing:
+                results = chain.from_iterable(pool.imap_unordered(
+                    self.hasher.packed_batch, batched(uncached_files(), self.chunk_size())
+                ))
+            else:
+                results = pool.imap_unordered(
+                    self.hasher.packed, uncached_files(), chunksize=self.chunk_size()
+                )
+            for file, thumbnail, packed in results:
+                while cached:
+                    yield cached.popleft()
+                self.progress_bars.update_reader()
+                if thumbnail is not None:
+                    self.thumbnails.add(file, thumbnail)
+                hashes = [unpack_hash(value) for value in packed]
+                self.copies.set_hashes(file, hashes)
+                image_hash, *additional_hashes = hashes
+                self.store(file, image_hash, additional_hashes)
+                yield file, image_hash
+                yield from self.resolved_copies(copies)
+        yield from cached
+        yield from self.resolved_copies(copies)
+
+    def resolved_copies(self, copies: Deque[Tuple[Path, Path]]) -> Iterator[CacheEntry]:
+        """Yields the hashes of the copies whose originals' hashes are known, and removes them"""
+        for _ in range(len(copies)):
+            file, original = copies.popleft()
+            if not self.copies.is_resolved(original):
+                copies.append((file, original))
+                continue
+            self.progress_bars.update_reader()
+            image_hash, *additional_hashes = self.copies.hashes_of(original)
+            self.store(file, image_hash, additional_hashes)
+            yield file, image_hash
+
+    def chunk_size(self) -> int:
+        """Number of files sent to a worker process at once"""
+        if not isinstance(self.files, Sized):
+            return self.STREAMING_CHUNK_SIZE
+        return max(1, min(64, len(self.files) // (4 * self.num_threads)))
+
+
+PARALLEL_SCANNERS: Dict[str, Type[ParallelImageHashScanner]] = {
+    'thread': ParallelImageHashScanner,
+    'process': ProcessImageHashScanner,
+}
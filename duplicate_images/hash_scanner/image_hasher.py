@@ -0,0 +1,218 @@
+"""
+Open a single image file and calculate its image hash
+"""
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from io import BytesIO
+from math import prod
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from PIL import ExifTags, Image
+from PIL.Image import DecompressionBombError
+from imagehash import ImageHash
+from numpy import asarray, frombuffer, ndarray, packbits, reshape, uint8, unpackbits
+from pillow_heif import register_heif_opener
+
+from duplicate_images.batch_hash import hash_pixels, resized_pixels
+from duplicate_images.common import path_with_parent
+from duplicate_images.function_types import Hash, HashFunction
+from duplicate_images.memory_budget import NullMemoryBudget, decoded_size
+
+EXIF_HEADER = b'Exif\x00\x00'
+
+PackedHash = Union[Tuple[Tuple[int, ...], bytes], Hash, None]
+ThumbnailAndHashes = Tuple[Optional[ndarray], List[Optional[Hash]]]
+# an image file, its thumbnail and hashes, as sent back from a worker process
+PackedResult = Tuple[Path, Optional[ndarray], List[PackedHash]]
+
+# shared by all worker processes, set when they are started by `initialize_worker()`
+worker_memory_budget = NullMemoryBudget()
+
+
+def exif_thumbnail(image: Image.Image) -> Optional[Image.Image]:
+    """
+    Returns the thumbnail embedded in the EXIF data of image, if present. Only
+    the file header already read by `Image.open()` is accessed.
+    """
+    exif_data = image.info.get('exif')
+    if not exif_data:
+        return None
+    try:
+        thumbnail_tags = image.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset = thumbnail_tags.get(ExifTags.Base.JpegIFOffset)
+        length = thumbnail_tags.get(ExifTags.Base.JpegIFByteCount)
+        if not offset or not length:
+            return None
+        tiff_data = exif_data[len(EXIF_HEADER):] if exif_data.startswith(EXIF_HEADER) \
+            else exif_data
+        thumbnail = Image.open(BytesIO(tiff_data[offset:offset + length]))
+        thumbnail.load()
+        return thumbnail
+    except (OSError, ValueError, SyntaxError):
+        return None
+
+
+def grayscale_thumbnail(image: Image.Image, size: int) -> Image.Image:
+    return image.convert('L').resize((size, size), Image.Resampling.LANCZOS)
+
+
+@contextmanager
+def image_errors_logged(file: Path) -> Iterator[None]:
+    """Logs errors reading or hashing the image in file instead of raising them"""
+    try:
+        yield
+    except (OSError, ValueError) as err:
+        logging.warning('%s: %s', path_with_parent(file), err)
+    except DecompressionBombError as err:
+        logging.warning('%s: %s', path_with_parent(file), err)
+        logging.warning('To process this file, use the --max-image-pixels option')
+
+
+@dataclass(frozen=True)
+class ImageHasher:
+    """
+    Opens image files and calculates their image hash with the given algorithm, and optionally
+    with additional algorithms from the same decoded image.
+    Can be pickled to calculate hashes in worker processes.
+    """
+    algorithm: HashFunction
+    hash_size_kwargs: Dict = field(default_factory=dict)
+    # decode at the smallest size not smaller than this (JPEG DCT scaling, HEIF thumbnails)
+    draft_size: Optional[int] = None
+    # use the thumbnail embedded in the EXIF data instead of the image, if present
+    exif_thumbnails: bool = False
+    # further algorithms and their hash size arguments, calculated from the same decoded image
+    additional_algorithms: Tuple[Tuple[HashFunction, Dict], ...] = ()
+    # calculate the hashes from a grayscale thumbnail of this side length, which can be cached
+    thumbnail_size: Optional[int] = None
+
+    def __call__(self, file: Path) -> Optional[Hash]:
+        return self.hashes(file)[0]
+
+    def hashes(self, file: Path) -> List[Optional[Hash]]:
+        """
+        The hashes of file for the algorithm followed by the additional algorithms, decoding the
+        image only once, or all None if the image can not be read
+        """
+        return self.thumbnail_and_hashes(file)[1]
+
+    def thumbnail_and_hashes(
+            self, file: Path, memory_budget: NullMemoryBudget = NullMemoryBudget()
+    ) -> ThumbnailAndHashes:
+        """
+        The hashes of file and, if `thumbnail_size` is set, the pixels of the thumbnail they were
+        calculated from
+        """
+        with image_errors_logged(file), self.decoded_image(file, memory_budget) as image:
+            if self.thumbnail_size is None:
+                return None, self.hashes_of_image(image)
+            thumbnail = grayscale_thumbnail(image, self.thumbnail_size)
+            return asarray(thumbnail), self.hashes_of_image(thumbnail)
+        return None, self.no_hashes()
+
+    def batch_thumbnails_and_hashes(
+            self, files: Sequence[Path], memory_budget: NullMemoryBudget = NullMemoryBudget()
+    ) -> List[ThumbnailAndHashes]:
+        """
+        Like `thumbnail_and_hashes()` for all files, scaling each image down for the algorithms
+        as soon as it is decoded and then calculating the hashes of all images in one vectorized
+        pass. All algorithms must be supported by `duplicate_images.batch_hash`.
+        """
+        algorithms = self.algorithms()
+        results: List[ThumbnailAndHashes] = [(None, self.no_hashes()) for _ in files]
+        decoded: List[Tuple[int, Optional[ndarray], List[ndarray]]] = []
+        for index, file in enumerate(files):
+            with image_errors_logged(file), self.decoded_image(file, memory_budget) as image:
+                thumbnail = None
+                if self.thumbnail_size is not None:
+                    image = grayscale_thumbnail(image, self.thumbnail_size)
+                    thumbnail = asarray(image)
+                decoded.append((
+                    index, thumbnail,
+                    [resized_pixels(image, algorithm, kwargs) for algorithm, kwargs in algorithms]
+                ))
+        if not decoded:
+            return results
+        hashes = [
+            hash_pixels([pixels[position] for _, _, pixels in decoded], algorithm, kwargs)
+            for position, (algorithm, kwargs) in enumerate(algorithms)
+        ]
+        for image_number, (index, thumbnail, _) in enumerate(decoded):
+            results[index] = (
+                thumbnail, [algorithm_hashes[image_number] for algorithm_hashes in hashes]
+            )
+        return results
+
+    def algorithms(self) -> List[Tuple[HashFunction, Dict]]:
+        return [(self.algorithm, self.hash_size_kwargs), *self.additional_algorithms]
+
+    def hashes_of_image(self, image: Image.Image) -> List[Optional[Hash]]:
+        return [algorithm(image, **kwargs) for algorithm, kwargs in self.algorithms()]
+
+    def no_hashes(self) -> List[Optional[Hash]]:
+        return [None] * (1 + len(self.additional_algorithms))
+
+    @contextmanager
+    def decoded_image(self, file: Path, memory_budget: NullMemoryBudget) -> Iterator[Image.Image]:
+        """
+        The image in file, which is decoded when it is first used, once the memory budget allows
+        it. The image is closed afterwards, which releases the file and the decoded pixels.
+        """
+        with self.open_image(file) as image:
+            with memory_budget.reserved(decoded_size(image)):
+                yield image
+                image.close()
+
+    def open_image(self, file: Path) -> Image.Image:
+        image = Image.open(file)
+        if self.exif_thumbnails:
+            thumbnail = exif_thumbnail(image)
+            if thumbnail is not None:
+                image.close()
+                return thumbnail
+        if self.draft_size is not None:
+            image.draft(None, (self.draft_size, self.draft_size))
+        return image
+
+    def packed(self, file: Path) -> PackedResult:
+        thumbnail, hashes = self.thumbnail_and_hashes(file, worker_memory_budget)
+        return file, thumbnail, [pack_hash(image_hash) for image_hash in hashes]
+
+    def packed_batch(self, files: Sequence[Path]) -> List[PackedResult]:
+        return [
+            (file, thumbnail, [pack_hash(image_hash) for image_hash in hashes])
+            for file, (thumbnail, hashes) in zip(
+                files, self.batch_thumbnails_and_hashes(files, worker_memory_budget)
+            )
+        ]
+
+
+def pack_hash(image_hash: Optional[Hash]) -> PackedHash:
+    """Reduces an `ImageHash` to its shape and packed bits for cheap transfer between processes"""
+    if isinstance(image_hash, ImageHash):
+        return image_hash.hash.shape, bytes(packbits(image_hash.hash))
+    return image_hash
+
+
+def unpack_hash(packed: PackedHash) -> Optional[Hash]:
+    if isinstance(packed, tuple):
+        shape, bits = packed
+        unpacked = unpackbits(frombuffer(bits, dtype=uint8), count=prod(shape))
+        return ImageHash(reshape(unpacked, shape).astype(bool))
+    return packed
+
+
+def initialize_worker(
+        max_image_pixels: Optional[int], memory_budget: NullMemoryBudget = NullMemoryBudget()
+) -> None:
+    global worker_memory_budget  # pylint: disable=global-statement
+    Image.MAX_IMAGE_PIXELS = max_image_pixels
+    worker_memory_budget = memory_budget
+    try:
+        register_heif_opener()
+    except ImportError:
+        pass
@@ -6,13 +6,25 @@ __author__ = 'Lene Preuss <lene.preuss@gmail.com>'
 import json
 import logging
 import pickle  # nosec
+import shutil
+import mmap
+import sqlite3
+from bisect import bisect_left
+from math import prod
 from pathlib import Path
-from typing import Any, IO, Callable, Optional, Union, Dict, Tuple
+from threading import Lock
+from time import monotonic
+from typing import Any, IO, Callable, Optional, Union, Dict, List, Sequence, Tuple
 
-from imagehash import hex_to_hash
+import numpy
+from imagehash import ImageHash, hex_to_hash
 
-from duplicate_images.common import log_execution_time
+from duplicate_images.common import (
+    aligned, decode_path, encode_path, log_execution_time, read_header, resolved_file,
+    write_header
+)
 from duplicate_images.function_types import Cache, Hash, is_hash
+from duplicate_images.search_index import NullSearchIndex, SearchIndex, index_path
 
 
 class NullHashStore:
@@ -23,6 +35,7 @@ class NullHashStore:
     """
 
     def __init__(self) -> None:
+        self.search_index = NullSearchIndex()
         logging.info('No persistent storage for calculated image hashes set up')
 
     def __enter__(self) -> 'NullHashStore':
@@ -37,16 +50,63 @@ class NullHashStore:
     def add(self, _: Path, __: Hash) -> None:
         pass
 
+    def key(self, file: Path) -> Path:
+        return file
 
-HashStore = Union[NullHashStore, 'FileHashStore', 'PickleHashStore', 'JSONHashStore']
+    def items(self) -> List[Tuple[Path, Hash]]:
+        return []
 
+    def stored_hash(self, _: Path) -> Optional[Hash]:
+        return None
+
+    def files_with_hash(self, _: Hash) -> List[Path]:
+        return []
+
+    def for_algorithm(self, _: str, __: Dict) -> 'NullHashStore':
+        return self
+
+    def open_search_index(self, _: int) -> None:
+        pass
+
+
+FileStat = Tuple[int, int, int]
+
+SQLITE_SUFFIXES = ('.sqlite', '.db')
+
+
+def file_stat(file: Path) -> Optional[FileStat]:
+    """Size, modification time and inode of file, which change if the file is modified"""
+    try:
+        stat = file.stat()
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+HashStore = Union[
+    NullHashStore, 'FileHashStore', 'PickleHashStore', 'JSONHashStore', 'SQLiteHashStore',
+    'SQLiteAlgorithmHashes', 'BinaryHashStore'
+]
 
-class FileHashStore:
+
+class FileHashStore:  # pylint: disable=too-many-instance-attributes
     """
     Base class for persistent storage of calculated image hashes, providing all
     necessary functionality except for reading and writing data to various file
-    formats
+    formats.
+    Along with each hash, the size, modification time and inode of the file are
+    stored, and a stored hash is only used if they are unchanged.
+    During long scans, the store is written after every `CHECKPOINT_ENTRIES` new
+    hashes or `CHECKPOINT_SECONDS` seconds, whichever comes first, so that an
+    interrupted scan can resume from there. As each checkpoint writes the whole
+    store, the number of new hashes between checkpoints grows to a tenth of
+    the store size for large stores, which keeps the total cost linear.
+    The hashes stored when the store was opened remain available through
+    `stored_hash()` and `files_with_hash()` after newer hashes replace them.
     """
+    CHECKPOINT_ENTRIES = 10000
+    CHECKPOINT_SECONDS = 600
+
     @staticmethod
     def create(
             store_path: Optional[Path], algorithm: str, hash_size_kwargs: Dict
@@ -55,6 +115,10 @@ class FileHashStore:
             return NullHashStore()
         if store_path.suffix == '.pickle':
             return PickleHashStore(store_path, algorithm, hash_size_kwargs)
+        if store_path.suffix in SQLITE_SUFFIXES:
+            return SQLiteHashStore(store_path, algorithm, hash_size_kwargs)
+        if store_path.suffix == '.dihash':
+            return BinaryHashStore(store_path, algorithm, hash_size_kwargs)
         return JSONHashStore(store_path, algorithm, hash_size_kwargs)
 
     def __init__(self, store_path: Path, algorithm: str, hash_size_kwargs: Dict) -> None:
@@ -62,11 +126,21 @@ class FileHashStore:
         self.algorithm = algorithm
         self.hash_size_kwargs = hash_size_kwargs
         self.values: Cache = {}
+        self.file_stats: Dict[Path, FileStat] = {}
+        # the hashes stored on opening for the files added since, None for files added first
+        self.replaced: Dict[Path, Optional[Hash]] = {}
+        self.stored_by_hash: Optional[Dict[Hash, List[Path]]] = None
         self.dirty: bool = False
+        self.lock = Lock()
+        self.write_lock = Lock()
+        self.new_entries = 0
+        self.last_checkpoint = monotonic()
+        self.backed_up = False
+        self.search_index = NullSearchIndex()
         try:
             self.load()
             logging.info(
-                'Opened persistent storage %s with %d entries', store_path, len(self.values)
+                'Opened persistent storage %s with %d entries', store_path, len(self)
             )
         except (FileNotFoundError, EOFError, pickle.PickleError):
             logging.info('Creating new %s at %s', self.__class__.__name__, store_path)
@@ -74,62 +148,180 @@ class FileHashStore:
     def __enter__(self) -> 'FileHashStore':
         return self
 
+    def __len__(self) -> int:
+        return len(self.values)
+
     def __exit__(self, exc_type: Any, _: Any, __: Any) -> None:
         # Don't save cache if interrupted by user - prevents corrupted partial cache
         if exc_type is KeyboardInterrupt:
-            logging.info('Scan interrupted - cache not updated')
+            logging.info('Scan interrupted - cache not updated since last checkpoint')
             return
 
-        if not self.dirty:
-            return
-        if self.store_path.is_file():
-            if self.store_path.with_suffix('.bak').is_file():
-                self.store_path.with_suffix('.bak').unlink()
-            self.store_path.rename(self.store_path.with_suffix('.bak'))
-        self.dump()
+        if self.dirty:
+            self.write()
+        self.search_index.write(file_stat(self.store_path))
+
+    def key(self, file: Path) -> Path:
+        return file
 
     def add(self, file: Path, image_hash: Hash) -> None:
-        self.values[file] = image_hash
-        self.dirty = True
+        key = self.key(file)
+        stat = file_stat(key)
+        self.search_index.add(key, image_hash)
+        with self.lock:
+            self.replaced.setdefault(key, self.values.get(key))
+            self.values[key] = image_hash
+            if stat is not None:
+                self.file_stats[key] = stat
+            self.dirty = True
+            self.new_entries += 1
+            checkpoint = self.checkpoint_due()
+        if checkpoint:
+            logging.info('Checkpoint: writing %d entries to %s', len(self), self.store_path)
+            self.write()
+
+    def checkpoint_due(self) -> bool:
+        """
+        Whether a checkpoint is to be written, which is then counted as written so that the other
+        threads go on adding hashes. Must be called holding `self.lock`.
+        """
+        if self.new_entries < max(self.CHECKPOINT_ENTRIES, len(self) // 10) and \
+                monotonic() - self.last_checkpoint < self.CHECKPOINT_SECONDS:
+            return False
+        self.new_entries = 0
+        self.last_checkpoint = monotonic()
+        return True
 
     def get(self, file: Path) -> Optional[Hash]:
-        return self.values.get(file)
+        key = self.key(file)
+        image_hash = self.values.get(key)
+        if image_hash is None or self.file_stats.get(key) != file_stat(key):
+            return None
+        return image_hash
+
+    def items(self) -> List[Tuple[Path, Hash]]:
+        """
+        All stored files and their hashes, without checking whether the files have changed since
+        """
+        with self.lock:
+            return list(self.values.items())
+
+    def stored_hash(self, file: Path) -> Optional[Hash]:
+        """
+        The hash stored for file when the store was opened, without checking whether the file has
+        changed since
+        """
+        key = self.key(file)
+        with self.lock:
+            return self.replaced[key] if key in self.replaced else self.values.get(key)
+
+    def files_with_hash(self, image_hash: Hash) -> List[Path]:
+        """The files stored with image_hash when the store was opened"""
+        with self.lock:
+            if self.stored_by_hash is None:
+                self.stored_by_hash = {}
+                for key, value in self.values.items():
+                    stored = self.replaced[key] if key in self.replaced else value
+                    if stored is not None:
+                        self.stored_by_hash.setdefault(stored, []).append(key)
+            return list(self.stored_by_hash.get(image_hash, []))
 
     def metadata(self) -> Dict:
         return {'algorithm': self.algorithm, **self.hash_size_kwargs}
 
-    def values_with_metadata(self) -> Tuple[Dict, Dict]:
-        return self.values, self.metadata()
+    def open_search_index(self, max_distance: int) -> None:
+        """
+        Opens the search index for max_distance next to the store file, which is built from the
+        stored hashes if it is missing or out of date, and updated with the hashes added
+        """
+        self.search_index = SearchIndex(
+            index_path(self.store_path), {**self.metadata(), 'max_distance': max_distance},
+            file_stat(self.store_path), self.items
+        )
+
+    def for_algorithm(self, algorithm: str, _: Dict) -> 'HashStore':
+        """
+        The hashes for another algorithm or hash size in the same store, which only
+        `SQLiteHashStore` supports
+        """
+        raise ValueError(
+            f'{self.__class__.__name__} can only store hashes for one algorithm, not {algorithm}'
+        )
+
+    def check_metadata(self, metadata: Any) -> None:
+        if not metadata:
+            raise ValueError('Metadata empty')
+        if not isinstance(metadata, dict):
+            raise ValueError(f'Metadata not a dict: {metadata}')
+        if metadata['algorithm'] != self.algorithm:
+            raise ValueError(f'Algorithm mismatch: {metadata['algorithm']} != {self.algorithm}')
+        if metadata.keys() != self.metadata().keys():
+            raise ValueError(f'Metadata mismatch: {metadata} != {self.metadata()}')
+        if metadata != self.metadata():
+            raise ValueError(f'Metadata mismatch: {metadata} != {self.metadata()}')
 
-    def checked_load(self, file: IO, load: Callable[[IO], Tuple[Cache, Dict]]) -> None:
+    def checked_load(self, file: IO, load: Callable[[IO], Sequence]) -> None:
         try:
-            values, metadata = load(file)  # nosec
+            values, metadata, *file_stats = load(file)  # nosec
         except IndexError as error:
-            raise ValueError('Save file not in format: [values, metadata]') from error
+            raise ValueError('Save file not in format: [values, metadata, file stats]') from error
         if not isinstance(values, dict):
             raise ValueError(f'Not a dict: {values}')
-        if not metadata:
-            raise ValueError('Metadata empty')
-        if not isinstance(metadata, dict):
-            raise ValueError(f'Metadata not a dict: {metadata}')
+        self.check_metadata(metadata)
         bad_keys = [key for key in values.keys() if not isinstance(key, Path)]
         if bad_keys:
             raise ValueError(f'Not a Path: {bad_keys}')
         bad_values = [value for value in values.values() if not is_hash(value)]
         if bad_values:
             raise ValueError(f'Not an image hash: {bad_values}')
-        if metadata['algorithm'] != self.algorithm:
-            raise ValueError(f'Algorithm mismatch: {metadata['algorithm']} != {self.algorithm}')
-        if metadata.keys() != self.metadata().keys():
-            raise ValueError(f'Metadata mismatch: {metadata} != {self.metadata()}')
-        if metadata != self.metadata():
-            raise ValueError(f'Metadata mismatch: {metadata} != {self.metadata()}')
         self.values = values
+        if file_stats:
+            if not isinstance(file_stats[0], dict):
+                raise ValueError(f'File stats not a dict: {file_stats[0]}')
+            self.file_stats = file_stats[0]
+        else:
+            self.upgrade_file_stats()
+
+    def upgrade_file_stats(self) -> None:
+        """
+        Records the current size and modification time of the files in a hash
+        store written before these were stored, trusting the stored hashes once
+        """
+        logging.info('Recording file stats for %d stored hashes', len(self.values))
+        for file in self.values:
+            stat = file_stat(file)
+            if stat is not None:
+                self.file_stats[file] = stat
+        self.dirty = True
+
+    def write(self) -> None:
+        """
+        Writes the store to a temporary file which then replaces the store file,
+        so an interruption never leaves a partially written store file behind.
+        The store file from before the first write is kept as a backup.
+        Only a copy of the stored values is taken holding `self.lock`, so that other threads can
+        go on adding hashes while it is written.
+        """
+        with self.write_lock:
+            with self.lock:
+                values, file_stats = dict(self.values), dict(self.file_stats)
+                self.dirty = False
+            temp_path = self.store_path.with_name(f'{self.store_path.name}.tmp')
+            self.dump(temp_path, values, file_stats)
+            if not self.backed_up and self.store_path.is_file():
+                backup_path = self.store_path.with_suffix('.bak')
+                backup_path.unlink(missing_ok=True)
+                try:
+                    backup_path.hardlink_to(self.store_path)
+                except OSError:
+                    shutil.copy2(self.store_path, backup_path)
+            temp_path.replace(self.store_path)
+            self.backed_up = True
 
     def load(self) -> None:
         raise NotImplementedError()
 
-    def dump(self) -> None:
+    def dump(self, path: Path, values: Cache, file_stats: Dict[Path, FileStat]) -> None:
         raise NotImplementedError()
 
 
@@ -145,12 +337,12 @@ class PickleHashStore(FileHashStore):
             self.checked_load(file, pickle.load)
 
     @log_execution_time()
-    def dump(self) -> None:
-        with self.store_path.open('wb') as file:
-            pickle.dump(self.values_with_metadata(), file)  # nosec
+    def dump(self, path: Path, values: Cache, file_stats: Dict[Path, FileStat]) -> None:
+        with path.open('wb') as file:
+            pickle.dump((values, self.metadata(), file_stats), file)  # nosec
 
 
-def load_values_and_metadata(file: IO) -> Tuple[Cache, Dict]:
+def load_values_and_metadata(file: IO) -> Tuple[Cache, Dict] | Tuple[Cache, Dict, Dict]:
     try:
         valds = json.load(file)
     except json.JSONDecodeError as error:
@@ -161,7 +353,18 @@ def load_values_and_metadata(file: IO) -> Tuple[Cache, Dict]:
         raise ValueError(f'Not a dict: {valds[0]}')
     if not isinstance(valds[1], dict):
         raise ValueError(f'Metadata not a dict: {valds[1]}')
-    return {Path(k).resolve(): hex_to_hash(str(v)) for k, v in valds[0].items()}, valds[1]
+    values: Cache = {stored_path(k): hex_to_hash(str(v)) for k, v in valds[0].items()}
+    if len(valds) < 3:
+        return values, valds[1]
+    if not isinstance(valds[2], dict):
+        raise ValueError(f'File stats not a dict: {valds[2]}')
+    return values, valds[1], {stored_path(k): tuple(v) for k, v in valds[2].items()}
+
+
+def stored_path(path: str) -> Path:
+    # paths are written resolved already, only resolve paths from other sources
+    stored = Path(path)
+    return stored if stored.is_absolute() else resolved_file(stored)
 
 
 class JSONHashStore(FileHashStore):
@@ -170,14 +373,9 @@ class JSONHashStore(FileHashStore):
     image hashes in JSON format
     """
 
-    def add(self, file: Path, image_hash: Hash) -> None:
+    def key(self, file: Path) -> Path:
         # Resolve path to ensure consistent key format
-        self.values[file.resolve()] = image_hash
-        self.dirty = True
-
-    def get(self, file: Path) -> Optional[Hash]:
-        # Resolve path to match how paths are stored
-        return self.values.get(file.resolve())
+        return resolved_file(file)
 
     @log_execution_time()
     def load(self) -> None:
@@ -186,10 +384,418 @@ class JSONHashStore(FileHashStore):
 
     # see https://bugs.python.org/issue18820 for why this pain is necessary (Python does not allow
     # to automatically convert dict keys for JSON export
-    def converted_values(self):
-        return {str(k.resolve()): str(v) for k, v in self.values.items()}
+    @staticmethod
+    def converted_values(values: Cache):
+        return {str(k): str(v) for k, v in values.items()}
+
+    @staticmethod
+    def converted_file_stats(file_stats: Dict[Path, FileStat]):
+        return {str(k): list(v) for k, v in file_stats.items()}
+
+    @log_execution_time()
+    def dump(self, path: Path, values: Cache, file_stats: Dict[Path, FileStat]) -> None:
+        with path.open('w') as file:
+            json.dump(
+                (
+                    self.converted_values(values), self.metadata(),
+                    self.converted_file_stats(file_stats)
+                ), file
+            )
+
+
+class SQLiteHashStore(FileHashStore):
+    """
+    Implementation of `FileHashStore` that keeps the calculated image hashes in
+    an SQLite database. Hashes are looked up in the database when needed
+    instead of being loaded at startup, and new hashes are committed in
+    batches, so hashes calculated before an interruption are not lost.
+    The hashes are stored per algorithm and hash size, so one database can hold
+    the hashes of several algorithms, see `for_algorithm()`.
+    The files with a hash are looked up by an index over the hashes as strings.
+    Rows replaced since the store was opened are copied to a temporary table
+    first, so the hashes stored on opening remain available.
+    """
+    BATCH_SIZE = 1000
+
+    def __init__(self, store_path: Path, algorithm: str, hash_size_kwargs: Dict) -> None:
+        self.pending: Dict[Tuple[str, Path], Tuple[Hash, Optional[FileStat]]] = {}
+        self.algorithm_key = algorithm_key(algorithm, hash_size_kwargs)
+        self.connection = sqlite3.connect(store_path, check_same_thread=False)
+        super().__init__(store_path, algorithm, hash_size_kwargs)
+
+    def __exit__(self, exc_type: Any, _: Any, __: Any) -> None:
+        # every batch is written in a transaction, so keeping the hashes calculated so far is safe
+        if exc_type is KeyboardInterrupt:
+            logging.info('Scan interrupted - keeping hashes calculated so far')
+        with self.lock:
+            self.flush()
+        self.connection.close()
+        self.search_index.write(file_stat(self.store_path))
+
+    def __len__(self) -> int:
+        with self.lock:
+            (count,) = self.connection.execute(
+                'SELECT COUNT(*) FROM hashes WHERE algorithm = ?', (self.algorithm_key,)
+            ).fetchone()
+            return count + sum(1 for key, _ in self.pending if key == self.algorithm_key)
+
+    def key(self, file: Path) -> Path:
+        return resolved_file(file)
+
+    def for_algorithm(self, algorithm: str, hash_size_kwargs: Dict) -> 'HashStore':
+        return SQLiteAlgorithmHashes(self, algorithm_key(algorithm, hash_size_kwargs))
+
+    def add(self, file: Path, image_hash: Hash) -> None:
+        self.search_index.add(self.key(file), image_hash)
+        self.add_with_key(self.algorithm_key, file, image_hash)
+
+    def get(self, file: Path) -> Optional[Hash]:
+        return self.get_with_key(self.algorithm_key, file)
+
+    def items(self) -> List[Tuple[Path, Hash]]:
+        return self.items_with_key(self.algorithm_key)
+
+    def stored_hash(self, file: Path) -> Optional[Hash]:
+        return self.stored_hash_with_key(self.algorithm_key, file)
+
+    def files_with_hash(self, image_hash: Hash) -> List[Path]:
+        return self.files_with_hash_with_key(self.algorithm_key, image_hash)
+
+    def add_with_key(self, key_of_algorithm: str, file: Path, image_hash: Hash) -> None:
+        key = self.key(file)
+        stat = file_stat(key)
+        with self.lock:
+            self.pending[key_of_algorithm, key] = (image_hash, stat)
+            if len(self.pending) >= self.BATCH_SIZE:
+                self.flush()
+
+    def get_with_key(self, key_of_algorithm: str, file: Path) -> Optional[Hash]:
+        key = self.key(file)
+        with self.lock:
+            if (key_of_algorithm, key) in self.pending:
+                image_hash, stat = self.pending[key_of_algorithm, key]
+                return image_hash if stat == file_stat(key) else None
+            row = self.connection.execute(
+                'SELECT hash, size, mtime_ns, inode FROM hashes WHERE algorithm = ? AND path = ?',
+                (key_of_algorithm, str(key))
+            ).fetchone()
+        if row is None or row[1] is None or tuple(row[1:]) != file_stat(key):
+            return None
+        return pickle.loads(row[0])  # nosec
+
+    def items_with_key(self, key_of_algorithm: str) -> List[Tuple[Path, Hash]]:
+        with self.lock:
+            self.flush()
+            rows = self.connection.execute(
+                'SELECT path, hash FROM hashes WHERE algorithm = ?', (key_of_algorithm,)
+            ).fetchall()
+        return [(Path(path), pickle.loads(image_hash)) for path, image_hash in rows]  # nosec
+
+    def stored_hash_with_key(self, key_of_algorithm: str, file: Path) -> Optional[Hash]:
+        parameters = (key_of_algorithm, str(self.key(file)))
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT hash FROM replaced WHERE algorithm = ? AND path = ?', parameters
+            ).fetchone() or self.connection.execute(
+                'SELECT hash FROM hashes WHERE algorithm = ? AND path = ?', parameters
+            ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return pickle.loads(row[0])  # nosec
+
+    def files_with_hash_with_key(self, key_of_algorithm: str, image_hash: Hash) -> List[Path]:
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT path FROM hashes WHERE algorithm = :algorithm AND hash_key = :hash_key '
+                'AND NOT EXISTS (SELECT 1 FROM replaced '
+                'WHERE replaced.algorithm = :algorithm AND replaced.path = hashes.path) '
+                'UNION SELECT path FROM replaced '
+                'WHERE algorithm = :algorithm AND hash_key = :hash_key',
+                {'algorithm': key_of_algorithm, 'hash_key': str(image_hash)}
+            ).fetchall()
+        return [Path(path) for (path,) in rows]
+
+    def flush(self) -> None:
+        """Writes all pending hashes to the database. Must be called holding `self.lock`"""
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO replaced SELECT :algorithm, :path, '
+                '(SELECT hash_key FROM hashes WHERE algorithm = :algorithm AND path = :path), '
+                '(SELECT hash FROM hashes WHERE algorithm = :algorithm AND path = :path)',
+                [
+                    {'algorithm': key_of_algorithm, 'path': str(key)}
+                    for key_of_algorithm, key in self.pending
+                ]
+            )
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO hashes '
+                '(algorithm, path, hash, size, mtime_ns, inode, hash_key) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (
+                        key_of_algorithm, str(key), pickle.dumps(image_hash),
+                        *(stat or (None, None, None)), str(image_hash)
+                    )
+                    for (key_of_algorithm, key), (image_hash, stat) in self.pending.items()
+                ]
+            )
+        self.pending.clear()
+
+    @log_execution_time()
+    def load(self) -> None:
+        try:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            with self.connection:
+                self.connection.execute(
+                    'CREATE TABLE IF NOT EXISTS hashes ('
+                    'algorithm TEXT, path TEXT, hash BLOB, size INTEGER, mtime_ns INTEGER, '
+                    'inode INTEGER, hash_key TEXT, PRIMARY KEY (algorithm, path))'
+                )
+            # fails for a hashes table of another layout
+            self.connection.execute(
+                'SELECT algorithm, path, hash, size, mtime_ns, inode FROM hashes LIMIT 1'
+            )
+            self.add_hash_keys()
+            self.connection.execute(
+                'CREATE TEMP TABLE replaced (algorithm TEXT, path TEXT, hash_key TEXT, hash BLOB, '
+                'PRIMARY KEY (algorithm, path))'
+            )
+            self.connection.execute(
+                'CREATE INDEX temp.replaced_by_hash ON replaced (algorithm, hash_key)'
+            )
+        except sqlite3.DatabaseError as error:
+            self.connection.close()
+            raise ValueError(f'Not an SQLite hash database: {self.store_path}') from error
+
+    def add_hash_keys(self) -> None:
+        """
+        Adds the indexed column holding each hash as a string to a database written before it
+        existed, by which the files with a hash are looked up
+        """
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(hashes)')]
+        with self.connection:
+            if 'hash_key' not in columns:
+                logging.info('Adding hash index to %s', self.store_path)
+                self.connection.create_function(
+                    'hash_string', 1, lambda image_hash: str(pickle.loads(image_hash)),  # nosec
+                    deterministic=True
+                )
+                self.connection.execute('ALTER TABLE hashes ADD COLUMN hash_key TEXT')
+                self.connection.execute('UPDATE hashes SET hash_key = hash_string(hash)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS hashes_by_hash ON hashes (algorithm, hash_key)'
+            )
+
+    def dump(self, path: Path, values: Cache, file_stats: Dict[Path, FileStat]) -> None:
+        with self.lock:
+            self.flush()
+
+
+def algorithm_key(algorithm: str, hash_size_kwargs: Dict) -> str:
+    """Identifies the hashes calculated with the same algorithm and parameters in a database"""
+    return json.dumps({'algorithm': algorithm, **hash_size_kwargs}, sort_keys=True)
+
+
+class SQLiteAlgorithmHashes:
+    """
+    The hashes calculated with another algorithm or hash size in the database of an open
+    `SQLiteHashStore`, sharing its connection and batches
+    """
+
+    def __init__(self, store: SQLiteHashStore, key_of_algorithm: str) -> None:
+        self.store = store
+        self.key_of_algorithm = key_of_algorithm
+        self.search_index = NullSearchIndex()
+
+    def get(self, file: Path) -> Optional[Hash]:
+        return self.store.get_with_key(self.key_of_algorithm, file)
+
+    def add(self, file: Path, image_hash: Hash) -> None:
+        self.store.add_with_key(self.key_of_algorithm, file, image_hash)
+
+    def key(self, file: Path) -> Path:
+        return self.store.key(file)
+
+    def items(self) -> List[Tuple[Path, Hash]]:
+        return self.store.items_with_key(self.key_of_algorithm)
+
+    def stored_hash(self, file: Path) -> Optional[Hash]:
+        return self.store.stored_hash_with_key(self.key_of_algorithm, file)
+
+    def files_with_hash(self, image_hash: Hash) -> List[Path]:
+        return self.store.files_with_hash_with_key(self.key_of_algorithm, image_hash)
+
+    def for_algorithm(self, algorithm: str, hash_size_kwargs: Dict) -> HashStore:
+        return self.store.for_algorithm(algorithm, hash_size_kwargs)
+
+
+class BinaryHashStore(FileHashStore):
+    """
+    Implementation of `FileHashStore` that stores the calculated image hashes
+    in a compact binary format, which is memory-mapped instead of being read
+    into Python objects when loaded. After a header holding the metadata, the
+    file contains the packed hashes as one fixed width array, the file stats,
+    and a table of the paths sorted by their UTF-8 encoding, which is searched
+    by bisection when looking up a hash. The mapped file keeps the hashes
+    stored on opening, the files with a hash are found by bisection in the
+    packed hashes once they have been sorted.
+    """
+    MAGIC = b'DIHASH01'
+    # file stats stored for files that could not be accessed, never equal to a real file stat
+    NO_STAT = (-1, -1, -1)
+
+    def __init__(self, store_path: Path, algorithm: str, hash_size_kwargs: Dict) -> None:
+        if algorithm == 'crop_resistant':
+            raise ValueError(f'{store_path.suffix} files only support fixed width image hashes')
+        self.mapped: Union[bytes, mmap.mmap] = b''
+        self.hash_shape: Optional[Tuple[int, ...]] = None
+        self.hashes = numpy.zeros((0, 0), dtype=numpy.uint8)
+        self.stats = numpy.zeros((0, 3), dtype='<i8')
+        self.path_offsets = numpy.zeros(1, dtype='<u8')
+        self.paths_start = 0
+        # the order of the packed hashes, and the packed hashes in that order
+        self.sorted_hashes: Optional[Tuple[numpy.ndarray, numpy.ndarray]] = None
+        super().__init__(store_path, algorithm, hash_size_kwargs)
+
+    def __len__(self) -> int:
+        return len(self.hashes) + len(self.values)
+
+    def key(self, file: Path) -> Path:
+        return file.absolute()
+
+    def get(self, file: Path) -> Optional[Hash]:
+        key = self.key(file)
+        if key in self.values:
+            return super().get(file)
+        index = self.find(encode_path(key))
+        if index is None or tuple(self.stats[index].tolist()) != file_stat(key):
+            return None
+        return self.unpack(self.hashes[index])
+
+    def items(self) -> List[Tuple[Path, Hash]]:
+        added = super().items()
+        added_paths = {encode_path(file) for file, _ in added}
+        return [
+            (decode_path(self.path_at(index)), self.unpack(self.hashes[index]))
+            for index in range(len(self.hashes))
+            if self.path_at(index) not in added_paths
+        ] + added
+
+    def stored_hash(self, file: Path) -> Optional[Hash]:
+        index = self.find(encode_path(self.key(file)))
+        return None if index is None else self.unpack(self.hashes[index])
+
+    def files_with_hash(self, image_hash: Hash) -> List[Path]:
+        if len(self.hashes) == 0 or not isinstance(image_hash, ImageHash) or \
+                image_hash.hash.shape != self.hash_shape:
+            return []
+        row_type = numpy.dtype((numpy.void, self.hash_bytes()))
+        with self.lock:
+            if self.sorted_hashes is None:
+                rows = self.hashes.view(row_type).ravel()
+                order = numpy.argsort(rows, kind='stable')
+                self.sorted_hashes = order, rows[order]
+            order, rows = self.sorted_hashes
+        packed = numpy.packbits(image_hash.hash.flatten()).view(row_type)
+        start, end = numpy.searchsorted(rows, packed[0], 'left'), \
+            numpy.searchsorted(rows, packed[0], 'right')
+        return [decode_path(self.path_at(index)) for index in order[start:end].tolist()]
+
+    def path_at(self, index: int) -> bytes:
+        start, end = self.path_offsets[index:index + 2].tolist()
+        return self.mapped[self.paths_start + start:self.paths_start + end]
+
+    def find(self, path: bytes) -> Optional[int]:
+        index = bisect_left(range(len(self.hashes)), path, key=self.path_at)
+        if index < len(self.hashes) and self.path_at(index) == path:
+            return index
+        return None
+
+    def unpack(self, packed: numpy.ndarray) -> ImageHash:
+        shape = self.hash_shape or (0,)
+        return ImageHash(numpy.unpackbits(packed, count=prod(shape)).reshape(shape).astype(bool))
+
+    @log_execution_time()
+    def load(self) -> None:
+        with self.store_path.open('rb') as file:
+            if file.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError(f'Not a binary hash store: {self.store_path}')
+            self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header, offset = read_header(self.mapped, self.MAGIC)
+        self.check_metadata(header['metadata'])
+        count, hash_bytes = header['count'], header['hash_bytes']
+        self.hash_shape = tuple(header['hash_shape']) if header['hash_shape'] else None
+        self.hashes = numpy.frombuffer(
+            self.mapped, dtype=numpy.uint8, count=count * hash_bytes, offset=offset
+        ).reshape(count, hash_bytes)
+        offset += aligned(count * hash_bytes)
+        self.stats = numpy.frombuffer(
+            self.mapped, dtype='<i8', count=count * 3, offset=offset
+        ).reshape(count, 3)
+        offset += count * self.stats.itemsize * 3
+        self.path_offsets = numpy.frombuffer(
+            self.mapped, dtype='<u8', count=count + 1, offset=offset
+        )
+        self.paths_start = offset + self.path_offsets.nbytes
+
+    def added_entries(
+            self, values: Cache, file_stats: Dict[Path, FileStat]
+    ) -> Tuple[List[bytes], numpy.ndarray, numpy.ndarray]:
+        """Paths, packed hashes and file stats of the hashes added since loading"""
+        added = {key: value for key, value in values.items() if isinstance(value, ImageHash)}
+        if len(added) < len(values):
+            raise ValueError(f'Not a fixed width image hash: {self.store_path}')
+        shapes = {value.hash.shape for value in added.values()}
+        if self.hash_shape is not None:
+            shapes.add(self.hash_shape)
+        if len(shapes) > 1:
+            raise ValueError(f'Image hashes of different shapes: {shapes}')
+        if shapes:
+            self.hash_shape = shapes.pop()
+        hashes = numpy.zeros((len(added), self.hash_bytes()), dtype=numpy.uint8)
+        for row, value in enumerate(added.values()):
+            hashes[row] = numpy.packbits(value.hash.flatten())
+        stats = numpy.array(
+            [file_stats.get(key, self.NO_STAT) for key in added], dtype='<i8'
+        ).reshape(len(added), 3)
+        return [encode_path(key) for key in added], hashes, stats
+
+    def hash_bytes(self) -> int:
+        return -(-prod(self.hash_shape) // 8) if self.hash_shape else 0
+
+    def merged_entries(
+            self, values: Cache, file_stats: Dict[Path, FileStat]
+    ) -> Tuple[List[bytes], numpy.ndarray, numpy.ndarray]:
+        """Paths, packed hashes and file stats of the stored and added hashes, sorted by path"""
+        new_paths, new_hashes, new_stats = self.added_entries(values, file_stats)
+        kept = numpy.ones(len(self.hashes), dtype=bool)
+        for index in map(self.find, new_paths):
+            if index is not None:
+                kept[index] = False
+        kept_indices = numpy.flatnonzero(kept)
+        paths = [self.path_at(index) for index in kept_indices.tolist()] + new_paths
+        order = sorted(range(len(paths)), key=paths.__getitem__)
+        hashes = numpy.concatenate(
+            (self.hashes[kept_indices].reshape(len(kept_indices), self.hash_bytes()), new_hashes)
+        )[order]
+        stats = numpy.concatenate((self.stats[kept_indices], new_stats))[order]
+        return [paths[index] for index in order], hashes, stats
 
     @log_execution_time()
-    def dump(self) -> None:
-        with self.store_path.open('w') as file:
-            json.dump((self.converted_values(), self.metadata()), file)
+    def dump(self, path: Path, values: Cache, file_stats: Dict[Path, FileStat]) -> None:
+        paths, hashes, stats = self.merged_entries(values, file_stats)
+        path_offsets = numpy.zeros(len(paths) + 1, dtype='<u8')
+        numpy.cumsum([len(sorted_path) for sorted_path in paths], out=path_offsets[1:])
+        with path.open('wb') as file:
+            write_header(file, self.MAGIC, {
+                'metadata': self.metadata(), 'count': len(paths), 'hash_bytes': self.hash_bytes(),
+                'hash_shape': self.hash_shape
+            })
+            file.write(hashes.tobytes())
+            file.write(bytes(aligned(hashes.nbytes) - hashes.nbytes))
+            file.write(stats.tobytes())
+            file.write(path_offsets.tobytes())
+            file.write(b''.join(paths))
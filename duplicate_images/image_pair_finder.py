@@ -5,27 +5,34 @@ algorithm
 __author__ = 'Lene Preuss <lene.preuss@gmail.com>'
 
 import logging
+from collections.abc import Sized
 from itertools import combinations
+from math import comb
 from pathlib import Path
 from time import time
-from typing import Dict, List, Iterator
+from typing import Callable, Dict, Iterable, List, Iterator, Tuple, Type
 
-from duplicate_images.common import log_execution_time
+from imagehash import ImageHash
+
+from duplicate_images import hash_matrix
+from duplicate_images.bk_tree import BKTree
+from duplicate_images.common import hash_as_int, log_execution_time
 from duplicate_images.function_types import (
-    Hash, HashFunction, ImageGroup, Results, ResultsGenerator, ResultsGrouper
+    CacheEntry, Hash, HashFunction, ImageGroup, Results, ResultsGenerator, ResultsGrouper
 )
 from duplicate_images.hash_scanner import ImageHashScanner
 from duplicate_images.hash_store import HashStore, NullHashStore
+from duplicate_images.image_pairs import ImagePairs
+from duplicate_images.known_files import KnownFiles, KnownFilesByHash, NullKnownFiles
+from duplicate_images.multi_index import MultiIndex
 from duplicate_images.pair_finder_options import PairFinderOptions
 from duplicate_images.progress_bar_manager import ProgressBarManager, NullProgressBarManager
+from duplicate_images.thumbnail_cache import NullThumbnailCache
+from duplicate_images.union_find import LINKAGE, connected_components
 
 
 def group_results_as_pairs(results: ResultsGenerator) -> Results:
-    return [
-        pair
-        for result in results
-        for pair in combinations(list(result), 2)
-    ]
+    return ImagePairs(results)
 
 
 def group_results_as_tuples(results: ResultsGenerator) -> Results:
@@ -36,22 +43,33 @@ class ImagePairFinder:
     """
     Finds duplicate images by comparing their image hashes
     """
+    # with new_only, how the files stored before the scan are read
+    known_files_class: Callable[[HashStore], NullKnownFiles] = KnownFiles
 
     @classmethod
     def create(
-            cls, files: List[Path], hash_algorithm: HashFunction,
+            cls, files: Iterable[Path], hash_algorithm: HashFunction,
             options: PairFinderOptions = PairFinderOptions(),
-            hash_store: HashStore = NullHashStore()
+            hash_store: HashStore = NullHashStore(),
+            thumbnails: NullThumbnailCache = NullThumbnailCache()
     ) -> 'ImagePairFinder':
         group_results = group_results_as_tuples if options.group else group_results_as_pairs
-        progress_bars = ProgressBarManager.create(len(files), options.show_progress_bars)
-        scanner = ImageHashScanner.create(files, hash_algorithm, options, hash_store, progress_bars)
+        num_files = len(files) if isinstance(files, Sized) else None
+        progress_bars = ProgressBarManager.create(num_files, options.show_progress_bars)
+        scanner = ImageHashScanner.create(
+            files, hash_algorithm, options, hash_store, progress_bars, thumbnails
+        )
 
         if options.max_distance == 0 and not options.slow:
-            return DictImagePairFinder(
+            finder_class = StreamingDictImagePairFinder if options.stream else DictImagePairFinder
+            return finder_class(
                 scanner, group_results, options=options, progress_bars=progress_bars
             )
-        if len(files) > 1000:
+        if not options.slow:
+            return SIMILARITY_SEARCH[options.similarity_search](
+                scanner, group_results, options, progress_bars
+            )
+        if num_files is None or num_files > 1000:
             logging.warning(
                 'Using %s with a big number of images. Expect slow performance.',
                 SlowImagePairFinder.__name__
@@ -59,21 +77,40 @@ class ImagePairFinder:
             logging.warning('Consider using [Parallel]DictImagePairFinder instead.')
         return SlowImagePairFinder(scanner, group_results, options, progress_bars)
 
-    def __init__(  # pylint: disable = too-many-arguments
+    def __init__(  # pylint: disable = too-many-arguments,too-many-positional-arguments
             self, scanner: ImageHashScanner,
             group_results: ResultsGrouper,
-            progress_bars: ProgressBarManager = NullProgressBarManager()
+            progress_bars: ProgressBarManager = NullProgressBarManager(),
+            new_only: bool = False
     ) -> None:
         self.precalculated_hashes: Dict = {}
         self.group_results = group_results
         self.scanner = scanner
         self.progress_bars = progress_bars
+        # with new_only, the files stored before the scan, which the new files are compared to
+        self.known = self.known_files_class(scanner.hash_store) if new_only \
+            else NullKnownFiles()
         self.scan_start_time = time()
         logging.info('Using %s', self.__class__.__name__)
 
     def get_equal_groups(self) -> Results:
         raise NotImplementedError()
 
+    def matches(self) -> Iterator[ImageGroup]:
+        """Yields the equal groups, unless overridden only after all images have been scanned"""
+        return iter(self.get_equal_groups())
+
+    def sorted_hashes(self) -> List[CacheEntry]:
+        """
+        Image hashes of all files, sorted by file so the results do not depend on the order in
+        which the files were found
+        """
+        hashes = sorted(
+            self.known.new_hashes(self.scanner.precalculate_hashes()), key=lambda entry: entry[0]
+        )
+        logging.info('%d total files', len(hashes))
+        return hashes
+
     def log_scan_finished(self) -> None:
         logging.info(
             '%d distinct hashes calculated in %.2fs',
@@ -84,15 +121,18 @@ class ImagePairFinder:
 class DictImagePairFinder(ImagePairFinder):
     """
     Searches by storing the image hashes as keys to a dict.
-    Works only if max_distance == 0.
+    Works only if max_distance == 0. With new_only, only the known files with the hash of a new
+    file are read from the hash store.
     """
+    known_files_class = KnownFilesByHash
+
     def __init__(  # pylint: disable = too-many-arguments
             self, scanner: ImageHashScanner,
             group_results: ResultsGrouper,
             options: PairFinderOptions = PairFinderOptions(),
             progress_bars: ProgressBarManager = NullProgressBarManager()
     ) -> None:
-        super().__init__(scanner, group_results, progress_bars)
+        super().__init__(scanner, group_results, progress_bars, options.new_only)
         if options.max_distance != 0:
             raise ValueError('DictImagePairFinder only works if max_distance == 0!')
         self.precalculated_hashes = self.get_hashes()
@@ -102,24 +142,87 @@ class DictImagePairFinder(ImagePairFinder):
     def get_equal_groups(self) -> Results:
         self.progress_bars.close()
         self.log_scan_finished()
-        return self.group_results(
-            (result for result in self.precalculated_hashes.values() if len(result) > 1)
+        groups = (
+            sorted(result) for result in self.precalculated_hashes.values() if len(result) > 1
         )
+        if self.group_results is group_results_as_pairs:
+            # each group contains a new file, leave out the pairs of known files only
+            return ImagePairs(groups, self.known.is_new)
+        return self.group_results(groups)
 
     def get_hashes(self) -> Dict[Hash, List[Path]]:
+        """The files with each hash, starting with the known files with the hash of a new file"""
         hash_dict: Dict[Hash, List[Path]] = {}
-        for file, image_hash in self.scanner.precalculate_hashes():
+        hashes = self.sorted_hashes()
+        for file, image_hash in hashes:
             if image_hash is not None:
-                hash_dict.setdefault(image_hash, []).append(file)
+                if image_hash not in hash_dict:
+                    hash_dict[image_hash] = self.known.with_hash(image_hash)
+                hash_dict[image_hash].append(file)
         return hash_dict
 
 
+class StreamingDictImagePairFinder(ImagePairFinder):
+    """
+    Searches by storing the image hashes as keys to a dict, like `DictImagePairFinder`, but yields
+    each new pair of equal images, or each group of equal images that has grown, as soon as the
+    hash of the image completing it has been calculated.
+    Works only if max_distance == 0. With new_only, only the known files with the hash of a new
+    file are read from the hash store.
+    """
+    known_files_class = KnownFilesByHash
+
+    def __init__(  # pylint: disable = too-many-arguments
+            self, scanner: ImageHashScanner,
+            group_results: ResultsGrouper,
+            options: PairFinderOptions = PairFinderOptions(),
+            progress_bars: ProgressBarManager = NullProgressBarManager()
+    ) -> None:
+        super().__init__(scanner, group_results, progress_bars, options.new_only)
+        if options.max_distance != 0:
+            raise ValueError(f'{self.__class__.__name__} only works if max_distance == 0!')
+        self.group = group_results is group_results_as_tuples
+
+    @log_execution_time()
+    def get_equal_groups(self) -> Results:
+        """Returns the same results, in the same order, as `DictImagePairFinder`"""
+        for _ in self.matches():
+            pass
+        groups = sorted(
+            sorted(files) for files in self.precalculated_hashes.values() if len(files) > 1
+        )
+        if self.group_results is group_results_as_pairs:
+            return ImagePairs(groups, self.known.is_new)
+        return self.group_results(group for group in groups)
+
+    def matches(self) -> Iterator[ImageGroup]:
+        """
+        Yields pairs of equal images as (earlier image, new image), in the order their hashes are
+        calculated. With grouping, yields the whole group again each time an image is added to it.
+        """
+        for file, image_hash in self.known.new_hashes(self.scanner.hashes()):
+            if image_hash is None:
+                continue
+            if image_hash not in self.precalculated_hashes:
+                self.precalculated_hashes[image_hash] = self.known.with_hash(image_hash)
+            files = self.precalculated_hashes[image_hash]
+            if not self.group:
+                yield from ((other_file, file) for other_file in files)
+            files.append(file)
+            if self.group and len(files) > 1:
+                yield tuple(files)
+        self.progress_bars.close_reader()
+        self.progress_bars.close()
+        self.log_scan_finished()
+
+
 class SlowImagePairFinder(ImagePairFinder):
     """
     Searches by comparing the image hashes of each image to every other, giving O(N^2) performance.
-    Does not allow returning the results in groups, only pairs.
-    The only option if max_distance != 0.
+    Does not allow returning the results in groups, only pairs, or comparing only new files.
     """
+    supports_groups = False
+    supports_new_only = False
 
     def __init__(  # pylint: disable = too-many-arguments
             self, scanner: ImageHashScanner,
@@ -127,11 +230,17 @@ class SlowImagePairFinder(ImagePairFinder):
             options: PairFinderOptions = PairFinderOptions(),
             progress_bars: ProgressBarManager = NullProgressBarManager()
     ) -> None:
-        if group_results is group_results_as_tuples:
+        self.group = group_results is group_results_as_tuples
+        if self.group and not self.supports_groups:
             raise ValueError(f'{self.__class__.__name__} only works with pairs, not groups')
-        super().__init__(scanner, group_results, progress_bars)
+        if options.new_only and not self.supports_new_only:
+            raise ValueError(f'{self.__class__.__name__} can not compare only new files')
+        super().__init__(scanner, group_results, progress_bars, options.new_only)
         self.max_distance = options.max_distance or 0
+        self.group_linkage = LINKAGE[options.group_linkage]
         self.precalculated_hashes = self.get_hashes()
+        # the new files come first in precalculated_hashes, followed by the known ones
+        self.num_new = len(self.precalculated_hashes)
         self.progress_bars.close_reader()
 
     @log_execution_time()
@@ -145,7 +254,7 @@ class SlowImagePairFinder(ImagePairFinder):
 
     def get_hashes(self) -> Dict[Path, Hash]:
         return {
-            file: image_hash for file, image_hash in self.scanner.precalculate_hashes()
+            file: image_hash for file, image_hash in self.sorted_hashes()
             if image_hash is not None
         }
 
@@ -163,3 +272,175 @@ class SlowImagePairFinder(ImagePairFinder):
             '%-30s - %-30s = %d', file.stem, other_file.stem, hash_distance
         )
         return hash_distance <= self.max_distance
+
+
+class HammingImagePairFinder(SlowImagePairFinder):
+    """
+    Base class for finders which use the fact that the distance between two image hashes is the
+    Hamming distance between their bits to avoid comparing all images to each other.
+    Finds the same pairs as `SlowImagePairFinder`. Falls back to comparing all images to each other
+    for hash algorithms whose distance is not a Hamming distance (crop_resistant).
+    Groups the matching pairs into clusters of images connected by chains of matching pairs, or
+    with complete linkage into clusters in which all images match each other.
+    With new_only, the new images are compared to each other and to the known images.
+    """
+    supports_groups = True
+    supports_new_only = True
+
+    @log_execution_time()
+    def get_equal_groups(self) -> Results:
+        self.log_scan_finished()
+        self.add_known_hashes()
+        image_files = list(self.precalculated_hashes.keys())
+        if not all(isinstance(value, ImageHash) for value in self.precalculated_hashes.values()):
+            logging.info('Hash distance is not a Hamming distance, comparing all pairs')
+            self.progress_bars.create_filter_bar(len(image_files))
+            index_pairs = [
+                (index, other_index)
+                for index in range(self.num_new)
+                for other_index in range(index + 1, len(image_files))
+                if self.are_images_equal(image_files[index], image_files[other_index])
+            ]
+        else:
+            logging.info('Filtering duplicates')
+            index_pairs = self.matching_indices(image_files, self.num_new)
+        index_pairs = self.existing_pairs(image_files, index_pairs)
+        self.progress_bars.close()
+        if self.group:
+            return self.group_results(self.clusters(image_files, index_pairs))
+        pairs = (sorted((image_files[index], image_files[other])) for index, other in index_pairs)
+        return sorted((file, other_file) for file, other_file in pairs)
+
+    def add_known_hashes(self) -> None:
+        """
+        Adds the known files which can match one of the new ones after the new ones
+        """
+        self.precalculated_hashes.update(self.known.candidates(
+            list(self.precalculated_hashes.values())[:self.num_new], self.max_distance
+        ))
+
+    def existing_pairs(
+            self, image_files: List[Path], index_pairs: List[Tuple[int, int]]
+    ) -> List[Tuple[int, int]]:
+        """The index pairs without the known image files which no longer exist"""
+        missing = {
+            index for pair in index_pairs for index in pair
+            if index >= self.num_new and not image_files[index].exists()
+        }
+        return [
+            (index, other) for index, other in index_pairs
+            if index not in missing and other not in missing
+        ]
+
+    def clusters(
+            self, image_files: List[Path], index_pairs: List[Tuple[int, int]]
+    ) -> ResultsGenerator:
+        """
+        Merges the matching pairs into clusters, ordered by their first image file. Only the images
+        in any of the pairs are clustered, so known images without a match cost nothing.
+        """
+        def are_similar(index: int, other: int) -> bool:
+            hashes = self.precalculated_hashes
+            return hashes[image_files[index]] - hashes[image_files[other]] <= self.max_distance
+
+        indices = sorted({index for pair in index_pairs for index in pair})
+        position = {index: number for number, index in enumerate(indices)}
+        components = connected_components(
+            len(indices), ((position[index], position[other]) for index, other in index_pairs)
+        )
+        clusters = [
+            sorted(image_files[index] for index in cluster)
+            for component in components
+            for cluster in self.group_linkage(
+                [indices[number] for number in component], are_similar
+            )
+        ]
+        yield from sorted(clusters)
+
+    def matching_indices(self, image_files: List[Path], num_new: int) -> List[Tuple[int, int]]:
+        """
+        Returns the index pairs of all matching image files of which at least one is among the
+        first num_new, the others are known files only compared to the new ones
+        """
+        raise NotImplementedError()
+
+
+class BKTreeImagePairFinder(HammingImagePairFinder):
+    """
+    Searches by storing the image hashes in a BK-tree over their Hamming distance, so that each
+    image is compared only to the images in its neighbourhood instead of to all others.
+    """
+
+    def matching_indices(self, image_files: List[Path], num_new: int) -> List[Tuple[int, int]]:
+        tree = BKTree()
+        for index in range(num_new, len(image_files)):
+            tree.add(hash_as_int(self.precalculated_hashes[image_files[index]]), index)
+        pairs: List[Tuple[int, int]] = []
+        for index, file in enumerate(image_files[:num_new]):
+            value = hash_as_int(self.precalculated_hashes[file])
+            pairs.extend(
+                (other_index, index) for other_index in tree.find(value, self.max_distance)
+            )
+            tree.add(value, index)
+        return pairs
+
+
+class VectorizedImagePairFinder(HammingImagePairFinder):
+    """
+    Searches by packing the image hashes into a matrix of 64 bit words and computing the Hamming
+    distances of blocks of images to all other images in a vectorized operation, giving O(N^2)
+    performance but with a tiny constant factor. With `parallel`, the comparisons are split among
+    as many processes.
+    """
+
+    def __init__(  # pylint: disable = too-many-arguments
+            self, scanner: ImageHashScanner,
+            group_results: ResultsGrouper,
+            options: PairFinderOptions = PairFinderOptions(),
+            progress_bars: ProgressBarManager = NullProgressBarManager()
+    ) -> None:
+        self.processes = options.parallel or 1
+        super().__init__(scanner, group_results, options, progress_bars)
+
+    def matching_indices(self, image_files: List[Path], num_new: int) -> List[Tuple[int, int]]:
+        return hash_matrix.matching_indices(
+            [self.precalculated_hashes[file] for file in image_files], self.max_distance,
+            self.processes, num_new
+        )
+
+
+class MultiIndexImagePairFinder(HammingImagePairFinder):
+    """
+    Searches by splitting the image hashes into max_distance + 1 blocks of bits and indexing the
+    images by the value of each block, so that each image is compared only to the images sharing
+    at least one block with it. Fastest for very small values of max_distance, with which most
+    images share no block with any other image.
+    """
+
+    def matching_indices(self, image_files: List[Path], num_new: int) -> List[Tuple[int, int]]:
+        if not image_files:
+            return []
+        first_hash = self.precalculated_hashes[image_files[0]]
+        index = MultiIndex(first_hash.hash.size, self.max_distance)
+        for image_index in range(num_new, len(image_files)):
+            index.add(hash_as_int(self.precalculated_hashes[image_files[image_index]]), image_index)
+        pairs: List[Tuple[int, int]] = []
+        for image_index, file in enumerate(image_files[:num_new]):
+            value = hash_as_int(self.precalculated_hashes[file])
+            pairs.extend((other_index, image_index) for other_index in index.find(value))
+            index.add(value, image_index)
+        num_pairs = comb(len(image_files), 2) - comb(len(image_files) - num_new, 2)
+        logging.info(
+            '%d of %d pairs of images share a block of their hashes, %d of them match '
+            '(%.2f%% of all pairs compared)',
+            index.num_candidates, num_pairs, index.num_matches,
+            100 * index.num_candidates / num_pairs if num_pairs else 0
+        )
+        return pairs
+
+
+SIMILARITY_SEARCH: Dict[str, Type[HammingImagePairFinder]] = {
+    'bktree': BKTreeImagePairFinder,
+    'vectorized': VectorizedImagePairFinder,
+    'multiindex': MultiIndexImagePairFinder,
+}
@@ -0,0 +1,79 @@
+"""
+All pairs of images in groups of equal images, generated only when they are needed
+"""
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from bisect import bisect_right
+from collections.abc import Collection
+from heapq import merge
+from math import comb
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from duplicate_images.function_types import ImageGroup
+
+
+class ImagePairs(Collection[ImageGroup]):
+    """
+    The pairs of images within each of the given groups of equal images. Only the groups are
+    stored, so memory use is proportional to the number of images, not to the number of pairs,
+    which grows with the square of the group sizes. Iterates over the pairs in sorted order, like
+    a sorted list of all pairs would.
+    With is_new, only the pairs containing at least one new file are generated, so that the pairs
+    of known files in big groups cost nothing.
+    """
+
+    def __init__(
+            self, groups: Iterable[List[Path]], is_new: Optional[Callable[[Path], bool]] = None
+    ) -> None:
+        self.groups = [sorted(group) for group in groups]
+        self.group_index: Dict[Path, int] = {
+            file: index for index, group in enumerate(self.groups) for file in group
+        }
+        self.known: Set[Path] = set() if is_new is None else {
+            file for group in self.groups for file in group if not is_new(file)
+        }
+        self.new_files = [
+            [file for file in group if file not in self.known] if self.known else group
+            for group in self.groups
+        ]
+
+    def __len__(self) -> int:
+        return sum(
+            comb(len(group), 2) - comb(len(group) - len(new_files), 2)
+            for group, new_files in zip(self.groups, self.new_files)
+        )
+
+    def __iter__(self) -> Iterator[ImageGroup]:
+        # each group's pairs are sorted, merging them keeps the memory use per group constant
+        return merge(*(
+            self.pairs_in(group, new_files) for group, new_files in zip(self.groups, self.new_files)
+        ))
+
+    def pairs_in(self, group: List[Path], new_files: List[Path]) -> Iterator[ImageGroup]:
+        """
+        The sorted pairs of files in group of which at least one is among new_files, each new file
+        paired with all files after it and each known file only with the new files after it
+        """
+        for index, file in enumerate(group):
+            others = new_files[bisect_right(new_files, file):] if file in self.known \
+                else group[index + 1:]
+            yield from ((file, other) for other in others)
+
+    def __contains__(self, pair: Any) -> bool:
+        if not isinstance(pair, tuple) or len(pair) != 2 or not pair[0] < pair[1]:
+            return False
+        if pair[0] in self.known and pair[1] in self.known:
+            return False
+        index = self.group_index.get(pair[0])
+        return index is not None and self.group_index.get(pair[1]) == index
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Collection):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == list(other)
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.groups!r})'
@@ -0,0 +1,109 @@
+"""
+The files stored in the hash store before a scan, which the new files are compared to with
+`--new-only`
+"""
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Mapping, Sequence, Set, Union
+
+from imagehash import ImageHash
+
+from duplicate_images.function_types import CacheEntry, Hash
+from duplicate_images.hash_store import HashStore
+from duplicate_images.search_index import SearchIndex
+
+
+class NullKnownFiles:
+    """No known files, so that all files found are new and compared to each other"""
+
+    def new_hashes(self, hashes: Iterable[CacheEntry]) -> Iterator[CacheEntry]:
+        return iter(hashes)
+
+    def with_hash(self, _: Hash) -> List[Path]:
+        return []
+
+    def candidates(self, _: Sequence[Hash], __: int) -> Mapping[Path, Hash]:
+        return {}
+
+    def is_new(self, _: Path) -> bool:
+        return True
+
+
+class KnownFiles(NullKnownFiles):
+    """
+    The hashes stored before the scan, read from the search index of the hash store if it is open.
+    Files scanned again with the same hash are known files, files whose hash has changed are new.
+    """
+
+    def __init__(self, hash_store: HashStore) -> None:
+        self.hash_store = hash_store
+        self.hashes: Union[Dict[Path, Hash], SearchIndex] = \
+            hash_store.search_index if isinstance(hash_store.search_index, SearchIndex) \
+            else dict(hash_store.items())
+        logging.info('Comparing new files to %d known files', len(self.hashes))
+
+    def new_hashes(self, hashes: Iterable[CacheEntry]) -> Iterator[CacheEntry]:
+        """
+        Leaves out the known files, and removes the files whose hash has changed from the known
+        files. The new files are returned under their key in the hash store, so that new and known
+        files are reported in the same form.
+        """
+        for file, image_hash in hashes:
+            key = self.hash_store.key(file)
+            known_hash = self.hashes.get(key)
+            if known_hash is not None and image_hash is not None and known_hash == image_hash:
+                continue
+            self.hashes.pop(key, None)
+            yield key, image_hash
+
+    def candidates(self, hashes: Sequence[Hash], max_distance: int) -> Mapping[Path, Hash]:
+        """
+        The known files which can be at most max_distance away from any of hashes. From a search
+        index, only the known files similar to one of hashes are read, otherwise all are returned.
+        """
+        if isinstance(self.hashes, SearchIndex):
+            return self.hashes.similar(
+                [image_hash for image_hash in hashes if isinstance(image_hash, ImageHash)],
+                max_distance
+            )
+        return self.hashes
+
+    def is_new(self, file: Path) -> bool:
+        return file not in self.hashes
+
+
+class KnownFilesByHash(NullKnownFiles):
+    """
+    The files stored before the scan with the same hash as a new file, looked up in the hash store
+    for each hash of a new file, so that only these are read. Files scanned again with the same
+    hash are known files, files whose hash has changed are new.
+    """
+
+    def __init__(self, hash_store: HashStore) -> None:
+        self.hash_store = hash_store
+        self.new_files: Set[Path] = set()
+        logging.info('Comparing new files to the known files with the same hash')
+
+    def new_hashes(self, hashes: Iterable[CacheEntry]) -> Iterator[CacheEntry]:
+        """
+        Leaves out the known files. The new files are returned under their key in the hash store,
+        so that new and known files are reported in the same form.
+        """
+        for file, image_hash in hashes:
+            key = self.hash_store.key(file)
+            if image_hash is not None and self.hash_store.stored_hash(key) == image_hash:
+                continue
+            self.new_files.add(key)
+            yield key, image_hash
+
+    def with_hash(self, image_hash: Hash) -> List[Path]:
+        """The known files with image_hash which still exist"""
+        return sorted(
+            file for file in self.hash_store.files_with_hash(image_hash)
+            if file not in self.new_files and file.exists()
+        )
+
+    def is_new(self, file: Path) -> bool:
+        return file in self.new_files
@@ -0,0 +1,55 @@
+"""
+Limiting the memory used by images decoded at the same time in several threads or processes
+"""
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from contextlib import contextmanager
+from multiprocessing import get_context
+from typing import Iterator
+
+from PIL import Image
+
+
+def decoded_size(image: Image.Image) -> int:
+    """
+    Estimated number of bytes needed to decode image, from the size and bands read from the file
+    header, after the image has been drafted to a reduced size
+    """
+    return image.width * image.height * len(image.getbands())
+
+
+class NullMemoryBudget:  # pylint: disable=too-few-public-methods
+    """Memory budget which lets all images be decoded at once"""
+
+    @contextmanager
+    def reserved(self, _: int) -> Iterator[None]:
+        yield
+
+
+class MemoryBudget(NullMemoryBudget):  # pylint: disable=too-few-public-methods
+    """
+    Lets images be decoded only while the sum of the reserved sizes of the images being decoded
+    stays within limit bytes, so that many small images are decoded at once but a few huge ones
+    are not. An image bigger than the limit is decoded when no other image is.
+    The counter and lock are shared memory, so that the budget can be passed to worker processes
+    when they are started.
+    """
+
+    def __init__(self, limit: int) -> None:
+        context = get_context('spawn')
+        self.limit = limit
+        self.condition = context.Condition()
+        self.in_use = context.RawValue('q', 0)
+
+    @contextmanager
+    def reserved(self, size: int) -> Iterator[None]:
+        size = min(size, self.limit)
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_use.value + size <= self.limit)
+            self.in_use.value += size
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_use.value -= size
+                self.condition.notify_all()
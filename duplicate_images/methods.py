@@ -16,8 +16,8 @@ from duplicate_images.common import path_with_parent
 from duplicate_images.function_types import ActionFunction, HashFunction, ImageGroup
 
 __all__ = [
-    'call', 'quote', 'get_hash_size_kwargs', 'IMAGE_HASH_ALGORITHM', 'ALGORITHM_DEFAULTS',
-    'ACTIONS_ON_EQUALITY'
+    'call', 'quote', 'get_hash_size_kwargs', 'get_draft_size', 'IMAGE_HASH_ALGORITHM',
+    'ALGORITHM_DEFAULTS', 'ACTIONS_ON_EQUALITY'
 ]
 
 
@@ -61,6 +61,17 @@ def get_hash_size_kwargs(algorithm: HashFunction, size: Optional[int]) -> Dict:
     return {} if kwarg == 'hash_func' else {kwarg: size}
 
 
+def get_draft_size(algorithm: HashFunction, hash_size_kwargs: Dict) -> Optional[int]:
+    """
+    Returns the side length of the image the algorithm scales its input down to, or None if the
+    hash depends on the original image size
+    """
+    input_size = ALGORITHM_INPUT_SIZE.get(algorithm)
+    if input_size is None:
+        return None
+    return input_size(hash_size_kwargs.get('hash_size', 8))
+
+
 IMAGE_HASH_ALGORITHM = {
     'ahash': imagehash.average_hash,
     'phash': imagehash.phash,
@@ -83,6 +94,16 @@ ALGORITHM_DEFAULTS: Dict[Callable, Dict[str, Union[int, HashFunction]]] = {
     imagehash.crop_resistant_hash: {'hash_func': imagehash.phash},
 }
 
+# whash scales to a power of 2 derived from the image size, colorhash and crop_resistant use the
+# full image
+ALGORITHM_INPUT_SIZE: Dict[Callable, Callable[[int], int]] = {
+    imagehash.average_hash: lambda hash_size: hash_size,
+    imagehash.phash: lambda hash_size: hash_size * 4,
+    imagehash.phash_simple: lambda hash_size: hash_size * 4,
+    imagehash.dhash: lambda hash_size: hash_size + 1,
+    imagehash.dhash_vertical: lambda hash_size: hash_size + 1,
+}
+
 ACTIONS_ON_EQUALITY: Dict[str, ActionFunction] = {
     'delete-first': lambda args, group: delete_with_log_message(group[0]),
     'd1': lambda args, group: delete_with_log_message(group[0]),
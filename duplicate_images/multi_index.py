@@ -0,0 +1,58 @@
+"""
+Multi-index hashing for finding image hashes within a small Hamming distance of each other
+"""
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from typing import Dict, List, Tuple
+
+from duplicate_images.bk_tree import hamming_distance
+
+
+def bit_blocks(num_bits: int, num_blocks: int) -> List[Tuple[int, int]]:
+    """(shift, mask) of num_blocks blocks of consecutive bits, as equal in size as possible"""
+    blocks: List[Tuple[int, int]] = []
+    start = 0
+    for block in range(num_blocks):
+        size = num_bits // num_blocks + (1 if block < num_bits % num_blocks else 0)
+        blocks.append((start, (1 << size) - 1))
+        start += size
+    return blocks
+
+
+class MultiIndex:
+    """
+    Splits the hashes of num_bits bits into max_distance + 1 blocks and keeps one dict per block
+    from the value of the block to the items with that value. By the pigeonhole principle, two
+    hashes at most max_distance apart are equal in at least one block, so only the items sharing a
+    block with the hash searched for are candidates whose distance needs to be checked.
+    Counts the candidates and the matches among them.
+    """
+
+    def __init__(self, num_bits: int, max_distance: int) -> None:
+        self.max_distance = max_distance
+        # if max_distance is not smaller than num_bits, the last block is empty and matches all
+        self.blocks = bit_blocks(num_bits, min(max_distance + 1, num_bits + 1))
+        self.tables: List[Dict[int, List[int]]] = [{} for _ in self.blocks]
+        self.values: Dict[int, int] = {}
+        self.num_candidates = 0
+        self.num_matches = 0
+
+    def add(self, value: int, item: int) -> None:
+        self.values[item] = value
+        for (shift, mask), table in zip(self.blocks, self.tables):
+            table.setdefault((value >> shift) & mask, []).append(item)
+
+    def find(self, value: int) -> List[int]:
+        """Returns all items whose value is at most max_distance away from value"""
+        candidates = {
+            item
+            for (shift, mask), table in zip(self.blocks, self.tables)
+            for item in table.get((value >> shift) & mask, ())
+        }
+        found = [
+            item for item in candidates
+            if hamming_distance(value, self.values[item]) <= self.max_distance
+        ]
+        self.num_candidates += len(candidates)
+        self.num_matches += len(found)
+        return found
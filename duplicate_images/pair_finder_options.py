@@ -5,11 +5,11 @@ __author__ = 'Lene Preuss <lene.preuss@gmail.com>'
 
 from argparse import Namespace
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, Optional, Tuple, Union
 
 
 @dataclass(frozen=True)
-class PairFinderOptions:
+class PairFinderOptions:  # pylint: disable=too-many-instance-attributes
     """
     Encapsulates the options for scanning images and detecting duplicates and
     reads them from an `argparse.Namespace` object
@@ -20,9 +20,46 @@ class PairFinderOptions:
     parallel: Optional[int] = None
     slow: bool = False
     group: bool = False
+    similarity_search: str = 'bktree'
+    parallel_mode: str = 'thread'
+    fast_decode: bool = False
+    exif_thumbnails: bool = False
+    trust_extensions: bool = False
+    stream: bool = False
+    group_linkage: str = 'single'
+    additional_algorithms: Tuple[str, ...] = ()
+    # only set if thumbnails are cached, the hashes are then calculated from the thumbnails
+    thumbnail_size: Optional[int] = None
+    detect_copies: bool = False
+    batch_hashing: bool = False
+    # MiB the images decoded at the same time may use
+    memory_budget: Optional[int] = None
+    # compare only the files not in the hash store yet to each other and to the stored ones
+    new_only: bool = False
+    # keep a search index for max_distance next to the hash store, read with new_only
+    search_index: bool = False
 
     @classmethod
     def from_args(cls, args: Namespace):
         return cls(
-            args.max_distance, args.hash_size, args.progress, args.parallel, args.slow, args.group
+            args.max_distance, args.hash_size, args.progress, args.parallel, args.slow, args.group,
+            args.similarity_search, args.parallel_mode, args.fast_decode, args.exif_thumbnails,
+            args.trust_extensions, args.stream, args.group_linkage,
+            tuple(args.additional_algorithms or ()),
+            args.thumbnail_size if args.thumbnail_cache else None, args.detect_copies,
+            args.batch_hashing, args.memory_budget, args.new_only,
+            args.search_index
         )
+
+
+def reduced_resolution_metadata(options: PairFinderOptions) -> Dict[str, Union[bool, int]]:
+    """
+    Hashes of images decoded at reduced resolution must not be mixed with full resolution ones in
+    the same hash store, so the options leading to them are stored as metadata
+    """
+    metadata: Dict[str, Union[bool, int]] = {
+        name: True for name in ('fast_decode', 'exif_thumbnails') if getattr(options, name)
+    }
+    if options.thumbnail_size is not None:
+        metadata['thumbnail_size'] = options.thumbnail_size
+    return metadata
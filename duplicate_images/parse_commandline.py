@@ -7,17 +7,27 @@ import logging
 from os import cpu_count
 from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter
 from configparser import ConfigParser
+from pathlib import Path
 from typing import List, Optional, Dict, Union
 
 from PIL import Image
 
-from duplicate_images.methods import ACTIONS_ON_EQUALITY, IMAGE_HASH_ALGORITHM, MOVE_ACTIONS
+from duplicate_images.batch_hash import BATCH_HASH_FUNCTION
+from duplicate_images.hash_scanner import PARALLEL_SCANNERS
+from duplicate_images.hash_store import SQLITE_SUFFIXES
+from duplicate_images.image_pair_finder import SIMILARITY_SEARCH
+from duplicate_images.methods import (
+    ACTIONS_ON_EQUALITY, IMAGE_HASH_ALGORITHM, MOVE_ACTIONS, get_draft_size, get_hash_size_kwargs
+)
+from duplicate_images.thumbnail_cache import DEFAULT_THUMBNAIL_SIZE
+from duplicate_images.union_find import LINKAGE
 
 DefaultsDict = Dict[str, Union[str, int, bool, None]]
 DEFAULTS: DefaultsDict = {
     'root_directory': '.',
     'exclude_dir': None,
     'algorithm': 'phash',
+    'additional_algorithms': None,
     'max_distance': 0,
     'hash_size': None,
     'on_equal': 'print',
@@ -25,13 +35,27 @@ DEFAULTS: DefaultsDict = {
     'move_to': None,
     'move_recreate_path': False,
     'parallel': None,
+    'parallel_mode': 'thread',
+    'batch_hashing': False,
+    'memory_budget': None,
     'parallel_actions': None,
     'slow': False,
+    'similarity_search': 'bktree',
     'group': False,
+    'group_linkage': 'single',
     'progress': False,
     'debug': False,
     'quiet': 0,
     'hash_db': None,
+    'new_only': False,
+    'search_index': False,
+    'fast_decode': False,
+    'exif_thumbnails': False,
+    'thumbnail_cache': None,
+    'thumbnail_size': DEFAULT_THUMBNAIL_SIZE,
+    'trust_extensions': False,
+    'detect_copies': False,
+    'stream': False,
     'max_image_pixels': None
 }
 
@@ -92,6 +116,12 @@ def create_main_parser(parent_parser: ArgumentParser, defaults: DefaultsDict) ->
         '--algorithm', choices=IMAGE_HASH_ALGORITHM.keys(),
         help='Method used to determine if two images are considered equal'
     )
+    parser.add_argument(
+        '--additional-algorithms', nargs='+', choices=IMAGE_HASH_ALGORITHM.keys(),
+        metavar='ALGORITHM',
+        help='Also calculate and store the hashes of these algorithms from the same decoded '
+             'images, so later runs with them can use the --hash-db (requires an SQLite --hash-db)'
+    )
     parser.add_argument(
         '--max-distance', type=int,
         help='Maximum hash distance for images to be considered equal'
@@ -120,10 +150,29 @@ def create_main_parser(parent_parser: ArgumentParser, defaults: DefaultsDict) ->
         '--parallel', nargs='?', type=int, const=cpu_count(),
         help=f'Calculate hashes using PARALLEL threads (default: {cpu_count()})'
     )
+    parser.add_argument(
+        '--parallel-mode', choices=PARALLEL_SCANNERS.keys(),
+        help='Calculate hashes with --parallel threads or processes (default: thread)'
+    )
+    parser.add_argument(
+        '--batch-hashing', action='store_true',
+        help='Calculate the hashes of the images each process handles at once in vectorized '
+             'operations (requires --parallel-mode process, supports ahash, dhash, '
+             'dhash_vertical and phash)'
+    )
+    parser.add_argument(
+        '--memory-budget', type=int, metavar='MIB',
+        help='Decode only as many images at the same time as fit into MIB megabytes, estimated '
+             'from their size in pixels (an image bigger than that is decoded alone)'
+    )
     parser.add_argument(
         '--parallel-actions', nargs='?', type=int, const=cpu_count(),
         help=f'Execute actions on equal images using PARALLEL threads (default: {cpu_count()})'
     )
+    parser.add_argument(
+        '--similarity-search', choices=SIMILARITY_SEARCH.keys(),
+        help='Method used to find similar images if --max-distance is greater than 0'
+    )
     group = parser.add_mutually_exclusive_group()
     group.add_argument(
         '--slow', action='store_true', help='Use slow (O(N^2)) algorithm'
@@ -132,6 +181,12 @@ def create_main_parser(parent_parser: ArgumentParser, defaults: DefaultsDict) ->
         '--group', action='store_true',
         help='Handle equal images in a group instead of multiple pairs'
     )
+    parser.add_argument(
+        '--group-linkage', choices=LINKAGE.keys(),
+        help='How similar images are grouped with --group and --max-distance: single (default) '
+             'merges all images connected by similar pairs, complete requires all images in a '
+             'group to be similar to each other'
+    )
     parser.add_argument(
         '--progress', action='store_true', help='Show progress bars during processing'
     )
@@ -144,6 +199,47 @@ def create_main_parser(parent_parser: ArgumentParser, defaults: DefaultsDict) ->
     parser.add_argument(
         '--hash-db', help='File storing precomputed hashes'
     )
+    parser.add_argument(
+        '--new-only', action='store_true',
+        help='Only compare the files not in the --hash-db yet, to each other and to the files '
+             'stored in it'
+    )
+    parser.add_argument(
+        '--search-index', action='store_true',
+        help='With --new-only, keep an index of the hashes in the --hash-db for the '
+             '--max-distance in a file next to it, so that not all stored hashes need to be read'
+    )
+    parser.add_argument(
+        '--fast-decode', action='store_true',
+        help='Decode JPEG and HEIF images at reduced resolution (slightly less accurate hashes)'
+    )
+    parser.add_argument(
+        '--exif-thumbnails', action='store_true',
+        help='Calculate hashes from the thumbnails embedded in the EXIF data, if present'
+    )
+    parser.add_argument(
+        '--thumbnail-cache',
+        help='File storing grayscale thumbnails of the images, from which hashes with other '
+             'algorithms or hash sizes are calculated without decoding the images again'
+    )
+    parser.add_argument(
+        '--thumbnail-size', type=int,
+        help=f'Side length of the thumbnails in the --thumbnail-cache '
+             f'(default: {DEFAULT_THUMBNAIL_SIZE})'
+    )
+    parser.add_argument(
+        '--trust-extensions', action='store_true',
+        help='Consider files with image file extensions images without checking their contents'
+    )
+    parser.add_argument(
+        '--detect-copies', action='store_true',
+        help='Find byte-identical copies of images by file size and content digest, and '
+             'calculate the image hash only once for all copies'
+    )
+    parser.add_argument(
+        '--stream', action='store_true',
+        help='Run the action on each match as soon as it is found, while the scan is still running'
+    )
     parser.add_argument(
         '--max-image-pixels', type=int,
         help=f'Maximum size of image in pixels (default: {Image.MAX_IMAGE_PIXELS})'
@@ -158,8 +254,19 @@ def check_complex_errors(namespace, parser):
         parser.error('--exec is only allowed with --on-equal exec')
     if namespace.algorithm == 'whash' and not is_power_of_2(namespace.hash_size):
         parser.error('whash requires hash_size to be a power of 2')
-    if namespace.group and namespace.max_distance:
-        parser.error('--max-distance: not allowed with argument --group')
+    if namespace.additional_algorithms and \
+            Path(namespace.hash_db or '').suffix not in SQLITE_SUFFIXES:
+        parser.error('--additional-algorithms requires a --hash-db ending in .sqlite or .db')
+    if namespace.thumbnail_cache:
+        check_thumbnail_errors(namespace, parser)
+    if namespace.parallel_mode == 'process' or namespace.batch_hashing:
+        check_process_errors(namespace, parser)
+    if namespace.memory_budget is not None and namespace.memory_budget <= 0:
+        parser.error('--memory-budget must be positive')
+    if namespace.hash_db or namespace.new_only or namespace.search_index:
+        check_hash_db_errors(namespace, parser)
+    if namespace.stream and (namespace.max_distance or namespace.slow):
+        parser.error('--stream is only allowed with --max-distance 0 and without --slow')
     if namespace.move_to and namespace.on_equal not in MOVE_ACTIONS:
         parser.error(f'--move-to requires --on-equal to be one of: {', '.join(MOVE_ACTIONS)}')
     if namespace.on_equal in MOVE_ACTIONS and not namespace.move_to:
@@ -168,3 +275,46 @@ def check_complex_errors(namespace, parser):
         parser.error(
             f'--move-recreate-path requires --on-equal to be one of: {', '.join(MOVE_ACTIONS)}'
         )
+
+
+def check_thumbnail_errors(namespace, parser):
+    """Only algorithms scaling the image down to a grayscale square can use the thumbnails"""
+    for name in [namespace.algorithm, *(namespace.additional_algorithms or [])]:
+        algorithm = IMAGE_HASH_ALGORITHM[name]
+        input_size = get_draft_size(
+            algorithm, get_hash_size_kwargs(algorithm, namespace.hash_size)
+        )
+        if input_size is None:
+            parser.error(f'--thumbnail-cache can not be used with {name}')
+        if input_size > namespace.thumbnail_size:
+            parser.error(
+                f'{name} with hash size {namespace.hash_size} needs a --thumbnail-size of at '
+                f'least {input_size}'
+            )
+
+
+def check_hash_db_errors(namespace, parser):
+    if Path(namespace.hash_db or '').suffix == '.dihash' and \
+            namespace.algorithm == 'crop_resistant':
+        parser.error('A --hash-db ending in .dihash can not be used with crop_resistant')
+    if namespace.new_only and (not namespace.hash_db or namespace.slow):
+        parser.error('--new-only requires --hash-db and is not allowed with --slow')
+    if namespace.search_index and (not namespace.new_only or not namespace.max_distance):
+        parser.error('--search-index requires --new-only, --hash-db and --max-distance')
+    if namespace.search_index and namespace.algorithm == 'crop_resistant':
+        parser.error('--search-index can not be used with crop_resistant')
+
+
+def check_process_errors(namespace, parser):
+    if namespace.batch_hashing:
+        check_batch_hashing_errors(namespace, parser)
+    if not namespace.parallel:
+        parser.error('--parallel-mode process requires --parallel')
+
+
+def check_batch_hashing_errors(namespace, parser):
+    if not namespace.parallel or namespace.parallel_mode != 'process':
+        parser.error('--batch-hashing requires --parallel and --parallel-mode process')
+    for name in [namespace.algorithm, *(namespace.additional_algorithms or [])]:
+        if IMAGE_HASH_ALGORITHM[name] not in BATCH_HASH_FUNCTION:
+            parser.error(f'--batch-hashing can not be used with {name}')
@@ -14,14 +14,15 @@ class ProgressBarManager:
     detection
     """
     @classmethod
-    def create(cls, files_length: int, active: bool = False) -> 'ProgressBarManager':
+    def create(cls, files_length: Optional[int], active: bool = False) -> 'ProgressBarManager':
         return ProgressBarManager(files_length) if active else NullProgressBarManager()
 
-    def __init__(self, files_length: int) -> None:
+    def __init__(self, files_length: Optional[int]) -> None:
+        """files_length is None if the number of files is not known in advance"""
         self.reader_progress: Optional[tqdm] = tqdm(
-            total=files_length, miniters=max(files_length / 100, 5), smoothing=0.1, unit='',
-            delay=0.1
-        ) if files_length else None
+            total=files_length, miniters=max((files_length or 0) / 100, 5), smoothing=0.1,
+            unit='', delay=0.1
+        ) if files_length != 0 else None
         self.filter_progress: Optional[tqdm] = None
 
     def create_filter_bar(self, hashes_length: int) -> None:
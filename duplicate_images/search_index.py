@@ -0,0 +1,296 @@
+"""
+Persistent multi-index of the hashes in a hash store, which finds the stored hashes similar to a
+few new ones without reading all of them
+"""
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+import logging
+import mmap
+from bisect import bisect_left
+from collections.abc import Mapping
+from math import prod
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy
+from imagehash import ImageHash
+
+from duplicate_images.common import (
+    decode_path, encode_path, hash_as_int, log_execution_time, read_header, write_header
+)
+from duplicate_images.function_types import Hash
+from duplicate_images.hash_matrix import distances, pack_hashes
+from duplicate_images.multi_index import bit_blocks
+
+StoreStat = Optional[Tuple[int, int, int]]
+
+# block values are reduced to 61 bits to fit into the tables, values which collide only add
+# candidates whose distance is checked anyway
+BLOCK_KEY_MODULUS = 2 ** 61 - 1
+
+
+def index_path(store_path: Path) -> Path:
+    return store_path.with_name(f'{store_path.name}.index')
+
+
+class NullSearchIndex:
+    """Search index that does not index anything, for hash stores without a search index"""
+
+    def add(self, _: Path, __: Hash) -> None:
+        pass
+
+    def write(self, _: StoreStat) -> None:
+        pass
+
+
+class SearchIndex(NullSearchIndex, Mapping):  # pylint: disable=too-many-instance-attributes
+    """
+    Multi-index of the hashes in a hash store for a maximum distance, kept in a file next to the
+    hash store. Like `MultiIndex`, the hashes are split into max_distance + 1 blocks of bits, and
+    the hashes similar to a hash are found among those sharing a block with it.
+    The file holds the packed hashes and their paths sorted by path and, for each block, the
+    values of the block in all hashes in sorted order along with the rows they belong to. It is
+    memory-mapped, so opening it takes the same time regardless of its size, and only the table
+    entries for the blocks of the hashes searched for are read.
+    Hashes added to the hash store are added to the index, which is written when the hash store is
+    closed. It is rebuilt from the hash store if it was written for other metadata or another
+    maximum distance, or if the hash store has been changed without it.
+    As a mapping, the index holds the hashes stored when it was opened.
+    """
+    MAGIC = b'DIINDEX1'
+
+    def __init__(
+            self, path: Path, metadata: Dict, store_stat: StoreStat,
+            stored_hashes: Callable[[], List[Tuple[Path, Hash]]]
+    ) -> None:
+        self.path = path
+        self.metadata = metadata
+        self.max_distance: int = metadata['max_distance']
+        self.store_stat = store_stat
+        self.hash_shape: Tuple[int, ...] = ()
+        self.blocks: List[Tuple[int, int]] = []
+        self.mapped: Union[bytes, mmap.mmap] = b''
+        self.hashes = numpy.zeros((0, 1), dtype='<u8')
+        self.table_values = numpy.zeros((0, 0), dtype='<u8')
+        self.table_rows = numpy.zeros((0, 0), dtype='<i8')
+        self.path_offsets = numpy.zeros(1, dtype='<u8')
+        self.path_data: Union[bytes, mmap.mmap] = b''
+        self.paths_start = 0
+        self.added: Dict[Path, ImageHash] = {}
+        # rows whose files have been added again, which are left out when writing the index
+        self.replaced: Set[int] = set()
+        # rows removed from the mapping by `pop()`, which are kept in the index
+        self.hidden: Set[int] = set()
+        self.dirty = False
+        self.lock = Lock()
+        try:
+            self.load()
+            logging.info('Opened search index %s with %d entries', path, len(self))
+        except (FileNotFoundError, ValueError) as error:
+            logging.info('Building search index %s: %s', path, error)
+            self.build(stored_hashes())
+
+    def __getitem__(self, file: Path) -> ImageHash:
+        row = self.visible_row(file)
+        if row is None:
+            raise KeyError(file)
+        return self.unpack(row)
+
+    def __contains__(self, file: object) -> bool:
+        return isinstance(file, Path) and self.visible_row(file) is not None
+
+    def __iter__(self) -> Iterator[Path]:
+        return (
+            decode_path(self.path_at(row)) for row in range(len(self.hashes))
+            if row not in self.hidden
+        )
+
+    def __len__(self) -> int:
+        return len(self.hashes) - len(self.hidden)
+
+    def pop(self, file: Path, default: Optional[ImageHash] = None) -> Optional[ImageHash]:
+        """Removes the hash of file from the mapping, but not from the index file"""
+        row = self.visible_row(file)
+        if row is None:
+            return default
+        self.hidden.add(row)
+        return self.unpack(row)
+
+    def add(self, file: Path, image_hash: Hash) -> None:
+        if not isinstance(image_hash, ImageHash):
+            raise ValueError(f'Not a fixed width image hash: {file}')
+        with self.lock:
+            row = self.find(encode_path(file))
+            if row is not None:
+                self.replaced.add(row)
+            self.added[file] = image_hash
+            self.dirty = True
+
+    def similar(self, hashes: Sequence[ImageHash], max_distance: int) -> Dict[Path, ImageHash]:
+        """The hashes in the mapping at most max_distance away from any of hashes"""
+        found: Set[int] = set()
+        num_candidates = 0
+        for image_hash in hashes:
+            rows = self.candidates(hash_as_int(image_hash))
+            num_candidates += len(rows)
+            if len(rows):
+                row_distances = distances(pack_hashes([image_hash]), self.hashes[rows])[0]
+                found.update(rows[row_distances <= max_distance].tolist())
+        found -= self.hidden
+        logging.info(
+            '%d of %d stored hashes share a block with %d hashes, %d of them are similar',
+            num_candidates, len(self), len(hashes), len(found)
+        )
+        return {decode_path(self.path_at(row)): self.unpack(row) for row in sorted(found)}
+
+    def candidates(self, value: int) -> numpy.ndarray:
+        """The rows sharing at least one block with the hash value"""
+        rows = []
+        for block, key in enumerate(self.block_keys([value])[0].tolist()):
+            start = numpy.searchsorted(self.table_values[block], key, side='left')
+            end = numpy.searchsorted(self.table_values[block], key, side='right')
+            rows.append(self.table_rows[block, start:end])
+        return numpy.unique(numpy.concatenate(rows)) if rows else numpy.zeros(0, dtype='<i8')
+
+    def block_keys(self, values: List[int]) -> numpy.ndarray:
+        return numpy.array(
+            [
+                [((value >> shift) & mask) % BLOCK_KEY_MODULUS for shift, mask in self.blocks]
+                for value in values
+            ], dtype='<u8'
+        ).reshape(len(values), len(self.blocks))
+
+    def set_hash_shape(self, hash_shape: Tuple[int, ...]) -> None:
+        self.hash_shape = hash_shape
+        num_bits = prod(hash_shape)
+        self.blocks = bit_blocks(num_bits, min(self.max_distance + 1, num_bits + 1))
+
+    def path_at(self, row: int) -> bytes:
+        start, end = self.path_offsets[row:row + 2].tolist()
+        return self.path_data[self.paths_start + start:self.paths_start + end]
+
+    def find(self, path: bytes) -> Optional[int]:
+        row = bisect_left(range(len(self.hashes)), path, key=self.path_at)
+        if row < len(self.hashes) and self.path_at(row) == path:
+            return row
+        return None
+
+    def visible_row(self, file: Path) -> Optional[int]:
+        row = self.find(encode_path(file))
+        return None if row is None or row in self.hidden else row
+
+    def unpack(self, row: int) -> ImageHash:
+        bits = numpy.unpackbits(self.hashes[row].view(numpy.uint8), count=prod(self.hash_shape))
+        return ImageHash(bits.reshape(self.hash_shape).astype(bool))
+
+    def row_keys(self) -> numpy.ndarray:
+        """The block values of each row, recovered from the tables"""
+        keys = numpy.zeros((len(self.hashes), len(self.blocks)), dtype='<u8')
+        for block in range(len(self.blocks)):
+            keys[self.table_rows[block], block] = self.table_values[block]
+        return keys
+
+    @log_execution_time()
+    def build(self, stored_hashes: List[Tuple[Path, Hash]]) -> None:
+        self.added = {}
+        for file, image_hash in stored_hashes:
+            self.add(file, image_hash)
+        self.set_entries([], self.hashes, self.table_values.T)
+        self.dirty = True
+
+    def set_entries(
+            self, paths: List[bytes], hashes: numpy.ndarray, keys: numpy.ndarray
+    ) -> None:
+        """
+        Sets the index to the given entries and the added ones, sorting them by path and sorting
+        the tables of block values
+        """
+        added_hashes = list(self.added.values())
+        if added_hashes and not self.hash_shape:
+            self.set_hash_shape(added_hashes[0].hash.shape)
+        if added_hashes:
+            paths = paths + [encode_path(file) for file in self.added]
+            added_packed = pack_hashes(added_hashes)
+            hashes = numpy.concatenate((hashes, added_packed)) if len(hashes) else added_packed
+            added_keys = self.block_keys([hash_as_int(image_hash) for image_hash in added_hashes])
+            keys = numpy.concatenate((keys.reshape(len(keys), len(self.blocks)), added_keys))
+        order = sorted(range(len(paths)), key=paths.__getitem__)
+        self.hashes = numpy.ascontiguousarray(hashes[order], dtype='<u8')
+        sorted_keys = keys[order]
+        rows = [
+            numpy.argsort(sorted_keys[:, block], kind='stable') for block in range(len(self.blocks))
+        ]
+        self.table_rows = numpy.array(rows, dtype='<i8').reshape(len(self.blocks), len(paths))
+        self.table_values = numpy.array(
+            [sorted_keys[block_rows, block] for block, block_rows in enumerate(rows)], dtype='<u8'
+        ).reshape(len(self.blocks), len(paths))
+        self.path_offsets = numpy.zeros(len(paths) + 1, dtype='<u8')
+        numpy.cumsum([len(paths[row]) for row in order], out=self.path_offsets[1:])
+        self.path_data = b''.join(paths[row] for row in order)
+        self.paths_start = 0
+        self.added = {}
+        self.replaced = set()
+        self.hidden = set()
+
+    @log_execution_time()
+    def load(self) -> None:
+        with self.path.open('rb') as file:
+            if file.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError(f'Not a search index: {self.path}')
+            self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header, offset = read_header(self.mapped, self.MAGIC)
+        if header['metadata'] != self.metadata:
+            raise ValueError(f'Metadata mismatch: {header['metadata']} != {self.metadata}')
+        if header['store_stat'] != (list(self.store_stat) if self.store_stat else None):
+            raise ValueError('Hash store changed since the search index was written')
+        count, words = header['count'], header['words']
+        if header['hash_shape']:
+            self.set_hash_shape(tuple(header['hash_shape']))
+        self.hashes = self.mapped_array('<u8', (count, words), offset)
+        offset += self.hashes.nbytes
+        self.table_values = self.mapped_array('<u8', (len(self.blocks), count), offset)
+        offset += self.table_values.nbytes
+        self.table_rows = self.mapped_array('<i8', (len(self.blocks), count), offset)
+        offset += self.table_rows.nbytes
+        self.path_offsets = self.mapped_array('<u8', (count + 1,), offset)
+        self.path_data = self.mapped
+        self.paths_start = offset + self.path_offsets.nbytes
+
+    def mapped_array(self, dtype: str, shape: Tuple[int, ...], offset: int) -> numpy.ndarray:
+        return numpy.frombuffer(
+            self.mapped, dtype=dtype, count=prod(shape), offset=offset
+        ).reshape(shape)
+
+    def write(self, store_stat: StoreStat) -> None:
+        """
+        Merges the added hashes into the index and writes it, recording the file stat of the hash
+        store written along with it
+        """
+        with self.lock:
+            if not self.dirty and store_stat == self.store_stat:
+                return
+            kept = numpy.ones(len(self.hashes), dtype=bool)
+            kept[list(self.replaced)] = False
+            kept_rows = numpy.flatnonzero(kept)
+            self.set_entries(
+                [self.path_at(row) for row in kept_rows.tolist()], self.hashes[kept_rows],
+                self.row_keys()[kept_rows]
+            )
+            self.store_stat = store_stat
+            temp_path = self.path.with_name(f'{self.path.name}.tmp')
+            self.dump(temp_path)
+            temp_path.replace(self.path)
+            self.dirty = False
+
+    @log_execution_time()
+    def dump(self, path: Path) -> None:
+        with path.open('wb') as file:
+            write_header(file, self.MAGIC, {
+                'metadata': self.metadata, 'store_stat': self.store_stat,
+                'count': len(self.hashes), 'words': self.hashes.shape[1],
+                'hash_shape': self.hash_shape
+            })
+            for array in (self.hashes, self.table_values, self.table_rows, self.path_offsets):
+                file.write(array.tobytes())
+            file.write(self.path_data)
@@ -0,0 +1,173 @@
+"""
+Persistent storage for small grayscale versions of the scanned images, from which image hashes
+can be calculated again without decoding the images
+"""
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+import json
+import logging
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy
+
+from duplicate_images.common import log_execution_time
+from duplicate_images.hash_store import FileStat, file_stat
+
+DEFAULT_THUMBNAIL_SIZE = 64
+
+
+class NullThumbnailCache:
+    """
+    Thumbnail cache that does not store anything but can be used in place of a
+    `ThumbnailCache` when no thumbnails are to be stored
+    """
+
+    def __enter__(self) -> 'NullThumbnailCache':
+        return self
+
+    def __exit__(self, _: Any, __: Any, ___: Any) -> None:
+        pass
+
+    def get(self, _: Path) -> Optional[numpy.ndarray]:
+        return None
+
+    def add(self, _: Path, __: numpy.ndarray) -> None:
+        pass
+
+
+class ThumbnailCache(NullThumbnailCache):
+    """
+    Stores a grayscale thumbnail of size x size pixels of each scanned image. The thumbnails are
+    appended to a file holding them as one packed array of size * size bytes per image, which is
+    memory-mapped for reading. The JSON index file next to it maps each image to its row in the
+    array and the size, modification time and inode of the image file, and a thumbnail is only
+    used if these are unchanged. Thumbnails of changed images are appended again, leaving the old
+    row unused.
+    The thumbnails are appended in batches of `FLUSH_ENTRIES`, so that they are not all kept in
+    memory during a scan. The index is written after every `FLUSH_ENTRIES` appended thumbnails,
+    growing to a tenth of the index size for large caches, and at exit. Thumbnails appended after
+    the last index was written are left unused if the scan is interrupted.
+    """
+    FLUSH_ENTRIES = 1000
+
+    @staticmethod
+    def create(cache_path: Optional[Path], size: Optional[int]) -> NullThumbnailCache:
+        if cache_path is None:
+            return NullThumbnailCache()
+        return ThumbnailCache(cache_path, size or DEFAULT_THUMBNAIL_SIZE)
+
+    def __init__(self, cache_path: Path, size: int = DEFAULT_THUMBNAIL_SIZE) -> None:
+        self.cache_path = cache_path
+        self.size = size
+        self.rows: Dict[Path, Tuple[int, FileStat]] = {}
+        self.pending: Dict[Path, Tuple[numpy.ndarray, FileStat]] = {}
+        self.thumbnails = numpy.zeros((0, size, size), dtype=numpy.uint8)
+        self.unindexed = 0
+        self.lock = Lock()
+        try:
+            self.load()
+            logging.info('Opened thumbnail cache %s with %d entries', cache_path, len(self))
+        except FileNotFoundError:
+            logging.info('Creating new thumbnail cache at %s', cache_path)
+
+    def __enter__(self) -> 'ThumbnailCache':
+        return self
+
+    def __exit__(self, _: Any, __: Any, ___: Any) -> None:
+        # rows are appended before the index referencing them is replaced, so writing is always safe
+        with self.lock:
+            if self.pending or self.unindexed:
+                self.write()
+
+    def __len__(self) -> int:
+        return len(self.rows) + len(self.pending)
+
+    def get(self, file: Path) -> Optional[numpy.ndarray]:
+        key = file.absolute()
+        stat = file_stat(key)
+        if stat is None:
+            return None
+        with self.lock:
+            if key in self.pending:
+                thumbnail, pending_stat = self.pending[key]
+                return thumbnail if pending_stat == stat else None
+            if key not in self.rows:
+                return None
+            row, stored_stat = self.rows[key]
+        if stored_stat != stat:
+            return None
+        return numpy.array(self.thumbnails[row])
+
+    def add(self, file: Path, thumbnail: numpy.ndarray) -> None:
+        if thumbnail.shape != (self.size, self.size):
+            raise ValueError(f'Thumbnail shape {thumbnail.shape} != {(self.size, self.size)}')
+        key = file.absolute()
+        stat = file_stat(key)
+        if stat is None:
+            return
+        with self.lock:
+            self.pending[key] = (thumbnail.astype(numpy.uint8), stat)
+            if len(self.pending) >= self.FLUSH_ENTRIES:
+                self.append_pending()
+                if self.unindexed >= max(self.FLUSH_ENTRIES, len(self.rows) // 10):
+                    self.write_index()
+
+    @property
+    def index_path(self) -> Path:
+        return self.cache_path.with_name(f'{self.cache_path.name}.json')
+
+    @log_execution_time()
+    def load(self) -> None:
+        with self.index_path.open('r') as file:
+            index = json.load(file)
+        if not isinstance(index, dict) or 'size' not in index or 'rows' not in index:
+            raise ValueError(f'Not a thumbnail cache index: {self.index_path}')
+        if index['size'] != self.size:
+            raise ValueError(f'Thumbnail size mismatch: {index['size']} != {self.size}')
+        self.map_thumbnails()
+        # rows beyond the end of the thumbnail file would be overwritten by the next thumbnails
+        self.rows = {
+            Path(path): (row, (size, mtime_ns, inode))
+            for path, (row, size, mtime_ns, inode) in index['rows'].items()
+            if row < len(self.thumbnails)
+        }
+
+    def map_thumbnails(self) -> None:
+        row_bytes = self.size * self.size
+        num_rows = self.cache_path.stat().st_size // row_bytes if self.cache_path.is_file() else 0
+        self.thumbnails = numpy.memmap(
+            self.cache_path, dtype=numpy.uint8, mode='r', shape=(num_rows, self.size, self.size)
+        ) if num_rows else numpy.zeros((0, self.size, self.size), dtype=numpy.uint8)
+
+    def write(self) -> None:
+        """Appends the pending thumbnails and writes the index, holding `self.lock`"""
+        self.append_pending()
+        self.write_index()
+
+    def append_pending(self) -> None:
+        """Appends the pending thumbnails to the thumbnail file, holding `self.lock`"""
+        num_rows = len(self.thumbnails)
+        new_rows: List[bytes] = []
+        for row, (key, (thumbnail, stat)) in enumerate(self.pending.items(), start=num_rows):
+            new_rows.append(thumbnail.tobytes())
+            self.rows[key] = (row, stat)
+        with self.cache_path.open('ab') as file:
+            # drop a partial row left by an interrupted write
+            file.truncate(num_rows * self.size * self.size)
+            file.write(b''.join(new_rows))
+        self.unindexed += len(new_rows)
+        self.pending.clear()
+        self.map_thumbnails()
+
+    def write_index(self) -> None:
+        """Replaces the index with one referencing all appended rows, holding `self.lock`"""
+        temp_path = self.index_path.with_name(f'{self.index_path.name}.tmp')
+        with temp_path.open('w') as file:
+            json.dump({
+                'size': self.size,
+                'rows': {str(key): [row, *stat] for key, (row, stat) in self.rows.items()}
+            }, file)
+        temp_path.replace(self.index_path)
+        self.unindexed = 0
@@ -0,0 +1,80 @@
+"""
+Merging pairs of similar images into clusters of images connected by chains of similar pairs
+"""
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+class UnionFind:
+    """
+    Disjoint set forest over the integers 0 to size - 1, stored in two arrays, with union by size
+    and path halving, so that merging and finding sets takes nearly constant time
+    """
+    __slots__ = ('parent', 'set_size')
+
+    def __init__(self, size: int) -> None:
+        self.parent = list(range(size))
+        self.set_size = [1] * size
+
+    def find(self, item: int) -> int:
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, item: int, other: int) -> None:
+        root, other_root = self.find(item), self.find(other)
+        if root == other_root:
+            return
+        if self.set_size[root] < self.set_size[other_root]:
+            root, other_root = other_root, root
+        self.parent[other_root] = root
+        self.set_size[root] += self.set_size[other_root]
+
+    def components(self) -> List[List[int]]:
+        """All sets with more than one element, each sorted, ordered by their smallest element"""
+        sets: Dict[int, List[int]] = {}
+        for item in range(len(self.parent)):
+            if self.set_size[self.find(item)] > 1:
+                sets.setdefault(self.find(item), []).append(item)
+        return list(sets.values())
+
+
+def connected_components(size: int, pairs: Iterable[Tuple[int, int]]) -> List[List[int]]:
+    """Clusters of the items 0 to size - 1 connected by the pairs, single linkage"""
+    union_find = UnionFind(size)
+    for item, other in pairs:
+        union_find.union(item, other)
+    return union_find.components()
+
+
+def complete_linkage(
+        component: List[int], are_similar: Callable[[int, int], bool]
+) -> List[List[int]]:
+    """
+    Splits component into clusters in which all items are similar to each other, greedily adding
+    each item to the first cluster it fits into
+    """
+    clusters: List[List[int]] = []
+    for item in component:
+        for cluster in clusters:
+            if all(are_similar(member, item) for member in cluster):
+                cluster.append(item)
+                break
+        else:
+            clusters.append([item])
+    return [cluster for cluster in clusters if len(cluster) > 1]
+
+
+def single_linkage(  # pylint: disable=unused-argument
+        component: List[int], are_similar: Callable[[int, int], bool]
+) -> List[List[int]]:
+    return [component]
+
+
+LINKAGE: Dict[str, Callable[[List[int], Callable[[int, int], bool]], List[List[int]]]] = {
+    'single': single_linkage,
+    'complete': complete_linkage,
+}
@@ -10,7 +10,9 @@ from unittest.mock import Mock, patch
 import pytest
 
 from duplicate_images.duplicate import get_matches
+from duplicate_images.hash_scanner.image_hasher import ImageHasher
 from duplicate_images.pair_finder_options import PairFinderOptions
+from duplicate_images.search_index import SearchIndex, index_path
 
 
 @pytest.mark.parametrize('test_set', ['equal_but_binary_different'])
@@ -122,7 +124,7 @@ def test_open_correct_file_format_but_metadata_empty(
 
 
 @pytest.mark.parametrize('test_set', ['different', 'equal_but_binary_different'])
-@pytest.mark.parametrize('file_type', ['pickle', 'json'])
+@pytest.mark.parametrize('file_type', ['pickle', 'json', 'dihash'])
 @pytest.mark.parametrize('algorithms', [('phash', 'ahash')])
 def test_opening_with_different_algorithm_leads_to_error(
         tmp_dir: Path, data_dir: Path, test_set: str, file_type: str, algorithms: Tuple[str, str]
@@ -134,7 +136,7 @@ def test_opening_with_different_algorithm_leads_to_error(
 
 
 @pytest.mark.parametrize('test_set', ['different', 'equal_but_binary_different'])
-@pytest.mark.parametrize('file_type', ['pickle', 'json'])
+@pytest.mark.parametrize('file_type', ['pickle', 'json', 'dihash'])
 @pytest.mark.parametrize('hash_size', [(8, 9)])
 def test_opening_with_different_algorithm_parameters_leads_to_error(
         tmp_dir: Path, data_dir: Path, test_set: str, file_type: str, hash_size: Tuple[int, int]
@@ -153,6 +155,82 @@ def test_opening_with_different_algorithm_parameters_leads_to_error(
         )
 
 
+@pytest.mark.parametrize('test_set', ['different', 'equal_but_binary_different'])
+@pytest.mark.parametrize('file_type', ['sqlite', 'db', 'dihash'])
+def test_hash_store_gives_same_results(
+        tmp_dir: Path, data_dir: Path, test_set: str, file_type: str
+) -> None:
+    cache_file = tmp_dir / f'hash_store.{file_type}'
+    expected = get_matches([data_dir / test_set], 'phash')
+    assert get_matches([data_dir / test_set], 'phash', hash_store_path=cache_file) == expected
+    with patch('imagehash.phash') as phash:
+        assert get_matches([data_dir / test_set], 'phash', hash_store_path=cache_file) == expected
+        assert phash.call_count == 0
+
+
+@pytest.mark.parametrize('test_set', ['different', 'equal_but_binary_different'])
+@pytest.mark.parametrize('options', [PairFinderOptions(), PairFinderOptions(hash_size=16)])
+def test_sqlite_store_holds_several_algorithms(
+        tmp_dir: Path, data_dir: Path, test_set: str, options: PairFinderOptions
+) -> None:
+    cache_file = tmp_dir / 'hash_store.sqlite'
+    for algorithm in ('phash', 'ahash'):
+        expected = get_matches([data_dir / test_set], algorithm, options)
+        assert get_matches(
+            [data_dir / test_set], algorithm, options, hash_store_path=cache_file
+        ) == expected
+        with patch.object(ImageHasher, 'open_image') as open_image:
+            assert get_matches(
+                [data_dir / test_set], algorithm, options, hash_store_path=cache_file
+            ) == expected
+            assert open_image.call_count == 0
+
+
+@pytest.mark.parametrize('parallel_mode', ['thread', 'process'])
+@pytest.mark.parametrize('test_set', ['different', 'equal_but_binary_different'])
+def test_additional_algorithms_are_stored(
+        tmp_dir: Path, data_dir: Path, test_set: str, parallel_mode: str
+) -> None:
+    cache_file = tmp_dir / 'hash_store.db'
+    get_matches(
+        [data_dir / test_set], 'phash',
+        PairFinderOptions(
+            parallel=2, parallel_mode=parallel_mode, additional_algorithms=('dhash', 'whash')
+        ),
+        hash_store_path=cache_file
+    )
+    for algorithm in ('phash', 'dhash', 'whash'):
+        expected = get_matches([data_dir / test_set], algorithm)
+        with patch.object(ImageHasher, 'open_image') as open_image:
+            assert get_matches(
+                [data_dir / test_set], algorithm, hash_store_path=cache_file
+            ) == expected
+            assert open_image.call_count == 0
+
+
+@pytest.mark.parametrize('parallel_mode', ['thread', 'process'])
+@pytest.mark.parametrize('test_set', ['different', 'equal_but_binary_different'])
+def test_hashes_are_calculated_from_cached_thumbnails(
+        tmp_dir: Path, data_dir: Path, test_set: str, parallel_mode: str
+) -> None:
+    thumbnail_cache = tmp_dir / f'thumbnails_{test_set}_{parallel_mode}'
+    options = PairFinderOptions(parallel=2, parallel_mode=parallel_mode, thumbnail_size=64)
+    get_matches([data_dir / test_set], 'phash', options, thumbnail_cache_path=thumbnail_cache)
+    for algorithm, hash_size in (('phash', 16), ('dhash', 8), ('ahash', 32)):
+        options = PairFinderOptions(
+            hash_size=hash_size, parallel=2, parallel_mode=parallel_mode, thumbnail_size=64
+        )
+        expected = get_matches(
+            [data_dir / test_set], algorithm, options,
+            thumbnail_cache_path=tmp_dir / f'{thumbnail_cache.name}_{algorithm}'
+        )
+        with patch.object(ImageHasher, 'open_image') as open_image:
+            assert get_matches(
+                [data_dir / test_set], algorithm, options, thumbnail_cache_path=thumbnail_cache
+            ) == expected
+            assert open_image.call_count == 0
+
+
 def check_garbage(
         temp_dir: Path, folder: Path, file_type: str, garbage_data: Any, message: Optional[str]
 ) -> None:
@@ -183,3 +261,46 @@ def encode_dict_keys_to_str(obj: Any) -> Any:
     if isinstance(obj, tuple):
         return tuple(encode_dict_keys_to_str(item) for item in obj)
     return obj
+
+
+@pytest.mark.parametrize('file_type', ['json', 'sqlite', 'dihash'])
+@pytest.mark.parametrize('max_distance', [0, 4])
+def test_new_only_compares_new_files_to_stored_ones(
+        tmp_dir: Path, data_dir: Path, file_type: str, max_distance: int
+) -> None:
+    cache_file = tmp_dir / f'hash_store_new_only_{max_distance}.{file_type}'
+    folders = [
+        data_dir / 'equal_but_binary_different' / name for name in ('jpeg_quality', 'jpeg_vs_heic')
+    ]
+    options = PairFinderOptions(max_distance=max_distance)
+    new_files = {file.resolve() for file in folders[1].iterdir()}
+    expected = {
+        frozenset(file.resolve() for file in pair)
+        for pair in get_matches(folders, 'phash', options)
+        if any(file.resolve() in new_files for file in pair)
+    }
+    get_matches(folders[:1], 'phash', options, hash_store_path=cache_file)
+    new_only = PairFinderOptions(max_distance=max_distance, new_only=True)
+    found = get_matches(folders[1:], 'phash', new_only, hash_store_path=cache_file)
+    assert expected
+    assert {frozenset(file.resolve() for file in pair) for pair in found} == expected
+
+
+@pytest.mark.parametrize('file_type', ['json', 'sqlite', 'dihash'])
+def test_search_index_finds_same_matches_as_stored_hashes(
+        tmp_dir: Path, data_dir: Path, file_type: str
+) -> None:
+    folders = [
+        data_dir / 'equal_but_binary_different' / name for name in ('jpeg_quality', 'jpeg_vs_heic')
+    ]
+    found = []
+    for search_index in (False, True):
+        cache_file = tmp_dir / f'hash_store_search_index_{search_index}.{file_type}'
+        options = PairFinderOptions(max_distance=4, new_only=True, search_index=search_index)
+        get_matches(folders[:1], 'phash', options, hash_store_path=cache_file)
+        assert index_path(cache_file).is_file() == search_index
+        with patch.object(SearchIndex, 'build') as build:
+            found.append(get_matches(folders[1:], 'phash', options, hash_store_path=cache_file))
+            build.assert_not_called()
+    assert found[0]
+    assert found[1] == found[0]
@@ -9,14 +9,18 @@ import pytest
 from PIL import Image
 from PIL.Image import DecompressionBombError
 
+from duplicate_images import hash_matrix
+from duplicate_images.hash_scanner import ImageHashScanner
 from duplicate_images.image_pair_finder import PairFinderOptions
 from duplicate_images.methods import IMAGE_HASH_ALGORITHM
 from duplicate_images.duplicate import (
-    files_in_dirs, is_image_file, get_matches, set_max_image_pixels
+    files_in_dirs, is_image_file, get_matches, set_max_image_pixels, stream_matches
 )
 from duplicate_images.parse_commandline import parse_command_line
 
 HUGE_IMAGE_SIZE = 20000 * 20000
+# decoding the test images at reduced resolution changes their hashes by at most this many bits
+FAST_DECODE_MAX_HASH_DIFFERENCE = 4
 
 
 @pytest.mark.parametrize('parallel', [True, False])
@@ -68,6 +72,26 @@ def test_similar_distance_matches(
     assert len(matches) == 1
 
 
+@pytest.mark.parametrize('similarity_search', ['bktree', 'vectorized', 'multiindex'])
+@pytest.mark.parametrize(
+    'algorithm,max_distance',
+    [('ahash', 14), ('dhash', 12), ('phash', 14), ('whash', 16)]
+)
+def test_similarity_search_gives_same_results_as_slow(
+        data_dir: Path, algorithm: str, max_distance: int, similarity_search: str
+) -> None:
+    folders = [data_dir / 'similar', data_dir / 'equal_but_binary_different']
+    expected = get_matches(
+        folders, algorithm, PairFinderOptions(slow=True, max_distance=max_distance)
+    )
+    matches = get_matches(
+        folders, algorithm, PairFinderOptions(
+            max_distance=max_distance, similarity_search=similarity_search
+        )
+    )
+    assert matches == expected
+
+
 @pytest.mark.parametrize('parallel', [True, False])
 @pytest.mark.parametrize('slow', [True, False])
 @pytest.mark.parametrize(
@@ -205,7 +229,36 @@ def test_multiple_images_appear_as_group(
     folders = [data_dir / 'equal_but_binary_different' / folder for folder in folders]
     matches = get_matches(folders, algorithm, PairFinderOptions(group=True, parallel=parallel))
     assert len(matches) == 1
-    assert len(matches[0]) == len(files_in_dirs(folders))
+    assert len(next(iter(matches))) == len(files_in_dirs(folders))
+
+
+@pytest.mark.parametrize('similarity_search', ['bktree', 'vectorized', 'multiindex'])
+@pytest.mark.parametrize('algorithm', ['ahash', 'phash'])
+def test_similar_images_appear_as_group_with_max_distance(
+        data_dir: Path, algorithm: str, similarity_search: str
+) -> None:
+    folder = data_dir / 'equal_but_binary_different'
+    options = PairFinderOptions(max_distance=4, similarity_search=similarity_search)
+    pairs = get_matches([folder], algorithm, options)
+    groups = get_matches(
+        [folder], algorithm,
+        PairFinderOptions(max_distance=4, similarity_search=similarity_search, group=True)
+    )
+    assert len(groups) < len(pairs)
+    assert {file for group in groups for file in group} == {file for pair in pairs for file in pair}
+
+
+@pytest.mark.parametrize('algorithm', ['ahash', 'phash'])
+def test_vectorized_search_in_parallel_processes_finds_same_pairs(
+        data_dir: Path, algorithm: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    folder = data_dir / 'equal_but_binary_different'
+    options = PairFinderOptions(max_distance=4, similarity_search='vectorized')
+    pairs = get_matches([folder], algorithm, options)
+    monkeypatch.setattr(hash_matrix, 'PARALLEL_MIN_HASHES', 0)
+    parallel_options = PairFinderOptions(max_distance=4, similarity_search='vectorized', parallel=2)
+    parallel_pairs = get_matches([folder], algorithm, parallel_options)
+    assert {frozenset(pair) for pair in parallel_pairs} == {frozenset(pair) for pair in pairs}
 
 
 @pytest.mark.parametrize('algorithm', ['ahash'])  # only one of each is needed, it works the same
@@ -240,3 +293,100 @@ def test_huge_image_succeeds_with_max_image_size_set(
     set_max_image_pixels(args)
     matches = get_matches([sub_folder], algorithm, PairFinderOptions.from_args(args))
     assert len(matches) == 1
+
+
+@pytest.mark.parametrize('algorithm', ['ahash', 'phash', 'whash'])
+def test_process_scanner_gives_same_results_as_thread_scanner(
+        data_dir: Path, algorithm: str
+) -> None:
+    folder = data_dir / 'equal_but_binary_different'
+    expected = get_matches([folder], algorithm, PairFinderOptions(parallel=2))
+    matches = get_matches(
+        [folder], algorithm, PairFinderOptions(parallel=2, parallel_mode='process')
+    )
+    assert matches == expected
+
+
+@pytest.mark.parametrize('algorithm', ['ahash', 'phash', 'dhash', 'dhash_vertical'])
+@pytest.mark.parametrize('test_set', ['equal_but_binary_different', 'similar', 'broken'])
+def test_batch_hashing_gives_same_results(data_dir: Path, algorithm: str, test_set: str) -> None:
+    folder = data_dir / test_set
+    expected = get_matches([folder], algorithm, PairFinderOptions(max_distance=8))
+    matches = get_matches(
+        [folder], algorithm,
+        PairFinderOptions(max_distance=8, parallel=2, parallel_mode='process', batch_hashing=True)
+    )
+    assert matches == expected
+
+
+@pytest.mark.parametrize(
+    'algorithm', ['ahash', 'phash', 'phash_simple', 'dhash', 'dhash_vertical']
+)
+def test_fast_decode_hashes_are_close_to_full_decode(data_dir: Path, algorithm: str) -> None:
+    image_files = sorted(files_in_dirs(
+        [data_dir / 'equal_but_binary_different', data_dir / 'similar'], is_image_file
+    ))
+    hash_algorithm = IMAGE_HASH_ALGORITHM[algorithm]
+    full_decode = ImageHashScanner(image_files, hash_algorithm).precalculate_hashes()
+    fast_decode = ImageHashScanner(
+        image_files, hash_algorithm, options=PairFinderOptions(fast_decode=True)
+    ).precalculate_hashes()
+    for (file, full_hash), (_, fast_hash) in zip(full_decode, fast_decode):
+        assert full_hash is not None and fast_hash is not None
+        assert full_hash - fast_hash <= FAST_DECODE_MAX_HASH_DIFFERENCE, file  # type: ignore
+
+
+@pytest.mark.parametrize('algorithm', ['ahash', 'phash', 'dhash'])
+@pytest.mark.parametrize('test_set', ['exactly_equal'])
+def test_fast_decode_finds_exactly_equal_images(
+        data_dir: Path, algorithm: str, test_set: str
+) -> None:
+    folder = data_dir / test_set
+    expected = get_matches([folder], algorithm)
+    assert get_matches([folder], algorithm, PairFinderOptions(fast_decode=True)) == expected
+
+
+@pytest.mark.parametrize('algorithm', ['ahash', 'phash'])
+@pytest.mark.parametrize('test_set', ['equal_but_binary_different', 'similar', 'broken'])
+def test_trust_extensions_gives_same_results(
+        data_dir: Path, algorithm: str, test_set: str
+) -> None:
+    folder = data_dir / test_set
+    expected = get_matches([folder], algorithm)
+    assert get_matches([folder], algorithm, PairFinderOptions(trust_extensions=True)) == expected
+
+
+@pytest.mark.parametrize('parallel_mode', ['thread', 'process'])
+@pytest.mark.parametrize('test_set', ['exactly_equal', 'equal_but_binary_different', 'broken'])
+def test_detect_copies_gives_same_results(
+        data_dir: Path, test_set: str, parallel_mode: str
+) -> None:
+    folder = data_dir / test_set
+    expected = get_matches([folder], 'phash')
+    assert get_matches(
+        [folder], 'phash',
+        PairFinderOptions(parallel=2, parallel_mode=parallel_mode, detect_copies=True)
+    ) == expected
+
+
+@pytest.mark.parametrize('parallel_mode', ['thread', 'process'])
+@pytest.mark.parametrize('group', [False, True])
+@pytest.mark.parametrize('test_set', ['equal_but_binary_different', 'exactly_equal'])
+def test_stream_gives_same_results(
+        data_dir: Path, test_set: str, group: bool, parallel_mode: str
+) -> None:
+    folder = data_dir / test_set
+    expected = get_matches([folder], 'phash', PairFinderOptions(group=group))
+    assert expected
+    streamed = list(stream_matches(
+        [folder], 'phash',
+        PairFinderOptions(group=group, parallel=2, parallel_mode=parallel_mode, stream=True)
+    ))
+    if group:
+        # each group is yielded again whenever it grows, the last time complete
+        complete_groups = {frozenset(result) for result in streamed} - {
+            frozenset(result[:-1]) for result in streamed
+        }
+        assert complete_groups == {frozenset(result) for result in expected}
+    else:
+        assert sorted(tuple(sorted(pair)) for pair in streamed) == sorted(expected)
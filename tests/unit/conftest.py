@@ -6,7 +6,7 @@ import shutil
 from io import BytesIO
 from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory, mkdtemp
-from typing import Generator, List, Tuple
+from typing import Generator, List
 from unittest.mock import Mock
 
 from pillow_heif import from_bytes, HeifFile
@@ -17,6 +17,8 @@ from wand.color import Color
 from wand.drawing import Drawing
 from wand.image import Image
 
+from duplicate_images.function_types import Results
+
 IMAGE_WIDTH = 40
 MOCK_IMAGE_HASH_VALUE = ImageHash(array([[True, True], [True, True]]))  # just some random value
 mock_algorithm = Mock(return_value=MOCK_IMAGE_HASH_VALUE)
@@ -118,7 +120,7 @@ def copy_image_file(file: Path, images: List[Path]) -> Path:
     return copied_file
 
 
-def is_pair_found(element1: Path, element2: Path, matches: List[Tuple[Path, Path]]) -> bool:
+def is_pair_found(element1: Path, element2: Path, matches: Results) -> bool:
     return (element1, element2) in matches or (element2, element1) in matches
 
 
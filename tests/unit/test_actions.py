@@ -57,7 +57,7 @@ def get_equals(equal_images: List[Path], group: bool) -> List[Tuple[Path, ...]]:
         equal_images, hash_algorithm, options=PairFinderOptions(group=group)
     ).get_equal_groups()
     assert len(equals) == 1
-    return equals
+    return list(equals)
 
 
 def paths_ascending_by_size(equals: Results):
@@ -0,0 +1,52 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from typing import List
+
+import numpy
+import pytest
+from PIL import Image
+from imagehash import ImageHash
+
+from duplicate_images.batch_hash import BATCH_HASH_FUNCTION, hash_pixels, resized_pixels
+from duplicate_images.methods import IMAGE_HASH_ALGORITHM
+
+BATCH_ALGORITHMS = [
+    name for name, algorithm in IMAGE_HASH_ALGORITHM.items() if algorithm in BATCH_HASH_FUNCTION
+]
+
+
+@pytest.fixture(name='images', scope='module')
+def fixture_images() -> List[Image.Image]:
+    rng = numpy.random.default_rng(1)
+    return [
+        Image.fromarray(rng.integers(0, 256, (*rng.integers(20, 200, 2), 3), dtype=numpy.uint8))
+        for _ in range(50)
+    ] + [Image.new('RGB', (50, 40), 'white'), Image.new('L', (30, 30), 5)]
+
+
+def test_supported_algorithms() -> None:
+    assert sorted(BATCH_ALGORITHMS) == ['ahash', 'dhash', 'dhash_vertical', 'phash']
+
+
+@pytest.mark.parametrize('algorithm', BATCH_ALGORITHMS)
+@pytest.mark.parametrize('hash_size', [2, 7, 8, 16])
+def test_batch_hashes_are_identical_to_imagehash(
+        images: List[Image.Image], algorithm: str, hash_size: int
+) -> None:
+    hash_function = IMAGE_HASH_ALGORITHM[algorithm]
+    kwargs = {'hash_size': hash_size}
+    batch_hashes = hash_pixels(
+        [resized_pixels(image, hash_function, kwargs) for image in images], hash_function, kwargs
+    )
+    for batch_hash, image in zip(batch_hashes, images):
+        expected = hash_function(image, **kwargs)
+        assert isinstance(expected, ImageHash)
+        assert batch_hash.hash.shape == expected.hash.shape
+        assert batch_hash == expected
+
+
+@pytest.mark.parametrize('algorithm', BATCH_ALGORITHMS)
+def test_too_small_hash_size_is_rejected(images: List[Image.Image], algorithm: str) -> None:
+    with pytest.raises(ValueError):
+        resized_pixels(images[0], IMAGE_HASH_ALGORITHM[algorithm], {'hash_size': 1})
@@ -0,0 +1,122 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+from imagehash import ImageHash
+from numpy.random import default_rng
+
+from duplicate_images.hash_store import BinaryHashStore, FileHashStore
+
+DEFAULT_ALGORITHM = 'phash'
+DEFAULT_HASH_SIZE = {'hash_size': 8}
+
+
+@pytest.fixture(name='sample_files')
+def fixture_sample_files(tmp_path: Path) -> List[Path]:
+    files = [tmp_path / f'image{i}.jpg' for i in range(20)]
+    for i, file in enumerate(files):
+        file.write_bytes(bytes(i))
+    return files
+
+
+def random_hashes(files: List[Path], shape: tuple = (8, 8)) -> Dict[Path, ImageHash]:
+    rng = default_rng(len(files))
+    return {file: ImageHash(rng.random(shape) > 0.5) for file in files}
+
+
+def create_store(store_path: Path, hashes: Dict[Path, ImageHash]) -> None:
+    with BinaryHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        for file, image_hash in hashes.items():
+            hash_store.add(file, image_hash)
+
+
+def test_create_selects_binary_store(tmp_path: Path) -> None:
+    hash_store = FileHashStore.create(
+        tmp_path / 'hashes.dihash', DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE
+    )
+    assert isinstance(hash_store, BinaryHashStore)
+
+
+@pytest.mark.parametrize('shape', [(8, 8), (16, 16), (14, 3)])
+def test_stored_hashes_are_read_back(
+        tmp_path: Path, sample_files: List[Path], shape: tuple
+) -> None:
+    store_path = tmp_path / 'hashes.dihash'
+    hashes = random_hashes(sample_files, shape)
+    create_store(store_path, hashes)
+    hash_store = BinaryHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+    assert len(hash_store) == len(sample_files)
+    assert not hash_store.values
+    for file, image_hash in hashes.items():
+        assert hash_store.get(file) == image_hash
+    assert hash_store.get(tmp_path / 'other.jpg') is None
+
+
+def test_added_hashes_are_merged_with_stored_hashes(
+        tmp_path: Path, sample_files: List[Path]
+) -> None:
+    store_path = tmp_path / 'hashes.dihash'
+    hashes = random_hashes(sample_files)
+    create_store(store_path, {file: hashes[file] for file in sample_files[::2]})
+    replaced = random_hashes(sample_files[:4])
+    create_store(store_path, {**{file: hashes[file] for file in sample_files[1::2]}, **replaced})
+    hash_store = BinaryHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+    assert len(hash_store) == len(sample_files)
+    for file, image_hash in {**hashes, **replaced}.items():
+        assert hash_store.get(file) == image_hash
+
+
+def test_items_are_stored_and_added_hashes(tmp_path: Path, sample_files: List[Path]) -> None:
+    store_path = tmp_path / 'hashes.dihash'
+    hashes = random_hashes(sample_files)
+    create_store(store_path, {file: hashes[file] for file in sample_files[::2]})
+    replaced = random_hashes(sample_files[:4])
+    with BinaryHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        for file in sample_files[1::2]:
+            hash_store.add(file, hashes[file])
+        for file, image_hash in replaced.items():
+            hash_store.add(file, image_hash)
+        assert dict(hash_store.items()) == {**hashes, **replaced}
+        assert len(hash_store.items()) == len(sample_files)
+
+
+def test_hash_of_modified_file_is_not_used(tmp_path: Path, sample_files: List[Path]) -> None:
+    store_path = tmp_path / 'hashes.dihash'
+    create_store(store_path, random_hashes(sample_files))
+    sample_files[0].write_bytes(b'modified')
+    hash_store = BinaryHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+    assert hash_store.get(sample_files[0]) is None
+    assert hash_store.get(sample_files[1]) is not None
+
+
+def test_relative_paths_are_found(
+        tmp_path: Path, sample_files: List[Path], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    store_path = tmp_path / 'hashes.dihash'
+    hashes = random_hashes(sample_files)
+    create_store(store_path, hashes)
+    monkeypatch.chdir(tmp_path)
+    hash_store = BinaryHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+    assert hash_store.get(Path(sample_files[0].name)) == hashes[sample_files[0]]
+
+
+def test_metadata_mismatch_raises_error(tmp_path: Path, sample_files: List[Path]) -> None:
+    store_path = tmp_path / 'hashes.dihash'
+    create_store(store_path, random_hashes(sample_files))
+    with pytest.raises(ValueError, match='Metadata mismatch'):
+        BinaryHashStore(store_path, DEFAULT_ALGORITHM, {'hash_size': 16})
+
+
+def test_invalid_file_raises_error(tmp_path: Path) -> None:
+    store_path = tmp_path / 'hashes.dihash'
+    store_path.write_text('garbage')
+    with pytest.raises(ValueError, match='Not a binary hash store'):
+        BinaryHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+
+
+def test_variable_width_hashes_are_rejected(tmp_path: Path) -> None:
+    with pytest.raises(ValueError, match='fixed width'):
+        BinaryHashStore(tmp_path / 'hashes.dihash', 'crop_resistant', {})
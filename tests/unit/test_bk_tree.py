@@ -0,0 +1,34 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from random import Random
+
+import pytest
+
+from duplicate_images.bk_tree import BKTree, hamming_distance
+
+
+def test_empty_tree_finds_nothing() -> None:
+    assert not BKTree().find(0, 64)
+
+
+def test_equal_values_are_found_at_distance_0() -> None:
+    tree = BKTree()
+    tree.add(0b1010, 1)
+    tree.add(0b1010, 2)
+    assert sorted(tree.find(0b1010, 0)) == [1, 2]
+
+
+@pytest.mark.parametrize('max_distance', [0, 1, 2, 5, 10])
+def test_find_gives_same_result_as_exhaustive_search(max_distance: int) -> None:
+    random = Random(max_distance)  # noqa: S311
+    values = [random.getrandbits(16) for _ in range(500)]
+    tree = BKTree()
+    for index, value in enumerate(values):
+        tree.add(value, index)
+    for value in values[:50]:
+        expected = [
+            index for index, other in enumerate(values)
+            if hamming_distance(value, other) <= max_distance
+        ]
+        assert sorted(tree.find(value, max_distance)) == expected
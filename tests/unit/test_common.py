@@ -0,0 +1,61 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from threading import Event
+from typing import Iterator
+
+import pytest
+
+from duplicate_images.common import prefetched
+
+
+def test_prefetched_preserves_order() -> None:
+    assert list(prefetched(range(1000), 10)) == list(range(1000))
+
+
+def test_prefetched_empty() -> None:
+    assert not list(prefetched([], 10))
+
+
+def test_prefetched_reraises_producer_exception() -> None:
+    def failing() -> Iterator[int]:
+        yield 1
+        raise OSError('walk failed')
+
+    items = prefetched(failing(), 10)
+    assert next(items) == 1
+    with pytest.raises(OSError, match='walk failed'):
+        next(items)
+
+
+def test_prefetched_does_not_run_ahead_more_than_size() -> None:
+    produced = []
+
+    def counting() -> Iterator[int]:
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    items = prefetched(counting(), 5)
+    assert next(items) == 0
+    items.close()
+    # queue size, the item being put and the item handed to the consumer
+    assert len(produced) <= 5 + 2
+
+
+def test_prefetched_stops_producer_when_closed() -> None:
+    finished = Event()
+
+    def endless() -> Iterator[int]:
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+        finally:
+            finished.set()
+
+    items = prefetched(endless(), 2)
+    assert next(items) == 0
+    items.close()
+    assert finished.wait(timeout=5)
@@ -0,0 +1,151 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from pathlib import Path
+from threading import Event, Thread
+from unittest.mock import patch
+
+import pytest
+
+from duplicate_images import copy_detector
+from duplicate_images.copy_detector import (
+    PARTIAL_DIGEST_SIZE, CopyDetector, full_digest, partial_digest
+)
+
+
+def write(path: Path, contents: bytes) -> Path:
+    path.write_bytes(contents)
+    return path
+
+
+@pytest.mark.parametrize('size', [0, 100, PARTIAL_DIGEST_SIZE + 1, 2 * PARTIAL_DIGEST_SIZE])
+def test_partial_digest_covers_small_files_completely(tmp_path: Path, size: int) -> None:
+    file = write(tmp_path / 'file', bytes(size))
+    other = write(tmp_path / 'other', bytes(size - 1) + b'\x01' if size else b'\x01')
+    assert partial_digest(file) != partial_digest(other)
+
+
+def test_partial_digest_ignores_middle_of_big_files(tmp_path: Path) -> None:
+    size = 3 * PARTIAL_DIGEST_SIZE
+    file = write(tmp_path / 'file', bytes(size))
+    middle = bytearray(size)
+    middle[size // 2] = 1
+    other = write(tmp_path / 'other', bytes(middle))
+    assert partial_digest(file) == partial_digest(other)
+    assert full_digest(file) != full_digest(other)
+
+
+def test_copies_are_found(tmp_path: Path) -> None:
+    detector = CopyDetector()
+    original = write(tmp_path / 'original', b'image')
+    copy = write(tmp_path / 'copy', b'image')
+    assert detector.original_of(original) is None
+    assert detector.original_of(copy) == original
+    assert detector.num_copies == 1
+
+
+def test_files_of_same_size_with_different_contents_are_no_copies(tmp_path: Path) -> None:
+    detector = CopyDetector()
+    assert detector.original_of(write(tmp_path / 'original', b'image')) is None
+    assert detector.original_of(write(tmp_path / 'other', b'photo')) is None
+    assert detector.num_copies == 0
+
+
+def test_files_of_unique_size_are_not_read(tmp_path: Path) -> None:
+    detector = CopyDetector()
+    with patch.object(copy_detector, 'partial_digest') as digest:
+        for size in range(10):
+            assert detector.original_of(write(tmp_path / f'file{size}', bytes(size))) is None
+        digest.assert_not_called()
+
+
+def test_full_digest_is_only_calculated_if_partial_digests_are_equal(tmp_path: Path) -> None:
+    detector = CopyDetector()
+    with patch.object(copy_detector, 'full_digest') as digest:
+        detector.original_of(write(tmp_path / 'original', b'image'))
+        detector.original_of(write(tmp_path / 'other', b'photo'))
+        digest.assert_not_called()
+
+
+def test_copies_get_hashes_of_original(tmp_path: Path) -> None:
+    detector = CopyDetector()
+    original = write(tmp_path / 'original', b'image')
+    detector.original_of(original)
+    assert not detector.is_resolved(original)
+    detector.set_hashes(original, [None])
+    assert detector.is_resolved(original)
+    assert detector.hashes_of(original) == [None]
+
+
+def test_missing_file_is_no_copy(tmp_path: Path) -> None:
+    detector = CopyDetector()
+    original = write(tmp_path / 'original', b'image')
+    copy = write(tmp_path / 'copy', b'image')
+    detector.original_of(original)
+    original.unlink()
+    assert detector.original_of(copy) is None
+    assert detector.original_of(tmp_path / 'missing') is None
+
+
+def test_files_of_other_sizes_are_not_blocked_by_comparison(tmp_path: Path) -> None:
+    detector = CopyDetector()
+    detector.original_of(write(tmp_path / 'original', b'image'))
+    started, release = Event(), Event()
+
+    def blocking_digest(file: Path) -> bytes:
+        started.set()
+        release.wait(5)
+        return full_digest(file)
+
+    with patch.object(copy_detector, 'full_digest', side_effect=blocking_digest):
+        copy = Thread(target=detector.original_of, args=(write(tmp_path / 'copy', b'image'),))
+        copy.start()
+        assert started.wait(5)
+        other = Thread(target=detector.original_of, args=(write(tmp_path / 'other', b'photos'),))
+        other.start()
+        other.join(1)
+        assert not other.is_alive()
+        release.set()
+        copy.join()
+    assert detector.num_copies == 1
+
+
+def test_files_of_same_size_are_not_blocked_by_comparison(tmp_path: Path) -> None:
+    detector = CopyDetector()
+    detector.original_of(write(tmp_path / 'original', b'image'))
+    started, release = Event(), Event()
+
+    def blocking_digest(file: Path) -> bytes:
+        started.set()
+        release.wait(5)
+        return full_digest(file)
+
+    with patch.object(copy_detector, 'full_digest', side_effect=blocking_digest):
+        copy = Thread(target=detector.original_of, args=(write(tmp_path / 'copy', b'image'),))
+        copy.start()
+        assert started.wait(5)
+        other = Thread(target=detector.original_of, args=(write(tmp_path / 'other', b'photo'),))
+        other.start()
+        other.join(1)
+        assert not other.is_alive()
+        release.set()
+        copy.join()
+    assert detector.num_copies == 1
+
+
+def test_copy_is_found_among_originals_of_same_size(tmp_path: Path) -> None:
+    detector = CopyDetector()
+    originals = [write(tmp_path / f'original{i}', bytes([i]) * 10) for i in range(5)]
+    for original in originals:
+        assert detector.original_of(original) is None
+    with patch.object(copy_detector, 'full_digest', side_effect=full_digest) as digest:
+        assert detector.original_of(write(tmp_path / 'copy', bytes([2]) * 10)) == originals[2]
+        assert sorted(call.args[0].name for call in digest.call_args_list) == ['copy', 'original2']
+
+
+def test_unreadable_original_can_get_hashes(tmp_path: Path) -> None:
+    detector = CopyDetector()
+    missing = tmp_path / 'missing'
+    assert detector.original_of(missing) is None
+    detector.set_hashes(missing, [None])
+    assert detector.hashes_of(missing) == [None]
@@ -1,14 +1,19 @@
 # pylint: disable=missing-docstring
 __author__ = 'Lene Preuss <lene.preuss@gmail.com>'
 
+import builtins
+from io import BytesIO
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import Generator
 from unittest.mock import patch
 
 import pytest
+from PIL import Image
 
-from duplicate_images.duplicate import files_in_dirs, is_image_file
+from duplicate_images.duplicate import (
+    files_in_dirs, has_image_extension, is_image_file, is_image_header, walk_files
+)
 from .conftest import create_image
 
 NUM_NUMBERED_FILES = 3
@@ -70,6 +75,44 @@ def test_files_in_dirs_with_arbitrary_condition(filled_folder: Path) -> None:
     assert '2.txt' == found[0].name
 
 
+def test_files_in_dirs_excludes_only_files_directly_in_matching_subdir(tmp_path: Path) -> None:
+    (tmp_path / '1' / 'nested').mkdir(parents=True)
+    (tmp_path / '1' / '1.txt').touch()
+    (tmp_path / '1' / 'nested' / '2.txt').touch()
+    found = files_in_dirs([tmp_path], exclude_regexes=['/1$'])
+    assert found == [tmp_path / '1' / 'nested' / '2.txt']
+
+
+def test_files_in_dirs_finds_files_in_deeply_nested_dirs(tmp_path: Path) -> None:
+    folder = tmp_path
+    expected = []
+    for depth in range(10):
+        folder = folder / str(depth)
+        folder.mkdir()
+        expected.append(folder / f'{depth}.txt')
+        expected[-1].touch()
+    assert sorted(files_in_dirs([tmp_path])) == sorted(expected)
+
+
+def test_files_in_dirs_does_not_follow_symlinked_dirs(tmp_path: Path) -> None:
+    (tmp_path / 'folder').mkdir()
+    (tmp_path / 'folder' / '1.txt').touch()
+    (tmp_path / 'link').symlink_to(tmp_path / 'folder', target_is_directory=True)
+    assert files_in_dirs([tmp_path]) == [tmp_path / 'folder' / '1.txt']
+
+
+def test_files_in_dirs_ignores_missing_root_dir(tmp_path: Path) -> None:
+    assert not files_in_dirs([tmp_path / 'missing'])
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_walk_files_yields_files_from_all_roots(filled_folder: Path, threads: int) -> None:
+    roots = [filled_folder / str(i) for i in range(NUM_NUMBERED_FILES)]
+    found = walk_files(roots, threads=threads)
+    assert not isinstance(found, list)
+    assert sorted(found) == sorted(filled_folder.glob('?/?.txt'))
+
+
 def test_is_image_file_empty_file(filled_folder: Path) -> None:
     assert not is_image_file(filled_folder / '1' / '1.txt')
 
@@ -85,3 +128,48 @@ def test_is_image_file_with_os_failure(temp_dir: Path, extension: str) -> None:
     create_image(temp_dir / f'1.{extension}', TEST_IMAGE_WIDTH)
     with patch('builtins.open', side_effect=OSError()):
         assert not is_image_file(temp_dir / f'1.{extension}')
+
+
+def image_bytes(image_format: str) -> bytes:
+    buffer = BytesIO()
+    Image.new('RGB', (TEST_IMAGE_WIDTH, TEST_IMAGE_WIDTH)).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('image_format', ['JPEG', 'PNG', 'GIF', 'BMP', 'TIFF', 'WEBP'])
+def test_is_image_header_recognizes_images(image_format: str) -> None:
+    assert is_image_header(image_bytes(image_format))
+
+
+@pytest.mark.parametrize('header', [b'', b'not an image', b'%PDF-1.4'])
+def test_is_image_header_rejects_other_files(header: bytes) -> None:
+    assert not is_image_header(header)
+
+
+def test_is_image_file_opens_file_once(tmp_path: Path) -> None:
+    image_file = tmp_path / 'image'
+    image_file.write_bytes(image_bytes('PNG'))
+    with patch('builtins.open', wraps=builtins.open) as mock_open:
+        assert is_image_file(image_file)
+        assert mock_open.call_count == 1
+
+
+@pytest.mark.parametrize('extension', ['.jpg', '.JPEG', '.png', '.heic', '.webp'])
+def test_has_image_extension_does_not_open_file(tmp_path: Path, extension: str) -> None:
+    image_file = tmp_path / f'image{extension}'
+    image_file.touch()
+    with patch('builtins.open', side_effect=OSError()):
+        assert has_image_extension(image_file)
+
+
+def test_has_image_extension_checks_contents_of_other_files(tmp_path: Path) -> None:
+    (tmp_path / 'image.dat').write_bytes(image_bytes('PNG'))
+    (tmp_path / 'text.txt').write_text('not an image')
+    assert has_image_extension(tmp_path / 'image.dat')
+    assert not has_image_extension(tmp_path / 'text.txt')
+
+
+def test_has_image_extension_skips_symlinks(tmp_path: Path) -> None:
+    (tmp_path / 'image.jpg').touch()
+    (tmp_path / 'link.jpg').symlink_to(tmp_path / 'image.jpg')
+    assert not has_image_extension(tmp_path / 'link.jpg')
@@ -0,0 +1,84 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from itertools import combinations
+from typing import List
+
+import numpy
+import pytest
+from imagehash import ImageHash
+
+from duplicate_images.hash_matrix import (
+    distances, matching_indices, matching_pairs, pack_hashes, shards
+)
+from duplicate_images import hash_matrix
+
+
+def random_hashes(num_hashes: int, hash_size: int) -> List[ImageHash]:
+    rng = numpy.random.default_rng(hash_size)
+    return [
+        ImageHash(rng.integers(0, 2, (hash_size, hash_size)).astype(bool))
+        for _ in range(num_hashes)
+    ]
+
+
+@pytest.mark.parametrize('hash_size', [2, 8, 9, 16])
+def test_packed_hashes_have_one_row_per_hash(hash_size: int) -> None:
+    packed = pack_hashes(random_hashes(10, hash_size))
+    assert packed.dtype == numpy.uint64
+    assert packed.shape == (10, (hash_size * hash_size + 63) // 64)
+
+
+@pytest.mark.parametrize('hash_size', [2, 8, 9, 16])
+def test_distances_equal_image_hash_distance(hash_size: int) -> None:
+    hashes = random_hashes(20, hash_size)
+    packed = pack_hashes(hashes)
+    calculated = distances(packed, packed)
+    for i, j in combinations(range(len(hashes)), 2):
+        assert calculated[i, j] == hashes[i] - hashes[j]
+
+
+@pytest.mark.parametrize('max_distance', [0, 28, 32, 36])
+@pytest.mark.parametrize('block_words', [1, 7, 1024])
+def test_matching_pairs_independent_of_block_size(
+        monkeypatch: pytest.MonkeyPatch, max_distance: int, block_words: int
+) -> None:
+    hashes = random_hashes(50, 8)
+    expected = [
+        (i, j) for i, j in combinations(range(len(hashes)), 2)
+        if hashes[i] - hashes[j] <= max_distance
+    ]
+    monkeypatch.setattr(hash_matrix, 'BLOCK_WORDS', block_words)
+    assert list(matching_pairs(pack_hashes(hashes), max_distance)) == expected
+
+
+def test_pack_empty_list() -> None:
+    assert not list(matching_pairs(pack_hashes([]), 1))
+
+
+@pytest.mark.parametrize('num_rows', [0, 1, 2, 10, 1000])
+@pytest.mark.parametrize('num_shards', [1, 3, 16])
+def test_shards_cover_all_rows(num_rows: int, num_shards: int) -> None:
+    rows = [row for start, end in shards(num_rows, num_shards) for row in range(start, end)]
+    assert rows == list(range(num_rows))
+    assert len(shards(num_rows, num_shards)) <= num_shards
+
+
+def test_shards_compare_about_same_number_of_pairs() -> None:
+    num_rows = 1000
+    pairs = [
+        sum(num_rows - 1 - row for row in range(start, end))
+        for start, end in shards(num_rows, 8)
+    ]
+    assert len(pairs) == 8
+    assert max(pairs) - min(pairs) < 2 * num_rows
+
+
+@pytest.mark.parametrize('max_distance', [0, 28, 36])
+def test_parallel_matching_indices_equal_sequential(
+        monkeypatch: pytest.MonkeyPatch, max_distance: int
+) -> None:
+    hashes = random_hashes(50, 8)
+    expected = matching_indices(hashes, max_distance)
+    monkeypatch.setattr(hash_matrix, 'PARALLEL_MIN_HASHES', 0)
+    assert matching_indices(hashes, max_distance, processes=2) == expected
@@ -5,14 +5,22 @@ from pathlib import Path
 from typing import Callable, List
 
 import pytest
+from imagehash import ImageHash
+from numpy import array
 
-from duplicate_images.hash_scanner import ImageHashScanner, ParallelImageHashScanner
+from duplicate_images.hash_scanner import (
+    ImageHashScanner, ParallelImageHashScanner, ProcessImageHashScanner
+)
+from duplicate_images.hash_scanner.image_hasher import pack_hash, unpack_hash
 from duplicate_images.methods import IMAGE_HASH_ALGORITHM, ALGORITHM_DEFAULTS, get_hash_size_kwargs
+from duplicate_images.pair_finder_options import PairFinderOptions
 from .conftest import mock_algorithm, MOCK_IMAGE_HASH_VALUE
 
 
 @pytest.mark.parametrize('algorithm', list(IMAGE_HASH_ALGORITHM.keys()))
-@pytest.mark.parametrize('scanner_class', [ImageHashScanner, ParallelImageHashScanner])
+@pytest.mark.parametrize(
+    'scanner_class', [ImageHashScanner, ParallelImageHashScanner, ProcessImageHashScanner]
+)
 @pytest.mark.parametrize('hash_size', [4, 7, 9])
 def test_different_hash_size_sets_options(
         algorithm: str, scanner_class: Callable, hash_size: int
@@ -35,3 +43,39 @@ def test_hash_values_correct(image_files: List[Path], scanner_class: Callable) -
     scanner = scanner_class(image_files, mock_algorithm)
     for cache_entry in scanner.precalculate_hashes():
         assert cache_entry[1] == MOCK_IMAGE_HASH_VALUE
+
+
+@pytest.mark.parametrize('algorithm', ['ahash', 'phash', 'colorhash', 'crop_resistant'])
+def test_process_scanner_calculates_same_hashes(image_files: List[Path], algorithm: str) -> None:
+    expected = ImageHashScanner(image_files, IMAGE_HASH_ALGORITHM[algorithm]).precalculate_hashes()
+    scanner = ProcessImageHashScanner(image_files, IMAGE_HASH_ALGORITHM[algorithm], parallel=2)
+    assert [(file, str(image_hash)) for file, image_hash in scanner.precalculate_hashes()] == [
+        (file, str(image_hash)) for file, image_hash in expected
+    ]
+
+
+@pytest.mark.parametrize('shape', [(8, 8), (14, 3), (4, 4)])
+def test_pack_hash_roundtrip(shape: tuple) -> None:
+    image_hash = ImageHash(
+        array([[(x * y) % 3 == 0 for y in range(shape[1])] for x in range(shape[0])])
+    )
+    assert unpack_hash(pack_hash(image_hash)) == image_hash
+    assert unpack_hash(pack_hash(None)) is None
+
+
+@pytest.mark.parametrize(
+    'algorithm,hash_size,draft_size',
+    [('ahash', 8, 8), ('phash', 8, 32), ('phash', 16, 64), ('dhash', 8, 9), ('whash', 8, None),
+     ('colorhash', 3, None), ('crop_resistant', None, None)]
+)
+def test_fast_decode_sets_draft_size(algorithm: str, hash_size: int, draft_size: int) -> None:
+    hash_algorithm = IMAGE_HASH_ALGORITHM[algorithm]
+    hash_size_kwargs = get_hash_size_kwargs(hash_algorithm, hash_size)
+    scanner = ImageHashScanner(
+        [], hash_algorithm, hash_size_kwargs, options=PairFinderOptions(fast_decode=True)
+    )
+    assert scanner.hasher.draft_size == draft_size
+
+
+def test_no_draft_size_without_fast_decode() -> None:
+    assert ImageHashScanner([], IMAGE_HASH_ALGORITHM['phash']).hasher.draft_size is None
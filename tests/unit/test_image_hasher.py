@@ -0,0 +1,265 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+import struct
+from io import BytesIO
+from pathlib import Path
+from typing import Type
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+from duplicate_images.hash_scanner import (
+    ImageHashScanner, ParallelImageHashScanner, ProcessImageHashScanner
+)
+from duplicate_images.hash_scanner.image_hasher import EXIF_HEADER, ImageHasher, exif_thumbnail
+from duplicate_images.hash_store import SQLiteHashStore
+from duplicate_images.methods import IMAGE_HASH_ALGORITHM
+from duplicate_images.pair_finder_options import PairFinderOptions
+from duplicate_images.thumbnail_cache import ThumbnailCache
+
+THUMBNAIL_SIZE = (16, 12)
+
+
+def jpeg_bytes(image: Image.Image, **kwargs) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', **kwargs)
+    return buffer.getvalue()
+
+
+def exif_with_thumbnail(thumbnail: bytes) -> bytes:
+    """
+    Big endian TIFF structure with an empty IFD0 followed by an IFD1 pointing
+    to the JPEG thumbnail appended after it
+    """
+    ifd1_offset = 8 + 2 + 4
+    thumbnail_offset = ifd1_offset + 2 + 2 * 12 + 4
+    tiff = b'MM\x00\x2a' + struct.pack('>I', 8)
+    tiff += struct.pack('>HI', 0, ifd1_offset)
+    tiff += struct.pack('>H', 2)
+    tiff += struct.pack('>HHII', 0x0201, 4, 1, thumbnail_offset)
+    tiff += struct.pack('>HHII', 0x0202, 4, 1, len(thumbnail))
+    tiff += struct.pack('>I', 0)
+    return EXIF_HEADER + tiff + thumbnail
+
+
+def create_jpeg(path: Path, color: str, thumbnail_color: str | None = None) -> Path:
+    kwargs = {}
+    if thumbnail_color is not None:
+        thumbnail = jpeg_bytes(Image.new('RGB', THUMBNAIL_SIZE, thumbnail_color))
+        kwargs['exif'] = exif_with_thumbnail(thumbnail)
+    path.write_bytes(jpeg_bytes(Image.new('RGB', (320, 240), color), **kwargs))
+    return path
+
+
+def test_exif_thumbnail_is_read(tmp_path: Path) -> None:
+    with Image.open(create_jpeg(tmp_path / 'image.jpg', 'white', 'black')) as image:
+        thumbnail = exif_thumbnail(image)
+        assert thumbnail is not None
+        assert thumbnail.size == THUMBNAIL_SIZE
+        assert thumbnail.getpixel((0, 0)) == (0, 0, 0)
+
+
+def test_no_exif_thumbnail_without_exif(tmp_path: Path) -> None:
+    with Image.open(create_jpeg(tmp_path / 'image.jpg', 'white')) as image:
+        assert exif_thumbnail(image) is None
+
+
+def test_hasher_uses_exif_thumbnail_if_requested(tmp_path: Path) -> None:
+    image_file = create_jpeg(tmp_path / 'image.jpg', 'white', 'black')
+    assert ImageHasher(IMAGE_HASH_ALGORITHM['ahash']).open_image(image_file).size == (320, 240)
+    assert ImageHasher(
+        IMAGE_HASH_ALGORITHM['ahash'], exif_thumbnails=True
+    ).open_image(image_file).size == THUMBNAIL_SIZE
+
+
+def test_hasher_falls_back_to_full_image_without_exif_thumbnail(tmp_path: Path) -> None:
+    image_file = create_jpeg(tmp_path / 'image.jpg', 'white')
+    hasher = ImageHasher(IMAGE_HASH_ALGORITHM['ahash'], exif_thumbnails=True)
+    assert hasher.open_image(image_file).size == (320, 240)
+    assert hasher(image_file) == ImageHasher(IMAGE_HASH_ALGORITHM['ahash'])(image_file)
+
+
+def test_scanner_passes_exif_thumbnails_option() -> None:
+    assert not ImageHashScanner([], IMAGE_HASH_ALGORITHM['ahash']).hasher.exif_thumbnails
+    assert ImageHashScanner(
+        [], IMAGE_HASH_ALGORITHM['ahash'], options=PairFinderOptions(exif_thumbnails=True)
+    ).hasher.exif_thumbnails
+
+
+@pytest.mark.parametrize(
+    'scanner_class', [ImageHashScanner, ParallelImageHashScanner, ProcessImageHashScanner]
+)
+def test_scanner_accepts_iterator(tmp_path: Path, scanner_class: Type[ImageHashScanner]) -> None:
+    files = [create_jpeg(tmp_path / f'{color}.jpg', color) for color in ('white', 'black', 'red')]
+    scanner = scanner_class(iter(files), IMAGE_HASH_ALGORITHM['ahash'])
+    assert dict(scanner.precalculate_hashes()) == {
+        file: ImageHasher(IMAGE_HASH_ALGORITHM['ahash'])(file) for file in files
+    }
+
+
+def test_additional_algorithms_give_same_hashes_as_separate_hashers(tmp_path: Path) -> None:
+    image_file = create_jpeg(tmp_path / 'image.jpg', 'white')
+    algorithms = [IMAGE_HASH_ALGORITHM[name] for name in ('phash', 'dhash', 'whash')]
+    hasher = ImageHasher(
+        algorithms[0], additional_algorithms=tuple((algorithm, {}) for algorithm in algorithms[1:])
+    )
+    assert hasher.hashes(image_file) == [
+        ImageHasher(algorithm)(image_file) for algorithm in algorithms
+    ]
+    assert hasher(image_file) == ImageHasher(algorithms[0])(image_file)
+
+
+def test_unreadable_image_gives_no_hashes(tmp_path: Path) -> None:
+    image_file = tmp_path / 'image.jpg'
+    image_file.write_bytes(b'not an image')
+    hasher = ImageHasher(
+        IMAGE_HASH_ALGORITHM['phash'], additional_algorithms=((IMAGE_HASH_ALGORITHM['dhash'], {}),)
+    )
+    assert hasher.hashes(image_file) == [None, None]
+
+
+def test_scanner_decodes_for_biggest_draft_size_needed() -> None:
+    scanner = ImageHashScanner(
+        [], IMAGE_HASH_ALGORITHM['ahash'], {'hash_size': 8},
+        options=PairFinderOptions(fast_decode=True, additional_algorithms=('phash', 'dhash'))
+    )
+    assert scanner.hasher.draft_size == 32
+    assert len(scanner.hasher.additional_algorithms) == 2
+    assert ImageHashScanner(
+        [], IMAGE_HASH_ALGORITHM['ahash'], {'hash_size': 8},
+        options=PairFinderOptions(fast_decode=True, additional_algorithms=('colorhash',))
+    ).hasher.draft_size is None
+
+
+def test_scanner_stores_hashes_of_additional_algorithms(tmp_path: Path) -> None:
+    image_file = create_jpeg(tmp_path / 'image.jpg', 'white')
+    with SQLiteHashStore(tmp_path / 'hashes.db', 'ahash', {'hash_size': 8}) as hash_store:
+        scanner = ImageHashScanner(
+            [image_file], IMAGE_HASH_ALGORITHM['ahash'], {'hash_size': 8}, hash_store,
+            options=PairFinderOptions(additional_algorithms=('ahash', 'dhash'))
+        )
+        assert len(scanner.additional_stores) == 1
+        scanner.precalculate_hashes()
+        assert hash_store.for_algorithm('dhash', {'hash_size': 8}).get(image_file) == \
+            ImageHasher(IMAGE_HASH_ALGORITHM['dhash'])(image_file)
+
+
+def test_hashes_from_thumbnail_equal_hashes_from_cached_thumbnail(tmp_path: Path) -> None:
+    image_file = create_jpeg(tmp_path / 'image.jpg', 'red')
+    hasher = ImageHasher(IMAGE_HASH_ALGORITHM['phash'], thumbnail_size=64)
+    thumbnail, hashes = hasher.thumbnail_and_hashes(image_file)
+    assert thumbnail is not None
+    assert thumbnail.shape == (64, 64)
+    assert hasher.hashes_of_image(Image.fromarray(thumbnail)) == hashes
+
+
+def test_scanner_calculates_hashes_from_cached_thumbnails(tmp_path: Path) -> None:
+    files = [create_jpeg(tmp_path / f'{color}.jpg', color) for color in ('white', 'black', 'red')]
+    options = PairFinderOptions(thumbnail_size=64)
+    with ThumbnailCache(tmp_path / 'thumbnails', 64) as thumbnails:
+        hashes = ImageHashScanner(
+            files, IMAGE_HASH_ALGORITHM['ahash'], options=options, thumbnails=thumbnails
+        ).precalculate_hashes()
+    with patch.object(ImageHasher, 'open_image') as open_image:
+        with ThumbnailCache(tmp_path / 'thumbnails', 64) as thumbnails:
+            assert ImageHashScanner(
+                files, IMAGE_HASH_ALGORITHM['ahash'], options=options, thumbnails=thumbnails
+            ).precalculate_hashes() == hashes
+        open_image.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    'scanner_class', [ImageHashScanner, ParallelImageHashScanner, ProcessImageHashScanner]
+)
+def test_scanner_with_detect_copies_gives_same_hashes(
+        tmp_path: Path, scanner_class: Type[ImageHashScanner]
+) -> None:
+    files = [create_jpeg(tmp_path / f'{color}.jpg', color) for color in ('white', 'black')]
+    for i in range(3):
+        files.append(tmp_path / f'copy{i}.jpg')
+        files[-1].write_bytes(files[i % 2].read_bytes())
+    scanner = scanner_class(
+        files, IMAGE_HASH_ALGORITHM['ahash'], options=PairFinderOptions(detect_copies=True)
+    )
+    assert scanner.precalculate_hashes() == [
+        (file, ImageHasher(IMAGE_HASH_ALGORITHM['ahash'])(file)) for file in files
+    ]
+    assert sorted(scanner.hashes(), key=lambda entry: entry[0]) == sorted(
+        ImageHashScanner(files, IMAGE_HASH_ALGORITHM['ahash']).hashes(), key=lambda entry: entry[0]
+    )
+
+
+@pytest.mark.parametrize('scanner_class', [ImageHashScanner, ParallelImageHashScanner])
+def test_copies_are_only_decoded_once(
+        tmp_path: Path, scanner_class: Type[ImageHashScanner]
+) -> None:
+    original = create_jpeg(tmp_path / 'original.jpg', 'white')
+    files = [original, *(tmp_path / f'copy{i}.jpg' for i in range(3))]
+    for copy in files[1:]:
+        copy.write_bytes(original.read_bytes())
+    with patch.object(ImageHasher, 'open_image', side_effect=Image.open) as open_image:
+        scanner_class(
+            files, IMAGE_HASH_ALGORITHM['ahash'], options=PairFinderOptions(detect_copies=True)
+        ).precalculate_hashes()
+        assert open_image.call_count == 1
+
+
+@pytest.mark.parametrize('thumbnail_size', [None, 64])
+def test_batch_hashes_equal_single_hashes(tmp_path: Path, thumbnail_size: int | None) -> None:
+    files = [create_jpeg(tmp_path / f'{color}.jpg', color) for color in ('white', 'black', 'red')]
+    files.insert(1, tmp_path / 'broken.jpg')
+    files[1].write_bytes(b'not an image')
+    hasher = ImageHasher(
+        IMAGE_HASH_ALGORITHM['phash'], {'hash_size': 8},
+        additional_algorithms=((IMAGE_HASH_ALGORITHM['dhash'], {'hash_size': 16}),),
+        thumbnail_size=thumbnail_size
+    )
+    for (thumbnail, hashes), file in zip(hasher.batch_thumbnails_and_hashes(files), files):
+        expected_thumbnail, expected_hashes = hasher.thumbnail_and_hashes(file)
+        assert hashes == expected_hashes
+        assert (thumbnail is None) == (expected_thumbnail is None)
+    assert hasher.batch_thumbnails_and_hashes([files[1]]) == [(None, [None, None])]
+
+
+def test_process_scanner_with_batch_hashing_gives_same_hashes(tmp_path: Path) -> None:
+    files = [create_jpeg(tmp_path / f'{color}.jpg', color) for color in ('white', 'black', 'red')]
+    scanner = ProcessImageHashScanner(
+        files, IMAGE_HASH_ALGORITHM['dhash'], {'hash_size': 8}, parallel=2,
+        options=PairFinderOptions(batch_hashing=True)
+    )
+    assert scanner.precalculate_hashes() == [
+        (file, ImageHasher(IMAGE_HASH_ALGORITHM['dhash'])(file)) for file in files
+    ]
+
+
+def test_images_are_closed_after_hashing(tmp_path: Path) -> None:
+    files = [create_jpeg(tmp_path / f'{color}.jpg', color) for color in ('white', 'black')]
+    opened = []
+
+    def open_image(file: Path) -> Image.Image:
+        opened.append(Image.open(file))
+        return opened[-1]
+
+    hasher = ImageHasher(IMAGE_HASH_ALGORITHM['ahash'], thumbnail_size=16)
+    with patch.object(ImageHasher, 'open_image', side_effect=open_image):
+        hasher(files[0])
+        hasher.batch_thumbnails_and_hashes(files)
+    assert len(opened) == 3
+    for image in opened:
+        with pytest.raises(ValueError, match='closed image'):
+            image.load()
+
+
+@pytest.mark.parametrize('scanner_class', [ParallelImageHashScanner, ProcessImageHashScanner])
+def test_scanner_with_memory_budget_gives_same_hashes(
+        tmp_path: Path, scanner_class: Type[ImageHashScanner]
+) -> None:
+    files = [create_jpeg(tmp_path / f'{color}.jpg', color) for color in ('white', 'black', 'red')]
+    scanner = scanner_class(
+        files, IMAGE_HASH_ALGORITHM['ahash'], options=PairFinderOptions(memory_budget=1)
+    )
+    assert scanner.precalculate_hashes() == [
+        (file, ImageHasher(IMAGE_HASH_ALGORITHM['ahash'])(file)) for file in files
+    ]
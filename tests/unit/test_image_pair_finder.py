@@ -1,20 +1,32 @@
 # pylint: disable=missing-docstring
 __author__ = 'Lene Preuss <lene.preuss@gmail.com>'
 
+from collections.abc import Collection
+from itertools import combinations
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Any, Callable, List, Tuple
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
 from unittest.mock import Mock
 
 import pytest
+from imagehash import ImageHash
+from numpy.random import default_rng
 
 from duplicate_images.duplicate import files_in_dirs
+from duplicate_images.function_types import ImageGroup
 from duplicate_images.hash_scanner import ImageHashScanner, ParallelImageHashScanner
 from duplicate_images.image_pair_finder import (
-    DictImagePairFinder, PairFinderOptions, SlowImagePairFinder, group_results_as_pairs
+    SIMILARITY_SEARCH, BKTreeImagePairFinder, DictImagePairFinder, ImagePairFinder,
+    MultiIndexImagePairFinder, PairFinderOptions, SlowImagePairFinder,
+    StreamingDictImagePairFinder, VectorizedImagePairFinder, group_results_as_pairs,
+    group_results_as_tuples
 )
+from duplicate_images.image_pairs import ImagePairs
 from duplicate_images.methods import IMAGE_HASH_ALGORITHM, get_hash_size_kwargs
-from .conftest import is_pair_found, copy_image_file, delete_image_file, named_file
+from duplicate_images.search_index import SearchIndex
+from .conftest import (
+    MOCK_IMAGE_HASH_VALUE, is_pair_found, copy_image_file, delete_image_file, named_file
+)
 
 
 def element_in_list_of_tuples(element: Any, tuples: List[Tuple[Any, Any]]) -> bool:
@@ -30,7 +42,8 @@ def test_get_files(top_directory: TemporaryDirectory, image_files: List[Path]) -
 @pytest.mark.parametrize('scanner_class', [ImageHashScanner, ParallelImageHashScanner])
 @pytest.mark.parametrize(
     'finder_class,max_distance', [
-        (DictImagePairFinder, 0), (SlowImagePairFinder, 0), (SlowImagePairFinder, 1)
+        (DictImagePairFinder, 0), (SlowImagePairFinder, 0), (SlowImagePairFinder, 1),
+        (BKTreeImagePairFinder, 1), (VectorizedImagePairFinder, 1)
     ]
 )
 def test_hashes_equal_for_copied_image(
@@ -53,7 +66,8 @@ def test_hashes_equal_for_copied_image(
 @pytest.mark.parametrize('scanner_class', [ImageHashScanner, ParallelImageHashScanner])
 @pytest.mark.parametrize(
     'finder_class,max_distance', [
-        (DictImagePairFinder, 0), (SlowImagePairFinder, 0), (SlowImagePairFinder, 1)
+        (DictImagePairFinder, 0), (SlowImagePairFinder, 0), (SlowImagePairFinder, 1),
+        (BKTreeImagePairFinder, 1), (VectorizedImagePairFinder, 1)
     ]
 )
 def test_hashes_not_equal_for_noisy_image(
@@ -74,7 +88,8 @@ def test_hashes_not_equal_for_noisy_image(
 @pytest.mark.parametrize('scanner_class', [ImageHashScanner, ParallelImageHashScanner])
 @pytest.mark.parametrize(
     'finder_class,max_distance', [
-        (DictImagePairFinder, 0), (SlowImagePairFinder, 0), (SlowImagePairFinder, 1)
+        (DictImagePairFinder, 0), (SlowImagePairFinder, 0), (SlowImagePairFinder, 1),
+        (BKTreeImagePairFinder, 1), (VectorizedImagePairFinder, 1)
     ]
 )
 def test_hashes_equal_for_different_image_format(
@@ -94,7 +109,8 @@ def test_hashes_equal_for_different_image_format(
 @pytest.mark.parametrize('scanner_class', [ImageHashScanner, ParallelImageHashScanner])
 @pytest.mark.parametrize(
     'finder_class,max_distance', [
-        (DictImagePairFinder, 0), (SlowImagePairFinder, 0), (SlowImagePairFinder, 1)
+        (DictImagePairFinder, 0), (SlowImagePairFinder, 0), (SlowImagePairFinder, 1),
+        (BKTreeImagePairFinder, 1), (VectorizedImagePairFinder, 1)
     ]
 )
 def test_hashes_equal_for_scaled_image(
@@ -114,7 +130,8 @@ def test_hashes_equal_for_scaled_image(
 @pytest.mark.parametrize('scanner_class', [ParallelImageHashScanner])
 @pytest.mark.parametrize(
     'finder_class,max_distance', [
-        (DictImagePairFinder, 0), (SlowImagePairFinder, 0), (SlowImagePairFinder, 1)
+        (DictImagePairFinder, 0), (SlowImagePairFinder, 0), (SlowImagePairFinder, 1),
+        (BKTreeImagePairFinder, 1), (VectorizedImagePairFinder, 1)
     ]
 )
 def test_parallel_filtering_gives_same_results(
@@ -187,3 +204,284 @@ def test_dict_image_finder_fails_for_max_distance_greater_0(max_distance: int) -
             scanner=Mock(), group_results=Mock(),
             options=PairFinderOptions(max_distance=max_distance)
         )
+
+
+def random_hashes(num_hashes: int, hash_size: int, seed: int = 0) -> List[Tuple[Path, ImageHash]]:
+    rng = default_rng(seed)
+    originals = rng.integers(0, 2, (num_hashes // 4, hash_size, hash_size)).astype(bool)
+    hashes = []
+    for index in range(num_hashes):
+        flipped = originals[index % len(originals)].copy()
+        flipped.flat[rng.integers(0, hash_size * hash_size, index % 5)] ^= True
+        hashes.append((Path(f'{index:04d}.jpg'), ImageHash(flipped)))
+    return hashes
+
+
+@pytest.mark.parametrize('max_distance', [1, 3, 8])
+@pytest.mark.parametrize('hash_size', [5, 8, 16])
+@pytest.mark.parametrize('finder_class', [BKTreeImagePairFinder, VectorizedImagePairFinder])
+def test_hamming_finder_finds_same_pairs_as_slow_finder(
+        max_distance: int, hash_size: int, finder_class: Callable
+) -> None:
+    scanner = Mock()
+    scanner.precalculate_hashes.return_value = random_hashes(200, hash_size)
+    options = PairFinderOptions(max_distance=max_distance)
+    expected = SlowImagePairFinder(scanner, group_results_as_pairs, options).get_equal_groups()
+    found = finder_class(scanner, group_results_as_pairs, options).get_equal_groups()
+    assert expected
+    assert found == expected
+
+
+@pytest.mark.parametrize('group_results', [group_results_as_pairs, group_results_as_tuples])
+def test_streaming_finder_finds_same_results_as_dict_finder(group_results: Callable) -> None:
+    scanner = Mock()
+    hashes = random_hashes(200, 4)
+    scanner.precalculate_hashes.return_value = hashes
+    scanner.hashes.return_value = iter(reversed(hashes))
+    expected = DictImagePairFinder(scanner, group_results).get_equal_groups()
+    found = StreamingDictImagePairFinder(scanner, group_results).get_equal_groups()
+    assert expected
+    assert found == expected
+
+
+def test_streaming_finder_yields_pair_before_scan_is_finished() -> None:
+    scanned = []
+
+    def hashes() -> Iterator[Tuple[Path, Optional[ImageHash]]]:
+        for file in ('a.jpg', 'b.jpg', 'c.jpg', 'd.jpg'):
+            scanned.append(file)
+            yield Path(file), MOCK_IMAGE_HASH_VALUE if file != 'b.jpg' else None
+
+    scanner = Mock()
+    scanner.hashes.return_value = hashes()
+    matches = StreamingDictImagePairFinder(scanner, group_results_as_pairs).matches()
+    assert next(matches) == (Path('a.jpg'), Path('c.jpg'))
+    assert scanned == ['a.jpg', 'b.jpg', 'c.jpg']
+    assert list(matches) == [(Path('a.jpg'), Path('d.jpg')), (Path('c.jpg'), Path('d.jpg'))]
+
+
+def test_streaming_finder_yields_growing_groups() -> None:
+    scanner = Mock()
+    scanner.hashes.return_value = iter(
+        [(Path(file), MOCK_IMAGE_HASH_VALUE) for file in ('a.jpg', 'b.jpg', 'c.jpg')]
+    )
+    matches = StreamingDictImagePairFinder(scanner, group_results_as_tuples).matches()
+    assert list(matches) == [
+        (Path('a.jpg'), Path('b.jpg')), (Path('a.jpg'), Path('b.jpg'), Path('c.jpg'))
+    ]
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_streaming_finder_is_used_if_requested(stream: bool) -> None:
+    finder = ImagePairFinder.create([], Mock(), options=PairFinderOptions(stream=stream))
+    assert isinstance(finder, StreamingDictImagePairFinder) == stream
+
+
+def connected_groups(pairs: Collection[ImageGroup]) -> Set[FrozenSet[Path]]:
+    groups: Dict[Path, Set[Path]] = {}
+    for file, other_file in pairs:
+        merged = groups.get(file, {file}) | groups.get(other_file, {other_file})
+        for member in merged:
+            groups[member] = merged
+    return {frozenset(group) for group in groups.values()}
+
+
+@pytest.mark.parametrize('max_distance', [1, 3])
+@pytest.mark.parametrize('finder_class', [BKTreeImagePairFinder, VectorizedImagePairFinder])
+def test_hamming_finder_groups_connected_pairs(max_distance: int, finder_class: Callable) -> None:
+    scanner = Mock()
+    scanner.precalculate_hashes.return_value = random_hashes(200, 5)
+    options = PairFinderOptions(max_distance=max_distance, group=True)
+    pairs = SlowImagePairFinder(scanner, group_results_as_pairs, options).get_equal_groups()
+    groups = finder_class(scanner, group_results_as_tuples, options).get_equal_groups()
+    assert len(groups) < len(pairs)
+    assert {frozenset(group) for group in groups} == connected_groups(pairs)
+    assert list(groups) == sorted(groups)
+    assert all(list(group) == sorted(group) for group in groups)
+
+
+def test_complete_linkage_groups_contain_only_similar_images() -> None:
+    scanner = Mock()
+    hashes = random_hashes(200, 5)
+    scanner.precalculate_hashes.return_value = hashes
+    options = PairFinderOptions(max_distance=3, group=True, group_linkage='complete')
+    groups = BKTreeImagePairFinder(scanner, group_results_as_tuples, options).get_equal_groups()
+    hash_of = dict(hashes)
+    assert groups
+    for group in groups:
+        assert all(hash_of[file] - hash_of[other] <= 3 for file, other in combinations(group, 2))
+    grouped = [file for group in groups for file in group]
+    assert len(grouped) == len(set(grouped))
+
+
+def test_slow_finder_refuses_groups() -> None:
+    with pytest.raises(ValueError):
+        SlowImagePairFinder(
+            Mock(), group_results_as_tuples, PairFinderOptions(max_distance=1, group=True)
+        )
+
+
+def test_bk_tree_finder_is_used_for_max_distance_greater_0() -> None:
+    finder = ImagePairFinder.create([], Mock(), options=PairFinderOptions(max_distance=1))
+    assert isinstance(finder, BKTreeImagePairFinder)
+
+
+@pytest.mark.parametrize('similarity_search', list(SIMILARITY_SEARCH.keys()))
+def test_similarity_search_selects_finder(similarity_search: str) -> None:
+    finder = ImagePairFinder.create(
+        [], Mock(),
+        options=PairFinderOptions(max_distance=1, similarity_search=similarity_search)
+    )
+    assert isinstance(finder, SIMILARITY_SEARCH[similarity_search])
+
+
+def test_slow_finder_is_used_if_requested() -> None:
+    finder = ImagePairFinder.create(
+        [], Mock(), options=PairFinderOptions(max_distance=1, slow=True)
+    )
+    assert type(finder) is SlowImagePairFinder  # pylint: disable=unidiomatic-typecheck
+
+
+def scanner_with_known_files(
+        tmp_path: Path, hashes: List[Tuple[Path, ImageHash]], num_known: int, scan_known: bool
+) -> Mock:
+    """Scanner for the files in hashes, of which the first num_known are in the hash store"""
+    for file, _ in hashes:
+        (tmp_path / file).touch()
+    hashes = [(tmp_path / file, image_hash) for file, image_hash in hashes]
+    scanned = hashes if scan_known else hashes[num_known:]
+    stored = dict(hashes[:num_known])
+    scanner = Mock()
+    scanner.hash_store.items.return_value = hashes[:num_known]
+    scanner.hash_store.key.side_effect = lambda file: file
+    scanner.hash_store.stored_hash.side_effect = stored.get
+    scanner.hash_store.files_with_hash.side_effect = lambda image_hash: [
+        file for file, stored_hash in stored.items() if stored_hash == image_hash
+    ]
+    scanner.precalculate_hashes.return_value = scanned
+    scanner.hashes.side_effect = lambda: iter(scanned)
+    return scanner
+
+
+@pytest.mark.parametrize('scan_known', [False, True])
+@pytest.mark.parametrize(
+    'finder_class,max_distance', [
+        (DictImagePairFinder, 0), (StreamingDictImagePairFinder, 0), (BKTreeImagePairFinder, 3),
+        (VectorizedImagePairFinder, 3), (MultiIndexImagePairFinder, 3)
+    ]
+)
+def test_new_only_finds_pairs_with_new_files(
+        tmp_path: Path, finder_class: Callable, max_distance: int, scan_known: bool
+) -> None:
+    hashes = random_hashes(200, 4 if max_distance == 0 else 8)
+    scanner = scanner_with_known_files(tmp_path, hashes, 150, scan_known)
+    new_files = {tmp_path / file for file, _ in hashes[150:]}
+    all_pairs = SlowImagePairFinder(
+        scanner_with_known_files(tmp_path, hashes, 0, True), group_results_as_pairs,
+        PairFinderOptions(max_distance=max_distance)
+    ).get_equal_groups()
+    expected = [pair for pair in all_pairs if set(pair) & new_files]
+    found = finder_class(
+        scanner, group_results_as_pairs, PairFinderOptions(max_distance=max_distance, new_only=True)
+    ).get_equal_groups()
+    assert len(expected) < len(all_pairs)
+    assert list(found) == expected
+
+
+@pytest.mark.parametrize('finder_class', [DictImagePairFinder, StreamingDictImagePairFinder])
+def test_new_only_reads_only_known_files_with_hash_of_new_file(
+        tmp_path: Path, finder_class: Callable
+) -> None:
+    hashes = random_hashes(200, 4)
+    scanner = scanner_with_known_files(tmp_path, hashes, 150, True)
+    found = finder_class(
+        scanner, group_results_as_pairs, PairFinderOptions(new_only=True)
+    ).get_equal_groups()
+    assert isinstance(found, ImagePairs)
+    assert found
+    scanner.hash_store.items.assert_not_called()
+    searched = {call.args[0] for call in scanner.hash_store.files_with_hash.call_args_list}
+    assert searched == {image_hash for _, image_hash in hashes[150:]}
+
+
+@pytest.mark.parametrize(
+    'finder_class,max_distance', [(DictImagePairFinder, 0), (BKTreeImagePairFinder, 3)]
+)
+def test_new_only_groups_contain_new_and_known_files(
+        tmp_path: Path, finder_class: Callable, max_distance: int
+) -> None:
+    hashes = random_hashes(200, 4 if max_distance == 0 else 8)
+    scanner = scanner_with_known_files(tmp_path, hashes, 150, False)
+    new_files = {tmp_path / file for file, _ in hashes[150:]}
+    groups = finder_class(
+        scanner, group_results_as_tuples,
+        PairFinderOptions(max_distance=max_distance, group=True, new_only=True)
+    ).get_equal_groups()
+    assert all(set(group) & new_files for group in groups)
+    assert any(set(group) - new_files for group in groups)
+    assert all(list(group) == sorted(group) for group in groups)
+
+
+@pytest.mark.parametrize(
+    'finder_class,max_distance', [(DictImagePairFinder, 0), (BKTreeImagePairFinder, 3)]
+)
+def test_new_only_leaves_out_deleted_known_files(
+        tmp_path: Path, finder_class: Callable, max_distance: int
+) -> None:
+    hashes = random_hashes(200, 4 if max_distance == 0 else 8)
+    scanner = scanner_with_known_files(tmp_path, hashes, 100, False)
+    for file, _ in hashes[:100]:
+        (tmp_path / file).unlink()
+    found = finder_class(
+        scanner, group_results_as_pairs, PairFinderOptions(max_distance=max_distance, new_only=True)
+    ).get_equal_groups()
+    new_files = {tmp_path / file for file, _ in hashes[100:]}
+    assert found
+    assert all(set(pair) <= new_files for pair in found)
+
+
+@pytest.mark.parametrize(
+    'finder_class,max_distance', [
+        (DictImagePairFinder, 0), (StreamingDictImagePairFinder, 0), (BKTreeImagePairFinder, 3)
+    ]
+)
+def test_new_only_reports_new_files_in_same_form_as_known_files(
+        tmp_path: Path, finder_class: Callable, max_distance: int
+) -> None:
+    hashes = random_hashes(200, 4 if max_distance == 0 else 8)
+    scanner = scanner_with_known_files(tmp_path, hashes, 150, False)
+    scanned = [(Path(file.name), image_hash) for file, image_hash in hashes[150:]]
+    scanner.precalculate_hashes.return_value = scanned
+    scanner.hashes.side_effect = lambda: iter(scanned)
+    scanner.hash_store.key.side_effect = lambda file: tmp_path / file.name
+    found = finder_class(
+        scanner, group_results_as_pairs, PairFinderOptions(max_distance=max_distance, new_only=True)
+    ).get_equal_groups()
+    assert any(tmp_path / file in pair for pair in found for file, _ in hashes[:150])
+    assert all(file.is_absolute() for pair in found for file in pair)
+
+
+@pytest.mark.parametrize(
+    'finder_class', [BKTreeImagePairFinder, VectorizedImagePairFinder, MultiIndexImagePairFinder]
+)
+def test_new_only_with_search_index_reads_only_similar_known_files(
+        tmp_path: Path, finder_class: Callable
+) -> None:
+    hashes = random_hashes(200, 8)
+    scanner = scanner_with_known_files(tmp_path, hashes, 150, True)
+    options = PairFinderOptions(max_distance=3, new_only=True)
+    expected = finder_class(scanner, group_results_as_pairs, options).get_equal_groups()
+    scanner.hash_store.search_index = SearchIndex(
+        tmp_path / 'hashes.index', {'max_distance': 3}, None, scanner.hash_store.items
+    )
+    finder = finder_class(scanner, group_results_as_pairs, options)
+    assert finder.get_equal_groups() == expected
+    assert expected
+    assert len(finder.precalculated_hashes) < len(hashes)
+
+
+def test_slow_finder_refuses_new_only() -> None:
+    with pytest.raises(ValueError):
+        SlowImagePairFinder(
+            Mock(), group_results_as_pairs, PairFinderOptions(max_distance=1, new_only=True)
+        )
@@ -0,0 +1,75 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from itertools import combinations
+from pathlib import Path
+from typing import List
+
+from duplicate_images.image_pairs import ImagePairs
+
+
+def paths(*names: str) -> List[Path]:
+    return [Path(name) for name in names]
+
+
+GROUPS = [paths('b', 'e', 'c'), paths('a', 'd'), paths('f', 'g', 'h', 'i')]
+
+
+def all_pairs(groups: List[List[Path]]) -> List[tuple]:
+    return sorted(pair for group in groups for pair in combinations(sorted(group), 2))
+
+
+def test_iterates_over_sorted_pairs() -> None:
+    assert list(ImagePairs(GROUPS)) == all_pairs(GROUPS)
+
+
+def test_length_is_number_of_pairs() -> None:
+    assert len(ImagePairs(GROUPS)) == 3 + 1 + 6
+
+
+def test_empty() -> None:
+    assert len(ImagePairs([])) == 0
+    assert not list(ImagePairs([]))
+
+
+def test_contains_pairs_in_same_group() -> None:
+    pairs = ImagePairs(GROUPS)
+    assert (Path('b'), Path('e')) in pairs
+    assert (Path('f'), Path('i')) in pairs
+    assert (Path('e'), Path('b')) not in pairs
+    assert (Path('a'), Path('b')) not in pairs
+    assert (Path('a'), Path('x')) not in pairs
+    assert (Path('a'),) not in pairs
+
+
+def test_equals_list_of_same_pairs() -> None:
+    assert ImagePairs(GROUPS) == all_pairs(GROUPS)
+    assert ImagePairs(GROUPS) != all_pairs(GROUPS)[1:]
+    assert ImagePairs(GROUPS) == ImagePairs(reversed(GROUPS))
+
+
+def test_big_group_is_iterated_lazily() -> None:
+    pairs = ImagePairs([[Path(f'{index:05d}.jpg') for index in range(5000)]])
+    assert len(pairs) == 5000 * 4999 // 2
+    iterator = iter(pairs)
+    assert next(iterator) == (Path('00000.jpg'), Path('00001.jpg'))
+    assert (Path('04998.jpg'), Path('04999.jpg')) in pairs
+
+
+def test_pairs_of_known_files_are_left_out() -> None:
+    new_files = set(paths('c', 'd', 'h'))
+    pairs = ImagePairs(GROUPS, new_files.__contains__)
+    expected = [pair for pair in all_pairs(GROUPS) if set(pair) & new_files]
+    assert list(pairs) == expected
+    assert len(pairs) == len(expected)
+    assert (Path('b'), Path('c')) in pairs
+    assert (Path('f'), Path('h')) in pairs
+    assert (Path('b'), Path('e')) not in pairs
+    assert (Path('f'), Path('g')) not in pairs
+
+
+def test_big_group_of_known_files_is_not_iterated() -> None:
+    group = [Path(f'{index:05d}.jpg') for index in range(5000)]
+    pairs = ImagePairs([group], Path('04999.jpg').__eq__)
+    assert len(pairs) == 4999
+    assert list(pairs) == [(file, Path('04999.jpg')) for file in group[:-1]]
@@ -17,6 +17,7 @@ from typing import Generator
 import pytest
 from imagehash import hex_to_hash
 
+from duplicate_images.common import resolved_directory
 from duplicate_images.hash_store import JSONHashStore, PickleHashStore
 
 
@@ -152,3 +153,31 @@ def test_json_saved_keys_are_resolved(tmp_path: Path):
         # It should match the resolved version of our input
         assert str(saved_path) == str(non_resolved_path.resolve()), \
             f"Saved path {saved_path} should match resolved input {non_resolved_path.resolve()}"
+
+
+def test_json_store_resolves_each_directory_once(
+        tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    directories = [tmp_path / 'images' / f'dir{i}' for i in range(3)]
+    files = [directory / f'image{i}.jpg' for directory in directories for i in range(10)]
+    for file in files:
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_bytes(b'image')
+    resolved_directory.cache_clear()
+    resolve_calls = []
+    original_resolve = Path.resolve
+
+    def counting_resolve(path: Path, strict: bool = False) -> Path:
+        resolve_calls.append(path)
+        return original_resolve(path, strict)
+
+    monkeypatch.setattr(Path, 'resolve', counting_resolve)
+    mock_hash = hex_to_hash('0' * 16)
+    with JSONHashStore(tmp_path / 'test.json', 'phash', {'hash_size': 8}) as store:
+        for file in files:
+            assert store.get(file) is None
+            store.add(file, mock_hash)
+    with JSONHashStore(tmp_path / 'test.json', 'phash', {'hash_size': 8}) as store:
+        for file in files:
+            assert store.get(file) == mock_hash
+    assert sorted(resolve_calls) == directories
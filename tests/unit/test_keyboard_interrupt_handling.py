@@ -220,3 +220,95 @@ def test_backup_not_deleted_on_keyboard_interrupt(
     # Backup should still exist with original content
     assert backup_path.is_file()
     assert backup_path.read_bytes() == backup_content
+
+
+@pytest.mark.parametrize('store_class,suffix', [
+    (PickleHashStore, '.pickle'),
+    (JSONHashStore, '.json')
+])
+class TestCheckpoints:
+    """Test that progress is saved periodically, so an interrupted scan can be resumed."""
+
+    def test_checkpoint_after_number_of_entries_survives_interrupt(
+            self, tmp_path: Path, sample_files: List[Path], monkeypatch: pytest.MonkeyPatch,
+            store_class, suffix
+    ) -> None:
+        monkeypatch.setattr(store_class, 'CHECKPOINT_ENTRIES', 2)
+        store_path = tmp_path / f'hashes{suffix}'
+
+        store = store_class(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+        for file in sample_files:
+            store.add(file, MOCK_IMAGE_HASH_VALUE)
+        store.__exit__(KeyboardInterrupt, KeyboardInterrupt('User interrupted'), None)
+
+        loaded_store = store_class(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+        assert set(loaded_store.values) == set(sample_files[:4])
+
+    def test_checkpoint_after_time_survives_interrupt(
+            self, tmp_path: Path, sample_files: List[Path], monkeypatch: pytest.MonkeyPatch,
+            store_class, suffix
+    ) -> None:
+        monkeypatch.setattr(store_class, 'CHECKPOINT_SECONDS', 0)
+        store_path = tmp_path / f'hashes{suffix}'
+
+        store = store_class(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+        store.add(sample_files[0], MOCK_IMAGE_HASH_VALUE)
+        store.__exit__(KeyboardInterrupt, KeyboardInterrupt('User interrupted'), None)
+
+        loaded_store = store_class(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+        assert set(loaded_store.values) == {sample_files[0]}
+
+    def test_checkpoints_keep_backup_from_before_scan(
+            self, tmp_path: Path, sample_files: List[Path], monkeypatch: pytest.MonkeyPatch,
+            store_class, suffix
+    ) -> None:
+        store_path = tmp_path / f'hashes{suffix}'
+        with store_class(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as store:
+            store.add(sample_files[0], MOCK_IMAGE_HASH_VALUE)
+        initial_content = store_path.read_bytes()
+
+        monkeypatch.setattr(store_class, 'CHECKPOINT_ENTRIES', 1)
+        with store_class(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as store:
+            for file in sample_files[1:]:
+                store.add(file, MOCK_IMAGE_HASH_VALUE)
+
+        assert store_path.with_suffix('.bak').read_bytes() == initial_content
+        assert [path.name for path in tmp_path.iterdir() if path.suffix == '.tmp'] == []
+        loaded_store = store_class(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+        assert set(loaded_store.values) == set(sample_files)
+
+    def test_checkpoint_interval_grows_with_store_size(
+            self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, store_class, suffix
+    ) -> None:
+        store_path = tmp_path / f'hashes{suffix}'
+        files = [tmp_path / f'image{i}.jpg' for i in range(33)]
+        with store_class(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as store:
+            for file in files[:30]:
+                store.add(file, MOCK_IMAGE_HASH_VALUE)
+
+        monkeypatch.setattr(store_class, 'CHECKPOINT_ENTRIES', 2)
+        store = store_class(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+        for file in files[30:32]:
+            store.add(file, MOCK_IMAGE_HASH_VALUE)
+        assert len(store_class(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)) == 30
+        store.add(files[32], MOCK_IMAGE_HASH_VALUE)
+        assert len(store_class(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)) == 33
+
+    def test_store_is_not_locked_while_checkpoint_is_written(
+            self, tmp_path: Path, sample_files: List[Path], monkeypatch: pytest.MonkeyPatch,
+            store_class, suffix
+    ) -> None:
+        monkeypatch.setattr(store_class, 'CHECKPOINT_ENTRIES', 1)
+        store = store_class(tmp_path / f'hashes{suffix}', DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+        unlocked = []
+        dump = store.dump
+
+        def checked_dump(*args) -> None:
+            unlocked.append(store.lock.acquire(blocking=False))
+            store.lock.release()
+            dump(*args)
+
+        monkeypatch.setattr(store, 'dump', checked_dump)
+        for file in sample_files:
+            store.add(file, MOCK_IMAGE_HASH_VALUE)
+        assert unlocked == [True] * len(sample_files)
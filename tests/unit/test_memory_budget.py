@@ -0,0 +1,61 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from threading import Event, Thread
+from typing import List
+
+from PIL import Image
+
+from duplicate_images.memory_budget import MemoryBudget, decoded_size
+
+TIMEOUT = 5
+
+
+def test_decoded_size() -> None:
+    assert decoded_size(Image.new('RGB', (10, 20))) == 600
+    assert decoded_size(Image.new('L', (10, 20))) == 200
+
+
+def test_reservations_within_limit_do_not_wait() -> None:
+    budget = MemoryBudget(100)
+    with budget.reserved(50), budget.reserved(50):
+        assert budget.in_use.value == 100
+    assert budget.in_use.value == 0
+
+
+def test_reservation_waits_for_release() -> None:
+    budget = MemoryBudget(100)
+    events: List[str] = []
+    reserved = Event()
+
+    def reserve() -> None:
+        reserved.set()
+        with budget.reserved(50):
+            events.append('second reserved')
+
+    with budget.reserved(60):
+        thread = Thread(target=reserve)
+        thread.start()
+        reserved.wait(TIMEOUT)
+        thread.join(0.1)
+        events.append('first released')
+    thread.join(TIMEOUT)
+    assert events == ['first released', 'second reserved']
+
+
+def test_reservation_bigger_than_limit_waits_for_all_others() -> None:
+    budget = MemoryBudget(100)
+    done = Event()
+
+    def reserve() -> None:
+        with budget.reserved(1000):
+            assert budget.in_use.value == 100
+            done.set()
+
+    with budget.reserved(1):
+        thread = Thread(target=reserve)
+        thread.start()
+        assert not done.wait(0.1)
+    thread.join(TIMEOUT)
+    assert done.is_set()
+    assert budget.in_use.value == 0
@@ -0,0 +1,59 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from random import Random
+
+import pytest
+
+from duplicate_images.bk_tree import hamming_distance
+from duplicate_images.multi_index import MultiIndex, bit_blocks
+
+
+def test_empty_index_finds_nothing() -> None:
+    assert not MultiIndex(64, 4).find(0)
+
+
+@pytest.mark.parametrize('num_bits,num_blocks', [(64, 1), (64, 3), (16, 5), (8, 8)])
+def test_bit_blocks_cover_all_bits_once(num_bits: int, num_blocks: int) -> None:
+    blocks = bit_blocks(num_bits, num_blocks)
+    assert len(blocks) == num_blocks
+    covered = 0
+    for shift, mask in blocks:
+        assert not covered & (mask << shift)
+        covered |= mask << shift
+    assert covered == (1 << num_bits) - 1
+
+
+def test_equal_values_are_found_at_distance_0() -> None:
+    index = MultiIndex(4, 0)
+    index.add(0b1010, 1)
+    index.add(0b1010, 2)
+    assert sorted(index.find(0b1010)) == [1, 2]
+
+
+@pytest.mark.parametrize('max_distance', [0, 1, 2, 3, 5, 16])
+def test_find_gives_same_result_as_exhaustive_search(max_distance: int) -> None:
+    random = Random(max_distance)  # noqa: S311
+    values = [random.getrandbits(16) for _ in range(500)]
+    index = MultiIndex(16, max_distance)
+    for item, value in enumerate(values):
+        index.add(value, item)
+    for value in values[:50]:
+        expected = [
+            item for item, other in enumerate(values)
+            if hamming_distance(value, other) <= max_distance
+        ]
+        assert sorted(index.find(value)) == expected
+
+
+def test_candidates_and_matches_are_counted() -> None:
+    index = MultiIndex(8, 1)
+    index.add(0b00000000, 0)
+    index.add(0b00000011, 1)
+    index.add(0b11110000, 2)
+    assert index.find(0b00000001) == [0, 1]
+    assert index.num_candidates == 2
+    assert index.num_matches == 2
+    assert not index.find(0b00001111)
+    assert index.num_candidates == 4
+    assert index.num_matches == 2
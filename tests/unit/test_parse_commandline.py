@@ -4,9 +4,11 @@ __author__ = 'Lene Preuss <lene.preuss@gmail.com>'
 from os import cpu_count
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from typing import List
 
 import pytest
 from duplicate_images.methods import ACTIONS_ON_EQUALITY, MOVE_ACTIONS
+from duplicate_images.pair_finder_options import PairFinderOptions
 
 from duplicate_images.parse_commandline import parse_command_line
 
@@ -129,6 +131,155 @@ def test_non_move_action_fails_with_recreate_path_specified(option: str) -> None
         parse_command_line(['/', '--on-equal', option, '--move-recreate-path'])
 
 
+@pytest.mark.parametrize('option', [['--max-distance', '1'], ['--slow']])
+def test_stream_fails_with_similarity_search(option: List[str]) -> None:
+    with pytest.raises(SystemExit):
+        parse_command_line(['.', '--stream', *option])
+
+
+def test_group_allowed_with_max_distance() -> None:
+    args = parse_command_line(['.', '--group', '--max-distance', '2'])
+    assert args.group
+    assert args.max_distance == 2
+    assert args.group_linkage == 'single'
+
+
+@pytest.mark.parametrize('linkage', ['single', 'complete'])
+def test_group_linkage(linkage: str) -> None:
+    args = parse_command_line(['.', '--group', '--max-distance', '2', '--group-linkage', linkage])
+    assert args.group_linkage == linkage
+
+
+def test_invalid_group_linkage() -> None:
+    with pytest.raises(SystemExit):
+        parse_command_line(['.', '--group-linkage', 'centroid'])
+
+
+@pytest.mark.parametrize('hash_db', ['hashes.sqlite', 'hashes.db'])
+def test_additional_algorithms(hash_db: str) -> None:
+    args = parse_command_line(
+        ['.', '--hash-db', hash_db, '--additional-algorithms', 'dhash', 'whash']
+    )
+    assert args.additional_algorithms == ['dhash', 'whash']
+
+
+@pytest.mark.parametrize('hash_db', [[], ['--hash-db', 'hashes.json'], ['--hash-db', 'h.dihash']])
+def test_additional_algorithms_require_sqlite_hash_db(hash_db: List[str]) -> None:
+    with pytest.raises(SystemExit):
+        parse_command_line(['.', *hash_db, '--additional-algorithms', 'dhash'])
+
+
+def test_binary_hash_db_fails_with_crop_resistant() -> None:
+    assert parse_command_line(['.', '--hash-db', 'h.dihash', '--algorithm', 'phash']).hash_db
+    with pytest.raises(SystemExit):
+        parse_command_line(['.', '--hash-db', 'h.dihash', '--algorithm', 'crop_resistant'])
+
+
+@pytest.mark.parametrize(
+    'algorithm', [['--algorithm', 'ahash'], ['--hash-size', '16'], ['--algorithm', 'dhash']]
+)
+def test_thumbnail_cache(algorithm: List[str]) -> None:
+    args = parse_command_line(['.', '--thumbnail-cache', 'thumbnails', *algorithm])
+    assert PairFinderOptions.from_args(args).thumbnail_size == 64
+
+
+def test_thumbnail_size_is_only_used_with_thumbnail_cache() -> None:
+    assert PairFinderOptions.from_args(
+        parse_command_line(['.', '--thumbnail-size', '128'])
+    ).thumbnail_size is None
+
+
+@pytest.mark.parametrize(
+    'algorithm', [
+        ['--algorithm', 'whash', '--hash-size', '8'], ['--algorithm', 'colorhash'],
+        ['--hash-size', '32'],
+        ['--thumbnail-size', '16'],
+        ['--hash-db', 'hashes.db', '--additional-algorithms', 'crop_resistant']
+    ]
+)
+def test_thumbnail_cache_fails_with_unsupported_algorithm(algorithm: List[str]) -> None:
+    with pytest.raises(SystemExit):
+        parse_command_line(['.', '--thumbnail-cache', 'thumbnails', *algorithm])
+
+
+def test_detect_copies() -> None:
+    assert not PairFinderOptions.from_args(parse_command_line(['.'])).detect_copies
+    assert PairFinderOptions.from_args(parse_command_line(['.', '--detect-copies'])).detect_copies
+
+
+def test_process_parallel_mode_requires_parallel() -> None:
+    assert parse_command_line(['.', '--parallel', '--parallel-mode', 'process']).parallel
+    assert not parse_command_line(['.', '--parallel-mode', 'thread']).parallel
+    with pytest.raises(SystemExit):
+        parse_command_line(['.', '--parallel-mode', 'process'])
+
+
+def test_batch_hashing() -> None:
+    args = parse_command_line(['.', '--batch-hashing', '--parallel', '--parallel-mode', 'process'])
+    assert PairFinderOptions.from_args(args).batch_hashing
+
+
+@pytest.mark.parametrize(
+    'options', [
+        ['--parallel', '--parallel-mode', 'thread'], ['--parallel-mode', 'process'],
+        ['--parallel', '--parallel-mode', 'process', '--algorithm', 'whash', '--hash-size', '8'],
+        ['--parallel', '--parallel-mode', 'process', '--hash-db', 'hashes.db',
+         '--additional-algorithms', 'colorhash']
+    ]
+)
+def test_batch_hashing_fails_with_unsupported_options(options: List[str]) -> None:
+    with pytest.raises(SystemExit):
+        parse_command_line(['.', '--batch-hashing', *options])
+
+
+def test_memory_budget() -> None:
+    assert PairFinderOptions.from_args(parse_command_line(['.'])).memory_budget is None
+    assert PairFinderOptions.from_args(
+        parse_command_line(['.', '--memory-budget', '4096'])
+    ).memory_budget == 4096
+
+
+@pytest.mark.parametrize('budget', ['0', '-1'])
+def test_memory_budget_must_be_positive(budget: str) -> None:
+    with pytest.raises(SystemExit):
+        parse_command_line(['.', '--memory-budget', budget])
+
+
+def test_new_only() -> None:
+    assert not PairFinderOptions.from_args(parse_command_line(['.'])).new_only
+    assert PairFinderOptions.from_args(
+        parse_command_line(['.', '--new-only', '--hash-db', 'hashes.json'])
+    ).new_only
+
+
+@pytest.mark.parametrize('options', [[], ['--hash-db', 'hashes.json', '--slow']])
+def test_new_only_fails_without_hash_db_or_with_slow(options: List[str]) -> None:
+    with pytest.raises(SystemExit):
+        parse_command_line(['.', '--new-only', *options])
+
+
+def test_search_index() -> None:
+    assert not PairFinderOptions.from_args(parse_command_line(['.'])).search_index
+    assert PairFinderOptions.from_args(
+        parse_command_line([
+            '.', '--search-index', '--new-only', '--hash-db', 'hashes.db', '--max-distance', '2'
+        ])
+    ).search_index
+
+
+@pytest.mark.parametrize(
+    'options', [
+        ['--new-only', '--max-distance', '2'], ['--new-only', '--hash-db', 'hashes.db'],
+        ['--hash-db', 'hashes.db', '--max-distance', '2'],
+        ['--new-only', '--hash-db', 'hashes.db', '--max-distance', '2', '--algorithm',
+         'crop_resistant']
+    ]
+)
+def test_search_index_fails_without_new_only_hash_db_and_max_distance(options: List[str]) -> None:
+    with pytest.raises(SystemExit):
+        parse_command_line(['.', '--search-index', *options])
+
+
 @pytest.fixture(name='config_file', scope='session')
 def fixture_config_file(top_directory: TemporaryDirectory) -> Path:
     config_file = Path(top_directory.name) / 'duplicate_images.cfg'
@@ -3,6 +3,7 @@ __author__ = 'Lene Preuss <lene.preuss@gmail.com>'
 
 import json
 import logging
+import os
 import pickle
 from itertools import combinations
 from pathlib import Path
@@ -11,13 +12,16 @@ from time import sleep
 from typing import List
 
 import pytest
+from imagehash import ImageHash
+from numpy import array
 
 from duplicate_images.duplicate import files_in_dirs, is_image_file
 from duplicate_images.function_types import Cache
 from duplicate_images.image_pair_finder import ImagePairFinder
 from duplicate_images.pair_finder_options import PairFinderOptions
 from duplicate_images.hash_store import (
-    PickleHashStore, JSONHashStore, FileHashStore, HashStore, NullHashStore
+    PickleHashStore, JSONHashStore, FileHashStore, HashStore, NullHashStore, SQLiteHashStore,
+    file_stat
 )
 from .conftest import MOCK_IMAGE_HASH_VALUE, mock_algorithm, create_jpg_and_png
 
@@ -29,6 +33,9 @@ DEFAULT_METADATA = {'algorithm': DEFAULT_ALGORITHM, **DEFAULT_HASH_SIZE}
 class MockHashStore(FileHashStore):  # pylint: disable=abstract-method
     def __init__(self, values: Cache) -> None:  # pylint: disable=super-init-not-called
         self.values = values
+        self.file_stats = {
+            path: stat for path in values if (stat := file_stat(path)) is not None
+        }
 
 
 def test_empty_hash_store_calculates_hash_values(
@@ -168,6 +175,76 @@ def test_hash_store_is_accessed_even_if_not_changed(
     assert hash_store_path.stat().st_atime > creation_time
 
 
+@pytest.mark.parametrize('file_type', ['pickle', 'json', 'sqlite'])
+def test_hash_store_get_returns_stored_hash_for_unchanged_file(
+        tmp_path: Path, hash_store_path: Path
+) -> None:
+    image_file = tmp_path / 'image.jpg'
+    image_file.write_bytes(b'image')
+    with FileHashStore.create(hash_store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        hash_store.add(image_file, MOCK_IMAGE_HASH_VALUE)
+    hash_store = FileHashStore.create(hash_store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+    assert hash_store.get(image_file) == MOCK_IMAGE_HASH_VALUE
+
+
+@pytest.mark.parametrize('file_type', ['pickle', 'json', 'sqlite'])
+@pytest.mark.parametrize('new_content', [b'changed image', b'image'])
+def test_hash_store_get_ignores_stored_hash_for_modified_file(
+        tmp_path: Path, hash_store_path: Path, new_content: bytes
+) -> None:
+    image_file = tmp_path / 'image.jpg'
+    image_file.write_bytes(b'image')
+    with FileHashStore.create(hash_store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        hash_store.add(image_file, MOCK_IMAGE_HASH_VALUE)
+    stat = image_file.stat()
+    image_file.write_bytes(new_content)
+    os.utime(image_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    hash_store = FileHashStore.create(hash_store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+    assert hash_store.get(image_file) is None
+
+
+@pytest.mark.parametrize('file_type', ['pickle', 'json', 'sqlite', 'dihash'])
+def test_hash_store_keeps_hashes_stored_on_opening(tmp_path: Path, hash_store_path: Path) -> None:
+    other_hash = ImageHash(array([[True, False], [False, True]]))
+    files = [tmp_path / f'image{i}.jpg' for i in range(4)]
+    for file in files:
+        file.write_bytes(b'image')
+    with FileHashStore.create(hash_store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        for file in files[:3]:
+            hash_store.add(file, MOCK_IMAGE_HASH_VALUE)
+    with FileHashStore.create(hash_store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        hash_store.add(files[0], other_hash)
+        hash_store.add(files[3], MOCK_IMAGE_HASH_VALUE)
+        if isinstance(hash_store, SQLiteHashStore):
+            hash_store.flush()
+        assert hash_store.stored_hash(files[0]) == MOCK_IMAGE_HASH_VALUE
+        assert hash_store.stored_hash(files[1]) == MOCK_IMAGE_HASH_VALUE
+        assert hash_store.stored_hash(files[3]) is None
+        assert sorted(hash_store.files_with_hash(MOCK_IMAGE_HASH_VALUE)) == [
+            hash_store.key(file) for file in files[:3]
+        ]
+        assert not hash_store.files_with_hash(other_hash)
+
+
+@pytest.mark.parametrize('file_type', ['pickle', 'json'])
+def test_hash_store_without_file_stats_is_upgraded(tmp_path: Path, hash_store_path: Path) -> None:
+    image_file = tmp_path / 'image.jpg'
+    image_file.write_bytes(b'image')
+    if hash_store_path.suffix == '.pickle':
+        with hash_store_path.open('wb') as file:
+            pickle.dump(({image_file: MOCK_IMAGE_HASH_VALUE}, DEFAULT_METADATA), file)
+    else:
+        with hash_store_path.open('w') as file:
+            json.dump(({str(image_file): str(MOCK_IMAGE_HASH_VALUE)}, DEFAULT_METADATA), file)
+    hash_store_class = PickleHashStore if hash_store_path.suffix == '.pickle' else JSONHashStore
+    with hash_store_class(hash_store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        assert hash_store.dirty
+        assert hash_store.get(image_file) == MOCK_IMAGE_HASH_VALUE
+    hash_store = hash_store_class(hash_store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+    assert not hash_store.dirty
+    assert hash_store.file_stats == {image_file: file_stat(image_file)}
+
+
 def image_list(top_directory: TemporaryDirectory) -> List[Path]:
     return sorted(files_in_dirs([top_directory.name], is_relevant=is_image_file))
 
@@ -0,0 +1,151 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from unittest.mock import Mock
+
+import pytest
+from imagehash import ImageHash
+from numpy.random import default_rng
+
+from duplicate_images.search_index import SearchIndex, index_path
+
+METADATA = {'algorithm': 'phash', 'hash_size': 8, 'max_distance': 4}
+STORE_STAT = (1000, 1, 1)
+
+
+def random_hashes(num_hashes: int, shape: tuple = (8, 8)) -> Dict[Path, ImageHash]:
+    rng = default_rng(num_hashes)
+    return {
+        Path(f'/images/image{i:04d}.jpg'): ImageHash(rng.random(shape) > 0.5)
+        for i in range(num_hashes)
+    }
+
+
+def open_index(
+        tmp_path: Path, hashes: Dict[Path, ImageHash], metadata: Optional[Dict] = None,
+        store_stat: Optional[Tuple[int, int, int]] = STORE_STAT
+) -> Tuple[SearchIndex, Mock]:
+    stored_hashes = Mock(return_value=list(hashes.items()))
+    index = SearchIndex(
+        tmp_path / 'hashes.index', metadata or METADATA, store_stat, stored_hashes
+    )
+    return index, stored_hashes
+
+
+def written_index(tmp_path: Path, hashes: Dict[Path, ImageHash]) -> SearchIndex:
+    index, _ = open_index(tmp_path, hashes)
+    index.write(STORE_STAT)
+    return index
+
+
+def brute_force_similar(
+        hashes: Dict[Path, ImageHash], searched: List[ImageHash], max_distance: int
+) -> Dict[Path, ImageHash]:
+    return {
+        file: image_hash for file, image_hash in hashes.items()
+        if any(image_hash - other <= max_distance for other in searched)
+    }
+
+
+def test_index_path_is_next_to_store() -> None:
+    assert index_path(Path('/data/hashes.sqlite')) == Path('/data/hashes.sqlite.index')
+
+
+@pytest.mark.parametrize('shape', [(8, 8), (16, 16), (14, 3)])
+@pytest.mark.parametrize('max_distance', [0, 2, 8])
+def test_similar_finds_same_hashes_as_brute_force(
+        tmp_path: Path, shape: tuple, max_distance: int
+) -> None:
+    hashes = random_hashes(500, shape)
+    searched = list(random_hashes(20, shape).values())
+    # hashes close to the stored ones, so that there are matches for small distances
+    searched += [ImageHash(~image_hash.hash) for image_hash in list(hashes.values())[:5]]
+    searched += list(hashes.values())[100:105]
+    written_index(tmp_path, hashes)
+    index, _ = open_index(tmp_path, hashes, {**METADATA, 'max_distance': max_distance})
+    expected = brute_force_similar(hashes, searched, max_distance)
+    assert index.similar(searched, max_distance) == expected
+    assert expected
+
+
+def test_reopened_index_is_not_rebuilt(tmp_path: Path) -> None:
+    hashes = random_hashes(100)
+    written_index(tmp_path, hashes)
+    index, stored_hashes = open_index(tmp_path, hashes)
+    stored_hashes.assert_not_called()
+    assert dict(index.items()) == hashes
+
+
+@pytest.mark.parametrize(
+    'metadata,store_stat', [
+        ({**METADATA, 'hash_size': 16}, STORE_STAT), ({**METADATA, 'max_distance': 5}, STORE_STAT),
+        (METADATA, (1001, 1, 1)), (METADATA, None)
+    ]
+)
+def test_outdated_index_is_rebuilt(
+        tmp_path: Path, metadata: Dict, store_stat: Optional[Tuple[int, int, int]]
+) -> None:
+    hashes = random_hashes(100)
+    written_index(tmp_path, hashes)
+    _, stored_hashes = open_index(tmp_path, hashes, metadata, store_stat)
+    stored_hashes.assert_called_once()
+
+
+def test_corrupt_index_is_rebuilt(tmp_path: Path) -> None:
+    hashes = random_hashes(100)
+    (tmp_path / 'hashes.index').write_bytes(b'garbage')
+    index, stored_hashes = open_index(tmp_path, hashes)
+    stored_hashes.assert_called_once()
+    assert dict(index.items()) == hashes
+
+
+def test_added_hashes_are_merged_on_write(tmp_path: Path) -> None:
+    hashes = random_hashes(100)
+    index = written_index(tmp_path, dict(list(hashes.items())[:50]))
+    changed = {file: ImageHash(~image_hash.hash) for file, image_hash in list(hashes.items())[:5]}
+    for file, image_hash in {**dict(list(hashes.items())[50:]), **changed}.items():
+        index.add(file, image_hash)
+    index.write(STORE_STAT)
+    reopened, stored_hashes = open_index(tmp_path, {})
+    stored_hashes.assert_not_called()
+    assert dict(reopened.items()) == {**hashes, **changed}
+    searched = list(random_hashes(10).values()) + list(changed.values())
+    assert reopened.similar(searched, 4) == brute_force_similar({**hashes, **changed}, searched, 4)
+
+
+def test_unchanged_index_is_not_written(tmp_path: Path) -> None:
+    written_index(tmp_path, random_hashes(10))
+    modified = (tmp_path / 'hashes.index').stat().st_mtime_ns
+    index, _ = open_index(tmp_path, {})
+    index.write(STORE_STAT)
+    assert (tmp_path / 'hashes.index').stat().st_mtime_ns == modified
+
+
+def test_popped_hashes_are_left_out_of_mapping_but_kept_in_index(tmp_path: Path) -> None:
+    hashes = random_hashes(10)
+    file, image_hash = next(iter(hashes.items()))
+    index, _ = open_index(tmp_path, hashes)
+    assert index.pop(file) == image_hash
+    assert index.pop(file) is None
+    assert file not in index
+    assert index.get(file) is None
+    assert len(index) == len(hashes) - 1
+    assert file not in index.similar([image_hash], 0)
+    index.write(STORE_STAT)
+    assert open_index(tmp_path, {})[0].get(file) == image_hash
+
+
+def test_empty_index(tmp_path: Path) -> None:
+    written_index(tmp_path, {})
+    index, stored_hashes = open_index(tmp_path, {})
+    stored_hashes.assert_not_called()
+    assert not index
+    assert not index.similar(list(random_hashes(3).values()), 4)
+
+
+def test_variable_width_hashes_are_not_indexed(tmp_path: Path) -> None:
+    index, _ = open_index(tmp_path, {})
+    with pytest.raises(ValueError):
+        index.add(Path('/images/image.jpg'), Mock())
@@ -0,0 +1,189 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+import sqlite3
+from pathlib import Path
+from typing import List
+
+import pytest
+from imagehash import ImageHash
+from numpy import array
+
+from duplicate_images.hash_store import FileHashStore, SQLiteHashStore
+from .conftest import MOCK_IMAGE_HASH_VALUE
+
+DEFAULT_ALGORITHM = 'phash'
+DEFAULT_HASH_SIZE = {'hash_size': 8}
+OTHER_IMAGE_HASH_VALUE = ImageHash(array([[True, False], [False, True]]))
+
+
+@pytest.fixture(name='sample_files')
+def fixture_sample_files(tmp_path: Path) -> List[Path]:
+    files = [tmp_path / f'image{i}.jpg' for i in range(5)]
+    for i, file in enumerate(files):
+        file.write_bytes(bytes(i))
+    return files
+
+
+def stored_paths(store_path: Path) -> List[str]:
+    with sqlite3.connect(store_path) as connection:
+        return [row[0] for row in connection.execute('SELECT path FROM hashes ORDER BY path')]
+
+
+@pytest.mark.parametrize('suffix', ['.sqlite', '.db'])
+def test_create_selects_sqlite_store(tmp_path: Path, suffix: str) -> None:
+    with FileHashStore.create(
+            tmp_path / f'hashes{suffix}', DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE
+    ) as hash_store:
+        assert isinstance(hash_store, SQLiteHashStore)
+
+
+def test_stored_hashes_are_read_back(tmp_path: Path, sample_files: List[Path]) -> None:
+    store_path = tmp_path / 'hashes.sqlite'
+    with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        for file in sample_files:
+            hash_store.add(file, MOCK_IMAGE_HASH_VALUE)
+    with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        assert len(hash_store) == len(sample_files)
+        for file in sample_files:
+            assert hash_store.get(file) == MOCK_IMAGE_HASH_VALUE
+        assert hash_store.get(sample_files[0].parent / 'other.jpg') is None
+
+
+def test_pending_hashes_are_found_before_written(
+        tmp_path: Path, sample_files: List[Path]
+) -> None:
+    store_path = tmp_path / 'hashes.sqlite'
+    with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        hash_store.add(sample_files[0], MOCK_IMAGE_HASH_VALUE)
+        assert not stored_paths(store_path)
+        assert hash_store.get(sample_files[0]) == MOCK_IMAGE_HASH_VALUE
+
+
+def test_items_are_written_and_pending_hashes(tmp_path: Path, sample_files: List[Path]) -> None:
+    store_path = tmp_path / 'hashes.sqlite'
+    with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        hash_store.add(sample_files[0], MOCK_IMAGE_HASH_VALUE)
+    with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        hash_store.add(sample_files[1], OTHER_IMAGE_HASH_VALUE)
+        hash_store.for_algorithm('ahash', DEFAULT_HASH_SIZE).add(
+            sample_files[2], MOCK_IMAGE_HASH_VALUE
+        )
+        assert dict(hash_store.items()) == {
+            sample_files[0]: MOCK_IMAGE_HASH_VALUE, sample_files[1]: OTHER_IMAGE_HASH_VALUE
+        }
+
+
+def test_hashes_are_written_in_batches(
+        tmp_path: Path, sample_files: List[Path], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(SQLiteHashStore, 'BATCH_SIZE', 2)
+    store_path = tmp_path / 'hashes.sqlite'
+    with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        for file in sample_files:
+            hash_store.add(file, MOCK_IMAGE_HASH_VALUE)
+        assert len(stored_paths(store_path)) == 4
+    assert len(stored_paths(store_path)) == 5
+
+
+def test_hashes_are_kept_after_keyboard_interrupt(
+        tmp_path: Path, sample_files: List[Path]
+) -> None:
+    store_path = tmp_path / 'hashes.sqlite'
+    with pytest.raises(KeyboardInterrupt):
+        with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+            hash_store.add(sample_files[0], MOCK_IMAGE_HASH_VALUE)
+            raise KeyboardInterrupt('User interrupted')
+    assert stored_paths(store_path) == [str(sample_files[0].resolve())]
+
+
+@pytest.mark.parametrize(
+    'algorithm,hash_size_kwargs',
+    [('ahash', DEFAULT_HASH_SIZE), (DEFAULT_ALGORITHM, {'hash_size': 16})]
+)
+def test_other_algorithms_are_stored_separately(
+        tmp_path: Path, sample_files: List[Path], algorithm: str, hash_size_kwargs: dict
+) -> None:
+    store_path = tmp_path / 'hashes.sqlite'
+    with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        hash_store.add(sample_files[0], MOCK_IMAGE_HASH_VALUE)
+    with SQLiteHashStore(store_path, algorithm, hash_size_kwargs) as hash_store:
+        assert len(hash_store) == 0
+        assert hash_store.get(sample_files[0]) is None
+        hash_store.add(sample_files[0], OTHER_IMAGE_HASH_VALUE)
+    with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        assert hash_store.get(sample_files[0]) == MOCK_IMAGE_HASH_VALUE
+        assert hash_store.for_algorithm(algorithm, hash_size_kwargs).get(
+            sample_files[0]
+        ) == OTHER_IMAGE_HASH_VALUE
+
+
+def test_hashes_for_other_algorithm_are_written(
+        tmp_path: Path, sample_files: List[Path]
+) -> None:
+    store_path = tmp_path / 'hashes.sqlite'
+    with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        other_hashes = hash_store.for_algorithm('dhash', DEFAULT_HASH_SIZE)
+        for file in sample_files:
+            other_hashes.add(file, OTHER_IMAGE_HASH_VALUE)
+        assert other_hashes.get(sample_files[0]) == OTHER_IMAGE_HASH_VALUE
+        assert hash_store.get(sample_files[0]) is None
+    with SQLiteHashStore(store_path, 'dhash', DEFAULT_HASH_SIZE) as hash_store:
+        assert len(hash_store) == len(sample_files)
+        assert all(hash_store.get(file) == OTHER_IMAGE_HASH_VALUE for file in sample_files)
+
+
+@pytest.mark.parametrize('file_type', ['json', 'pickle', 'dihash'])
+def test_other_stores_hold_only_one_algorithm(tmp_path: Path, file_type: str) -> None:
+    with FileHashStore.create(
+            tmp_path / f'hashes.{file_type}', DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE
+    ) as hash_store:
+        with pytest.raises(ValueError, match='only store hashes for one algorithm'):
+            hash_store.for_algorithm('dhash', DEFAULT_HASH_SIZE)
+
+
+def test_database_of_other_layout_raises_error(tmp_path: Path) -> None:
+    store_path = tmp_path / 'hashes.db'
+    with sqlite3.connect(store_path) as connection:
+        connection.execute('CREATE TABLE hashes (path TEXT PRIMARY KEY, hash BLOB)')
+    with pytest.raises(ValueError, match='Not an SQLite hash database'):
+        SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+
+
+def test_invalid_database_raises_error(tmp_path: Path) -> None:
+    store_path = tmp_path / 'hashes.db'
+    store_path.write_text('not a database' * 100)
+    with pytest.raises(ValueError, match='Not an SQLite hash database'):
+        SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE)
+
+
+def test_database_without_hash_index_is_upgraded(
+        tmp_path: Path, sample_files: List[Path]
+) -> None:
+    store_path = tmp_path / 'hashes.db'
+    with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        for file in sample_files:
+            hash_store.add(file, MOCK_IMAGE_HASH_VALUE)
+    with sqlite3.connect(store_path) as connection:
+        connection.execute('DROP INDEX hashes_by_hash')
+        connection.execute('ALTER TABLE hashes DROP COLUMN hash_key')
+    with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        assert sorted(hash_store.files_with_hash(MOCK_IMAGE_HASH_VALUE)) == [
+            file.resolve() for file in sample_files
+        ]
+        assert not hash_store.files_with_hash(OTHER_IMAGE_HASH_VALUE)
+
+
+def test_files_with_hash_are_found_for_other_algorithm(
+        tmp_path: Path, sample_files: List[Path]
+) -> None:
+    store_path = tmp_path / 'hashes.db'
+    with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        hash_store.for_algorithm('dhash', DEFAULT_HASH_SIZE).add(
+            sample_files[0], OTHER_IMAGE_HASH_VALUE
+        )
+    with SQLiteHashStore(store_path, DEFAULT_ALGORITHM, DEFAULT_HASH_SIZE) as hash_store:
+        other_hashes = hash_store.for_algorithm('dhash', DEFAULT_HASH_SIZE)
+        assert other_hashes.files_with_hash(OTHER_IMAGE_HASH_VALUE) == [sample_files[0].resolve()]
+        assert other_hashes.stored_hash(sample_files[0]) == OTHER_IMAGE_HASH_VALUE
+        assert not hash_store.files_with_hash(OTHER_IMAGE_HASH_VALUE)
@@ -0,0 +1,154 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from pathlib import Path
+from typing import Dict, List
+
+import numpy
+import pytest
+from numpy.random import default_rng
+
+from duplicate_images.thumbnail_cache import NullThumbnailCache, ThumbnailCache
+
+SIZE = 16
+
+
+@pytest.fixture(name='sample_files')
+def fixture_sample_files(tmp_path: Path) -> List[Path]:
+    files = [tmp_path / f'image{i}.jpg' for i in range(10)]
+    for i, file in enumerate(files):
+        file.write_bytes(bytes(i))
+    return files
+
+
+def random_thumbnails(files: List[Path]) -> Dict[Path, numpy.ndarray]:
+    rng = default_rng(len(files))
+    return {file: rng.integers(0, 256, (SIZE, SIZE), dtype=numpy.uint8) for file in files}
+
+
+def create_cache(cache_path: Path, thumbnails: Dict[Path, numpy.ndarray]) -> None:
+    with ThumbnailCache(cache_path, SIZE) as cache:
+        for file, thumbnail in thumbnails.items():
+            cache.add(file, thumbnail)
+
+
+def assert_cached(cache: ThumbnailCache, thumbnails: Dict[Path, numpy.ndarray]) -> None:
+    for file, thumbnail in thumbnails.items():
+        cached = cache.get(file)
+        assert cached is not None
+        assert numpy.array_equal(cached, thumbnail)
+
+
+def test_create_selects_cache(tmp_path: Path) -> None:
+    assert isinstance(ThumbnailCache.create(None, SIZE), NullThumbnailCache)
+    assert isinstance(ThumbnailCache.create(tmp_path / 'thumbnails', SIZE), ThumbnailCache)
+
+
+def test_stored_thumbnails_are_read_back(tmp_path: Path, sample_files: List[Path]) -> None:
+    thumbnails = random_thumbnails(sample_files)
+    create_cache(tmp_path / 'thumbnails', thumbnails)
+    cache = ThumbnailCache(tmp_path / 'thumbnails', SIZE)
+    assert len(cache) == len(sample_files)
+    assert_cached(cache, thumbnails)
+
+
+def test_thumbnails_are_appended(tmp_path: Path, sample_files: List[Path]) -> None:
+    thumbnails = random_thumbnails(sample_files)
+    create_cache(tmp_path / 'thumbnails', dict(list(thumbnails.items())[:5]))
+    create_cache(tmp_path / 'thumbnails', dict(list(thumbnails.items())[5:]))
+    cache = ThumbnailCache(tmp_path / 'thumbnails', SIZE)
+    assert_cached(cache, thumbnails)
+    assert (tmp_path / 'thumbnails').stat().st_size == len(sample_files) * SIZE * SIZE
+
+
+def test_thumbnail_of_changed_file_is_not_used(tmp_path: Path, sample_files: List[Path]) -> None:
+    create_cache(tmp_path / 'thumbnails', random_thumbnails(sample_files))
+    sample_files[0].write_bytes(b'changed contents')
+    cache = ThumbnailCache(tmp_path / 'thumbnails', SIZE)
+    assert cache.get(sample_files[0]) is None
+    assert cache.get(sample_files[1]) is not None
+
+
+def test_missing_file_has_no_thumbnail(tmp_path: Path, sample_files: List[Path]) -> None:
+    create_cache(tmp_path / 'thumbnails', random_thumbnails(sample_files))
+    cache = ThumbnailCache(tmp_path / 'thumbnails', SIZE)
+    sample_files[0].unlink()
+    assert cache.get(sample_files[0]) is None
+    assert cache.get(tmp_path / 'missing.jpg') is None
+
+
+def test_empty_cache_has_no_thumbnails(tmp_path: Path, sample_files: List[Path]) -> None:
+    cache = ThumbnailCache(tmp_path / 'thumbnails', SIZE)
+    assert cache.get(sample_files[0]) is None
+    assert cache.get(tmp_path / 'missing.jpg') is None
+
+
+def test_pending_thumbnails_are_found(tmp_path: Path, sample_files: List[Path]) -> None:
+    thumbnails = random_thumbnails(sample_files)
+    with ThumbnailCache(tmp_path / 'thumbnails', SIZE) as cache:
+        cache.add(sample_files[0], thumbnails[sample_files[0]])
+        assert_cached(cache, {sample_files[0]: thumbnails[sample_files[0]]})
+        assert cache.get(sample_files[1]) is None
+
+
+def test_thumbnail_of_wrong_size_is_rejected(tmp_path: Path, sample_files: List[Path]) -> None:
+    with ThumbnailCache(tmp_path / 'thumbnails', SIZE) as cache:
+        with pytest.raises(ValueError):
+            cache.add(sample_files[0], numpy.zeros((SIZE, SIZE + 1), dtype=numpy.uint8))
+
+
+def test_cache_with_other_size_is_rejected(tmp_path: Path, sample_files: List[Path]) -> None:
+    create_cache(tmp_path / 'thumbnails', random_thumbnails(sample_files))
+    with pytest.raises(ValueError, match='size mismatch'):
+        ThumbnailCache(tmp_path / 'thumbnails', 2 * SIZE)
+
+
+def test_partial_row_is_overwritten(tmp_path: Path, sample_files: List[Path]) -> None:
+    thumbnails = random_thumbnails(sample_files)
+    create_cache(tmp_path / 'thumbnails', dict(list(thumbnails.items())[:5]))
+    with (tmp_path / 'thumbnails').open('ab') as cache_file:
+        cache_file.write(b'interrupted')
+    create_cache(tmp_path / 'thumbnails', dict(list(thumbnails.items())[5:]))
+    cache = ThumbnailCache(tmp_path / 'thumbnails', SIZE)
+    assert_cached(cache, thumbnails)
+
+
+def test_rows_missing_from_thumbnail_file_are_ignored(
+        tmp_path: Path, sample_files: List[Path]
+) -> None:
+    create_cache(tmp_path / 'thumbnails', random_thumbnails(sample_files))
+    (tmp_path / 'thumbnails').unlink()
+    cache = ThumbnailCache(tmp_path / 'thumbnails', SIZE)
+    assert len(cache) == 0
+    assert cache.get(sample_files[0]) is None
+
+
+def test_thumbnails_are_written_in_batches(
+        tmp_path: Path, sample_files: List[Path], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(ThumbnailCache, 'FLUSH_ENTRIES', 2)
+    thumbnails = random_thumbnails(sample_files[:5])
+    cache = ThumbnailCache(tmp_path / 'thumbnails', SIZE)
+    for file, thumbnail in thumbnails.items():
+        cache.add(file, thumbnail)
+    assert len(cache.pending) == 1
+    reopened = ThumbnailCache(tmp_path / 'thumbnails', SIZE)
+    assert len(reopened) == 4
+    assert_cached(reopened, dict(list(thumbnails.items())[:4]))
+
+
+def test_index_interval_grows_with_cache_size(
+        tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    files = [tmp_path / f'image{i}.jpg' for i in range(22)]
+    for file in files:
+        file.write_bytes(b'image')
+    thumbnails = random_thumbnails(files)
+    create_cache(tmp_path / 'thumbnails', dict(list(thumbnails.items())[:20]))
+    monkeypatch.setattr(ThumbnailCache, 'FLUSH_ENTRIES', 1)
+    cache = ThumbnailCache(tmp_path / 'thumbnails', SIZE)
+    cache.add(files[20], thumbnails[files[20]])
+    assert not cache.pending
+    assert len(ThumbnailCache(tmp_path / 'thumbnails', SIZE)) == 20
+    cache.add(files[21], thumbnails[files[21]])
+    assert_cached(ThumbnailCache(tmp_path / 'thumbnails', SIZE), thumbnails)
@@ -0,0 +1,52 @@
+# pylint: disable=missing-docstring
+__author__ = 'Lene Preuss <lene.preuss@gmail.com>'
+
+from duplicate_images.union_find import (
+    LINKAGE, UnionFind, complete_linkage, connected_components
+)
+
+
+def test_single_items_are_not_components() -> None:
+    assert not UnionFind(5).components()
+
+
+def test_union_merges_sets() -> None:
+    union_find = UnionFind(6)
+    union_find.union(4, 1)
+    union_find.union(2, 5)
+    union_find.union(1, 5)
+    assert union_find.find(1) == union_find.find(2)
+    assert union_find.find(0) != union_find.find(1)
+    assert union_find.components() == [[1, 2, 4, 5]]
+
+
+def test_union_of_same_set_changes_nothing() -> None:
+    union_find = UnionFind(3)
+    union_find.union(0, 1)
+    union_find.union(1, 0)
+    assert union_find.components() == [[0, 1]]
+    assert union_find.set_size[union_find.find(0)] == 2
+
+
+def test_connected_components_are_ordered_by_smallest_item() -> None:
+    assert connected_components(8, [(5, 7), (1, 6), (0, 5), (2, 3)]) == [
+        [0, 5, 7], [1, 6], [2, 3]
+    ]
+
+
+def test_chain_is_one_component() -> None:
+    pairs = [(index, index + 1) for index in range(999)]
+    assert connected_components(1000, reversed(pairs)) == [list(range(1000))]
+
+
+def test_complete_linkage_splits_chain() -> None:
+    # 0 - 1 - 2 - 3, but 0 and 2, 1 and 3 are not similar
+    def are_similar(item: int, other: int) -> bool:
+        return abs(item - other) <= 1
+
+    assert complete_linkage([0, 1, 2, 3], are_similar) == [[0, 1], [2, 3]]
+    assert LINKAGE['single']([0, 1, 2, 3], are_similar) == [[0, 1, 2, 3]]
+
+
+def test_complete_linkage_drops_single_items() -> None:
+    assert complete_linkage([0, 1, 2], lambda item, other: {item, other} == {0, 2}) == [[0, 2]]